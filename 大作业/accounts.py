@@ -0,0 +1,52 @@
+"""账号批量导入/导出
+
+导入文件每行一个账号，带明文 password（导入时并行哈希）或 password_hash（如本工具导出的文件）。
+CSV 第一行为表头: username,password 或 username,password_hash,register_time,last_login
+
+用法:
+    python accounts.py import new_users.csv
+    python accounts.py import backup.jsonl --overwrite
+    python accounts.py export backup.jsonl
+    python accounts.py export - --format csv
+"""
+import argparse
+import sys
+import time
+from storage import ACCOUNT_FORMATS
+from user_manager import UserManager
+
+ERRORS_SHOWN = 20  # 最多列出的错误行数
+
+
+def main():
+    parser = argparse.ArgumentParser(description="账号批量导入/导出（CSV 或 JSONL）")
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('path', help="账号文件，导出时 - 表示标准输出")
+    parser.add_argument('--format', choices=ACCOUNT_FORMATS, help="默认按扩展名判断")
+    parser.add_argument('--overwrite', action='store_true', help="导入时覆盖同名账号，默认跳过")
+    args = parser.parse_args()
+
+    manager = UserManager()
+    started = time.perf_counter()
+    try:
+        if args.action == 'import':
+            imported, errors = manager.import_file(args.path, args.format, args.overwrite)
+            for line_no, username, reason in errors[:ERRORS_SHOWN]:
+                print(f"第 {line_no} 行 {username or ''}: {reason}", file=sys.stderr)
+            if len(errors) > ERRORS_SHOWN:
+                print(f"... 共 {len(errors)} 行有错误", file=sys.stderr)
+            print(f"已导入 {imported} 个账号，跳过 {len(errors)} 行，用时 {time.perf_counter() - started:.1f} 秒",
+                  file=sys.stderr)
+        else:
+            count = manager.export_file(args.path, args.format)
+            print(f"已导出 {count} 个账号，用时 {time.perf_counter() - started:.1f} 秒", file=sys.stderr)
+    except (OSError, ValueError) as e:
+        print(f"{args.action} 失败: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        manager.hasher.shutdown()
+        manager.storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""广播延迟对比：逐个阻塞发送 vs 每连接发送队列 vs 发送队列 + 送达序号（含部分慢速读者）
+
+用法: python bench_broadcast.py --recipients 1000 --slow 20 --messages 200
+"""
+import argparse
+import os
+import selectors
+import socket
+import tempfile
+import threading
+import time
+from connection import ClientConnection
+from delivery import DeliveryWindow
+from protocol import FrameDecoder, decode_payload, encode_message
+
+
+def make_pairs(count, slow):
+    """创建 socketpair：服务端一侧发送，客户端一侧读取；慢速读者的缓冲区调小"""
+    pairs = []
+    for i in range(count):
+        server_side, client_side = socket.socketpair()
+        if i < slow:
+            server_side.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            client_side.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        pairs.append((server_side, client_side))
+    return pairs
+
+
+def fast_reader(sockets, expected, latencies, done):
+    """单线程读取所有正常客户端，记录每条消息的送达延迟"""
+    selector = selectors.DefaultSelector()
+    for s in sockets:
+        s.setblocking(False)
+        selector.register(s, selectors.EVENT_READ, FrameDecoder())
+    received = 0
+    while received < expected and not done.is_set():
+        for key, _ in selector.select(timeout=0.5):
+            try:
+                data = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            now = time.perf_counter()
+            for payload in key.data.feed(data):
+                message = decode_payload(payload)
+                latencies.append(now - message['sent_at'])
+                received += 1
+    selector.close()
+
+
+def slow_reader(sockets, done):
+    """慢速读者：每 50ms 每个连接只读 256 字节"""
+    for s in sockets:
+        s.setblocking(False)
+    while not done.is_set():
+        for s in sockets:
+            try:
+                s.recv(256)
+            except (BlockingIOError, OSError):
+                pass
+        time.sleep(0.05)
+
+
+def broadcast_direct(server_sockets, message):
+    """旧实现：发送方线程上逐个接收者编码并阻塞发送"""
+    for s in server_sockets:
+        s.sendall(encode_message(message))
+
+
+def run(mode, recipients, slow, messages, interval):
+    pairs = make_pairs(recipients, slow)
+    fast_clients = [c for _, c in pairs[slow:]]
+    slow_clients = [c for _, c in pairs[:slow]]
+    latencies = []
+    done = threading.Event()
+
+    reader = threading.Thread(target=fast_reader,
+                              args=(fast_clients, len(fast_clients) * messages, latencies, done))
+    slow = threading.Thread(target=slow_reader, args=(slow_clients, done))
+    reader.start()
+    slow.start()
+
+    server = None
+    if mode in ('queued', 'acked'):
+        from server import ChatServer
+        server = ChatServer()
+        server.writer.start()
+        for i, (server_side, _) in enumerate(pairs):
+            conn = ClientConnection(server_side, ('bench', i), server.writer, overflow_policy='drop')
+            if mode == 'acked':
+                conn.delivery = DeliveryWindow()
+            server.clients.add(f'user{i}', conn)
+
+    call_times = []
+    padding = 'x' * 200
+    for seq in range(messages):
+        message = {'type': 'chat_message', 'username': 'bench', 'content': padding,
+                   'seq': seq, 'sent_at': time.perf_counter()}
+        start = time.perf_counter()
+        if server:
+            server.broadcast_message(message)
+        else:
+            broadcast_direct([s for s, _ in pairs], message)
+        call_times.append(time.perf_counter() - start)
+        time.sleep(interval)
+
+    reader.join(timeout=30)
+    done.set()
+    slow.join()
+    for server_side, client_side in pairs:
+        server_side.close()
+        client_side.close()
+
+    latencies.sort()
+    call_times.sort()
+
+    def pct(values, p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float('nan')
+
+    return {
+        'mode': mode,
+        'delivered': len(latencies),
+        'expected': len(fast_clients) * messages,
+        'call_p50': pct(call_times, 0.5),
+        'call_max': call_times[-1] * 1000,
+        'lat_p50': pct(latencies, 0.5),
+        'lat_p99': pct(latencies, 0.99),
+        'lat_max': latencies[-1] * 1000 if latencies else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="广播延迟对比")
+    parser.add_argument('--recipients', type=int, default=1000)
+    parser.add_argument('--slow', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.03)
+    args = parser.parse_args()
+
+    # ChatServer 会在当前目录读写 users.json，放到临时目录里
+    os.chdir(tempfile.mkdtemp(prefix='chat_bench_'))
+
+    print(f"{args.recipients} 个接收者，其中 {args.slow} 个慢速读者，{args.messages} 条广播")
+    print(f"{'模式':<8}{'送达/应送达':>16}{'调用p50(ms)':>14}{'调用max(ms)':>14}"
+          f"{'延迟p50(ms)':>14}{'延迟p99(ms)':>14}{'延迟max(ms)':>14}")
+    for mode in ('direct', 'queued', 'acked'):
+        r = run(mode, args.recipients, args.slow, args.messages, args.interval)
+        print(f"{r['mode']:<8}{r['delivered']:>8}/{r['expected']:<8}{r['call_p50']:>14.2f}"
+              f"{r['call_max']:>14.2f}{r['lat_p50']:>14.2f}{r['lat_p99']:>14.2f}{r['lat_max']:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
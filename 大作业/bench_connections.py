@@ -0,0 +1,114 @@
+"""连接数与服务器内存/CPU 对比（thread 模式 vs asyncio 模式，仅 Linux）
+
+用法: python bench_connections.py --connections 500 1000 2000
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from protocol import encode_message
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def read_proc_stats(pid):
+    """读取进程 RSS(KB)、线程数和 CPU 时间(秒)"""
+    rss_kb = threads = 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss_kb = int(line.split()[1])
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK
+    return rss_kb, threads, cpu
+
+
+def wait_for_server(port, timeout=10):
+    """等待服务器开始监听"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def request_round(sockets, payload):
+    """每个连接发送一次请求并等待响应"""
+    for s in sockets:
+        s.sendall(payload)
+    for s in sockets:
+        s.recv(65536)
+
+
+def run_mode(mode, connections, rounds, port):
+    """启动指定模式的服务器并测量"""
+    workdir = tempfile.mkdtemp(prefix='chat_bench_')
+    proc = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT, '--mode', mode, '--port', str(port), '--metrics-port', '0'],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    sockets = []
+    try:
+        if not wait_for_server(port):
+            raise RuntimeError(f"{mode} 模式服务器未能启动")
+        base_rss, _, _ = read_proc_stats(proc.pid)
+
+        for _ in range(connections):
+            sockets.append(socket.create_connection(('localhost', port)))
+        payload = encode_message({'type': 'get_user_list'})
+        request_round(sockets, payload)
+        time.sleep(0.5)
+        rss, threads, cpu_before = read_proc_stats(proc.pid)
+
+        start = time.time()
+        for _ in range(rounds):
+            request_round(sockets, payload)
+        elapsed = time.time() - start
+        _, _, cpu_after = read_proc_stats(proc.pid)
+
+        requests = connections * rounds
+        return {
+            'mode': mode,
+            'connections': connections,
+            'rss_mb': rss / 1024,
+            'rss_per_conn_kb': (rss - base_rss) / connections,
+            'threads': threads,
+            'cpu_us_per_req': (cpu_after - cpu_before) / requests * 1e6,
+            'req_per_sec': requests / elapsed,
+        }
+    finally:
+        for s in sockets:
+            s.close()
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="连接数与内存/CPU 对比")
+    parser.add_argument('--connections', type=int, nargs='+', default=[100, 500, 1000, 2000])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--port', type=int, default=18888)
+    args = parser.parse_args()
+
+    print(f"{'模式':<8}{'连接数':>8}{'RSS(MB)':>10}{'KB/连接':>10}{'线程数':>8}"
+          f"{'CPU us/请求':>14}{'请求/秒':>10}")
+    for connections in args.connections:
+        for mode in ('thread', 'asyncio'):
+            r = run_mode(mode, connections, args.rounds, args.port)
+            print(f"{r['mode']:<8}{r['connections']:>8}{r['rss_mb']:>10.1f}"
+                  f"{r['rss_per_conn_kb']:>10.1f}{r['threads']:>8}"
+                  f"{r['cpu_us_per_req']:>14.1f}{r['req_per_sec']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""JSON 与紧凑二进制编码对比：每条消息的线上字节数与编解码 CPU 时间
+
+用法: python bench_encoding.py --count 20000
+"""
+import argparse
+import time
+from protocol import FRAME_HEADER, decode_payload, get_codec
+
+SAMPLES = {
+    '短聊天': {'type': 'chat_message', 'id': 123456, 'username': 'student01',
+              'content': '今天的作业交了吗？', 'timestamp': 1762862076.123456},
+    '长聊天': {'type': 'chat_message', 'id': 123457, 'username': 'student02',
+              'content': '这是一段比较长的聊天内容，用来观察压缩效果。' * 40,
+              'timestamp': 1762862077.654321},
+    '上线': {'type': 'user_joined', 'username': 'student03', 'seq': 4821,
+             'timestamp': 1762862078.5},
+}
+
+CODECS = [
+    ('json', None),
+    ('json', 'zlib'),
+    ('binary', None),
+    ('binary', 'zlib'),
+]
+
+
+def measure(codec, message, count):
+    """返回 (帧字节数, 编码us/条, 解码us/条)"""
+    frame = codec.encode(message)
+    payload = frame[FRAME_HEADER.size:]
+    assert decode_payload(payload)['type'] == message['type']
+
+    start = time.perf_counter()
+    for _ in range(count):
+        codec.encode(message)
+    encode_us = (time.perf_counter() - start) / count * 1e6
+
+    start = time.perf_counter()
+    for _ in range(count):
+        decode_payload(payload)
+    decode_us = (time.perf_counter() - start) / count * 1e6
+
+    return len(frame), encode_us, decode_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description="编码对比")
+    parser.add_argument('--count', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'消息':<6}{'编码':<14}{'字节':>8}{'编码us':>10}{'解码us':>10}")
+    for name, message in SAMPLES.items():
+        for encoding, compression in CODECS:
+            codec = get_codec(encoding, compression)
+            size, encode_us, decode_us = measure(codec, message, args.count)
+            label = encoding + ('+' + compression if compression else '')
+            print(f"{name:<6}{label:<14}{size:>8}{encode_us:>10.2f}{decode_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""在线连接表对比：不加锁的 dict / 全局锁 / 写时复制快照（高频登录下线 + 并发广播）
+
+广播线程反复遍历整个连接表（每个接收者做一次入队），churn 线程不断移除并重新登记随机用户。
+用法: python bench_registry.py --users 5000 --churn-threads 4 --churn-rate 0 --broadcasters 4 --duration 5
+"""
+import argparse
+import random
+import threading
+import time
+from collections import deque
+
+from registry import ClientRegistry
+
+
+class PlainRegistry:
+    """原实现：普通 dict，不加锁"""
+
+    def __init__(self):
+        self.clients = {}
+
+    def add(self, username, conn):
+        self.clients[username] = conn
+
+    def remove(self, username):
+        return self.clients.pop(username, None)
+
+    def broadcast(self, visit):
+        for username, conn in self.clients.items():
+            visit(conn)
+
+
+class LockedRegistry:
+    """全局锁：写操作与整个广播遍历都持有同一把锁"""
+
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def add(self, username, conn):
+        with self.lock:
+            self.clients[username] = conn
+
+    def remove(self, username):
+        with self.lock:
+            return self.clients.pop(username, None)
+
+    def broadcast(self, visit):
+        with self.lock:
+            for username, conn in self.clients.items():
+                visit(conn)
+
+
+class SnapshotRegistry(ClientRegistry):
+    """写时复制：广播遍历当前快照，不加锁"""
+
+    def broadcast(self, visit):
+        for username, conn in self.items():
+            visit(conn)
+
+
+REGISTRIES = {'plain': PlainRegistry, 'locked': LockedRegistry, 'snapshot': SnapshotRegistry}
+
+
+def run(kind, users, churn_threads, churn_rate, broadcasters, duration):
+    registry = REGISTRIES[kind]()
+    queues = {f'user{i}': deque(maxlen=8) for i in range(users)}
+    for username, queue in queues.items():
+        registry.add(username, queue)
+    names = list(queues)
+
+    stop = threading.Event()
+    broadcast_times = []
+    write_times = []
+    errors = [0]
+    frame = b'x' * 64
+
+    def visit(queue):
+        queue.append(frame)
+
+    def broadcaster():
+        times = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                registry.broadcast(visit)
+            except RuntimeError:
+                # dictionary changed size during iteration：这次广播没有发完
+                errors[0] += 1
+            times.append(time.perf_counter() - start)
+        broadcast_times.extend(times)
+
+    def churn(seed):
+        rng = random.Random(seed)
+        times = []
+        while not stop.is_set():
+            username = rng.choice(names)
+            start = time.perf_counter()
+            registry.remove(username)
+            registry.add(username, queues[username])
+            times.append(time.perf_counter() - start)
+            if churn_rate:
+                time.sleep(1 / churn_rate)
+        write_times.extend(times)
+
+    threads = [threading.Thread(target=broadcaster) for _ in range(broadcasters)]
+    threads += [threading.Thread(target=churn, args=(seed,)) for seed in range(churn_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    broadcast_times.sort()
+    write_times.sort()
+
+    def pct(values, p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float('nan')
+
+    return {
+        'kind': kind,
+        'broadcasts': len(broadcast_times) / duration,
+        'broken': errors[0],
+        'b_p50': pct(broadcast_times, 0.5),
+        'b_p99': pct(broadcast_times, 0.99),
+        'writes': len(write_times) / duration,
+        'w_p50': pct(write_times, 0.5),
+        'w_p99': pct(write_times, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在线连接表并发对比")
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--churn-threads', type=int, default=4)
+    parser.add_argument('--churn-rate', type=float, default=0,
+                        help="每个登录/下线线程每秒的操作数，0 表示不限")
+    parser.add_argument('--broadcasters', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.users} 个在线用户，{args.churn_threads} 个登录/下线线程，{args.broadcasters} 个广播线程，"
+          f"每种 {args.duration:g} 秒")
+    print(f"{'实现':<10}{'广播/秒':>10}{'中断次数':>10}{'广播p50(ms)':>14}{'广播p99(ms)':>14}"
+          f"{'写/秒':>10}{'写p50(ms)':>12}{'写p99(ms)':>12}")
+    for kind in REGISTRIES:
+        r = run(kind, args.users, args.churn_threads, args.churn_rate, args.broadcasters, args.duration)
+        print(f"{r['kind']:<10}{r['broadcasts']:>10.0f}{r['broken']:>10}{r['b_p50']:>14.3f}{r['b_p99']:>14.3f}"
+              f"{r['writes']:>10.0f}{r['w_p50']:>12.4f}{r['w_p99']:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
+import queue
 import socket
 import threading
-import json
 import time
 import os
+from collections import deque
+from itertools import chain
+from config import (BUFFER_SIZE, ENCODING, RESUME_RETRY_DELAYS, ACK_BATCH, ACK_INTERVAL, CLIENT_POLL_INTERVAL,
+                    CLIENT_POLL_BATCH, CHAT_MAX_LINES, CHAT_TRIM_CHUNK, CHAT_LOAD_CHUNK)
+from protocol import JSON_CODEC, SUPPORTED_ENCODINGS, COMPRESSION_ZLIB, FrameDecoder, decode_payload, get_codec
+from transcript import Transcript
 
 
 class ChatClient:
@@ -12,6 +18,30 @@ class ChatClient:
         self.socket = None
         self.connected = False
         self.username = None
+        self.presence_seq = None  # 在线列表版本号，None 表示等待完整列表
+        self.online_users = []
+        self.last_message_id = 0  # 已收到的最新聊天消息 id，重新登录时据此补发
+        self.chat_ready = False
+        self.pending_history = []
+        self.codec = JSON_CODEC  # 登录成功后改为协商出的编码
+        self.server_address = None
+        self.resume_token = None  # 登录时服务器签发，断线后凭它快速恢复会话
+        # 送达确认: 当前连接上已处理的最新序号、已确认到的序号（每个连接从 0 开始）
+        self.delivered_seq = 0
+        self.acked_seq = 0
+        self.last_ack = 0
+        self.receive_thread = None
+        self.send_lock = threading.Lock()  # 界面线程与接收线程都会发送
+        # 接收线程只解码并放入队列，Tk 控件只在界面线程中修改
+        self.inbound = queue.SimpleQueue()
+        self.draining = False
+        self.chat_buffer = []  # 本轮待插入聊天框的 (文本, 标签)
+        self.user_list_dirty = False
+        # 聊天框只保留一段连续的记录: view_last 为其中最后一条的编号，view_rows 为每条占的行数
+        self.transcript = Transcript()
+        self.view_rows = deque()
+        self.view_last = 0
+        self.chat_loading = False
 
         # 创建主窗口
         self.root = tk.Tk()
@@ -20,12 +50,14 @@ class ChatClient:
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
         self.create_login_window()
+        self.root.after(int(CLIENT_POLL_INTERVAL * 1000), self.poll_inbound)
 
     def create_login_window(self):
         """创建登录窗口"""
         # 清除现有内容
         for widget in self.root.winfo_children():
             widget.destroy()
+        self.chat_ready = False
 
         self.root.title("Python聊天室 - 用户登录")
         self.root.geometry("400x300")
@@ -104,17 +136,15 @@ class ChatClient:
                 host = server_info
                 port = 8888
 
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(5)
-            self.socket.connect((host, port))
-            self.socket.settimeout(None)
+            self.server_address = (host, port)
+            self.socket = self.open_socket()
 
             self.connected = True
 
             # 启动消息接收线程
-            receive_thread = threading.Thread(target=self.receive_messages)
-            receive_thread.daemon = True
-            receive_thread.start()
+            self.receive_thread = threading.Thread(target=self.receive_messages)
+            self.receive_thread.daemon = True
+            self.receive_thread.start()
 
             return True
 
@@ -122,6 +152,12 @@ class ChatClient:
             self.status_label.config(text=f"连接失败: {e}", foreground="red")
             return False
 
+    def open_socket(self):
+        """建立到服务器的 TCP 连接"""
+        sock = socket.create_connection(self.server_address, timeout=5)
+        sock.settimeout(None)
+        return sock
+
     def login(self):
         """用户登录"""
         if self.connected:
@@ -147,9 +183,18 @@ class ChatClient:
             'password': password,
             'timestamp': time.time()
         }
+        # 请求使用紧凑二进制编码与压缩，服务器不支持时仍用 JSON
+        login_data['encodings'] = list(SUPPORTED_ENCODINGS)
+        login_data['compression'] = COMPRESSION_ZLIB
+        login_data['acks'] = True
+        self.delivered_seq = self.acked_seq = 0
+
+        # 重新登录时从上次收到的消息之后补发
+        if self.last_message_id:
+            login_data['after_id'] = self.last_message_id
 
         try:
-            self.socket.send(json.dumps(login_data).encode('utf-8'))
+            self.send_data(login_data)
             self.username = username
         except Exception as e:
             self.status_label.config(text=f"登录失败: {e}", foreground="red")
@@ -179,7 +224,7 @@ class ChatClient:
         }
 
         try:
-            self.socket.send(json.dumps(register_data).encode('utf-8'))
+            self.send_data(register_data)
         except Exception as e:
             self.status_label.config(text=f"注册失败: {e}", foreground="red")
             self.connected = False
@@ -230,6 +275,8 @@ class ChatClient:
             font=("Arial", 10)
         )
         self.chat_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.chat_text.config(yscrollcommand=self.on_chat_scroll)
+        self.reset_transcript()
 
         # 配置标签样式
         self.chat_text.tag_config("system", foreground="blue", font=("Arial", 9, "italic"))
@@ -263,8 +310,17 @@ class ChatClient:
         # 设置焦点
         self.message_entry.focus()
 
+        # 登录时收到的在线列表可能早于聊天窗口创建
+        self.render_user_list()
+
         # 显示欢迎消息
         self.display_system_message("登录成功！开始聊天吧！")
+        self.display_system_message("输入 /join 聊天室 加入聊天室，/to 聊天室 内容 在聊天室发言，/msg 用户 内容 发私信")
+
+        # 显示窗口创建前收到的历史消息
+        self.chat_ready = True
+        pending, self.pending_history = self.pending_history, []
+        self.display_history(pending)
 
     def send_message(self):
         """发送消息"""
@@ -276,6 +332,11 @@ class ChatClient:
         if not message:
             return
 
+        if message.startswith('/'):
+            self.message_entry.delete(0, tk.END)
+            self.handle_command(message)
+            return
+
         try:
             # 发送消息
             message_data = {
@@ -284,7 +345,7 @@ class ChatClient:
                 'content': message,
                 'timestamp': time.time()
             }
-            self.socket.send(json.dumps(message_data).encode('utf-8'))
+            self.send_data(message_data)
 
             # 在聊天框显示自己的消息
             self.display_my_message(message)
@@ -294,54 +355,272 @@ class ChatClient:
 
         except Exception as e:
             self.display_system_message(f"发送失败: {e}")
-            self.connected = False
-            self.connection_status.config(text="● 离线", foreground="red")
+            if self.resume_token:
+                # 让接收线程发现连接已断开并续连
+                self.shutdown_socket()
+            else:
+                self.connected = False
+                self.connection_status.config(text="● 离线", foreground="red")
+
+    def handle_command(self, text):
+        """处理命令: /join 名称, /leave 名称, /rooms, /to 名称 内容, /msg 用户 内容, /find 前缀"""
+        parts = text.split(maxsplit=2)
+        command = parts[0].lower()
+        try:
+            if command == '/join' and len(parts) >= 2:
+                self.send_data({'type': 'join_room', 'room': parts[1]})
+            elif command == '/leave' and len(parts) >= 2:
+                self.send_data({'type': 'leave_room', 'room': parts[1]})
+            elif command == '/rooms':
+                self.send_data({'type': 'list_rooms'})
+            elif command == '/find':
+                self.send_data({'type': 'search_users', 'prefix': parts[1] if len(parts) >= 2 else ''})
+            elif command == '/to' and len(parts) == 3:
+                self.send_data({
+                    'type': 'message',
+                    'room': parts[1],
+                    'username': self.username,
+                    'content': parts[2],
+                    'timestamp': time.time()
+                })
+                self.display_my_message(f"[{parts[1]}] {parts[2]}")
+            elif command == '/msg' and len(parts) == 3:
+                self.send_data({
+                    'type': 'private_message',
+                    'to': parts[1],
+                    'content': parts[2],
+                    'timestamp': time.time()
+                })
+                self.display_my_message(f"(私信给 {parts[1]}) {parts[2]}")
+            else:
+                self.display_system_message("可用命令: /join 聊天室, /leave 聊天室, /rooms, "
+                                            "/to 聊天室 内容, /msg 用户 内容, /find 用户名前缀")
+        except Exception as e:
+            self.display_system_message(f"发送失败: {e}")
+
+    def send_data(self, data):
+        """按帧格式发送消息"""
+        frame = self.codec.encode(data)
+        with self.send_lock:
+            self.socket.sendall(frame)
 
     def receive_messages(self):
-        """接收服务器消息"""
+        """接收服务器消息；登录后连接意外断开时先尝试续连"""
         while self.connected:
+            decoder = FrameDecoder()
+            sock = self.socket
             try:
-                data = self.socket.recv(1024)
-                if not data:
-                    break
+                while self.connected:
+                    data = sock.recv(BUFFER_SIZE)
+                    if not data:
+                        break
 
-                message = data.decode('utf-8')
-                self.process_message(message)
+                    # 一次读取可能包含多帧，也可能只有半帧
+                    for payload in decoder.feed(data):
+                        self.receive_payload(payload)
+                    self.send_ack()
 
             except Exception as e:
                 if self.connected:
                     print(f"接收消息错误: {e}")
+
+            if not (self.connected and self.resume_session()):
                 break
 
         # 连接断开
-        if self.connected:
+        self.call_in_ui(self.connection_lost, threading.current_thread())
+
+    def receive_payload(self, payload):
+        """在接收线程中解码一帧：ping 直接回应，其余放入队列由界面线程处理"""
+        try:
+            data = decode_payload(payload)
+        except ValueError:
+            # 无法解析时直接显示原文
+            self.call_in_ui(self.display_system_message, payload.decode(ENCODING, 'replace'))
+            return
+
+        if data.get('type') == 'ping':
+            self.send_ack(force=True)
+            self.send_data({'type': 'pong', 'timestamp': data.get('timestamp')})
+            return
+        self.inbound.put(data)
+        # 放入队列即记为已送达，界面线程随后处理
+        if data.get('delivery_seq'):
+            self.delivered_seq = data['delivery_seq']
+
+    def call_in_ui(self, callback, *args):
+        """让界面线程执行回调（从接收线程修改界面时使用）"""
+        self.inbound.put((callback, args))
+
+    def poll_inbound(self):
+        """界面线程定时排空接收队列：本轮的消息一起处理，聊天框与在线列表各只重绘一次"""
+        try:
+            # 弹出对话框时 Tk 在对话框内继续处理定时器，此时不能重入
+            if not self.draining:
+                self.draining = True
+                try:
+                    for _ in range(CLIENT_POLL_BATCH):
+                        try:
+                            item = self.inbound.get_nowait()
+                        except queue.Empty:
+                            break
+                        if isinstance(item, dict):
+                            self.process_message(item)
+                        else:
+                            callback, args = item
+                            callback(*args)
+                finally:
+                    self.draining = False
+                    self.flush_ui()
+        finally:
+            # 队列里还有（突发消息超过一批）时尽快处理下一批，但先让 Tk 处理界面事件
+            delay = 1 if not self.inbound.empty() else int(CLIENT_POLL_INTERVAL * 1000)
+            self.root.after(delay, self.poll_inbound)
+
+    def connection_lost(self, thread):
+        """接收线程已结束：仍是当前连接的线程时按断开处理（期间可能已经登出并重新登录）"""
+        if self.connected and self.receive_thread is thread:
             self.disconnect()
 
-    def process_message(self, message):
-        """处理接收到的消息"""
+    def resume_session(self):
+        """用续连令牌重新连接并发送 resume 请求（在接收线程中执行），结果见 handle_resume_response"""
+        token, self.resume_token = self.resume_token, None
+        if not token or not self.chat_ready:
+            return False
+        # 旧连接上已收到的序号，服务器据此只重传之后的消息
+        delivered = self.delivered_seq
+
+        self.call_in_ui(lambda: self.connection_status.config(text="● 重连中", foreground="orange"))
+        self.call_in_ui(self.display_system_message, "连接中断，正在重新连接...")
+        for delay in RESUME_RETRY_DELAYS:
+            time.sleep(delay)
+            if not self.connected:
+                return False
+            try:
+                sock = self.open_socket()
+            except OSError:
+                continue
+
+            old_socket, self.socket = self.socket, sock
+            try:
+                old_socket.close()
+            except OSError:
+                pass
+            self.codec = JSON_CODEC
+            self.delivered_seq = self.acked_seq = 0
+            try:
+                self.send_data({
+                    'type': 'resume',
+                    'token': token,
+                    'after_id': self.last_message_id,
+                    'presence_seq': self.presence_seq,
+                    'ack': delivered,
+                    'acks': True,
+                    'encodings': list(SUPPORTED_ENCODINGS),
+                    'compression': COMPRESSION_ZLIB
+                })
+                return True
+            except OSError:
+                continue
+
+        self.call_in_ui(self.display_system_message, "重新连接失败")
+        return False
+
+    def send_ack(self, force=False):
+        """累计确认已收到的消息：攒够 ACK_BATCH 条或距上次确认超过 ACK_INTERVAL 秒时确认一次"""
+        unacked = self.delivered_seq - self.acked_seq
+        if unacked <= 0:
+            return
+        if not force and unacked < ACK_BATCH and time.monotonic() - self.last_ack < ACK_INTERVAL:
+            return
+        self.acked_seq = self.delivered_seq
+        self.last_ack = time.monotonic()
+        try:
+            self.send_data({'type': 'ack', 'seq': self.acked_seq})
+        except OSError:
+            pass  # 连接已断开，续连请求会带上确认序号
+
+    def shutdown_socket(self):
+        """关闭 socket 的读写，阻塞在 recv 上的接收线程随即返回"""
         try:
-            data = json.loads(message)
-            msg_type = data.get('type')
-
-            if msg_type == 'register_response':
-                self.handle_register_response(data)
-            elif msg_type == 'login_response':
-                self.handle_login_response(data)
-            elif msg_type == 'system_message':
-                self.display_system_message(data.get('content', ''))
-            elif msg_type == 'chat_message':
-                username = data.get('username', '')
-                content = data.get('content', '')
-                if username != self.username:  # 不显示自己的消息
-                    self.display_message(username, content)
-            elif msg_type == 'user_list':
-                self.handle_user_list(data)
-            elif msg_type == 'error':
-                self.display_system_message(f"错误: {data.get('message', '')}")
-
-        except json.JSONDecodeError:
-            # 如果不是JSON，直接显示
-            self.display_system_message(message)
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def process_message(self, data):
+        """处理接收到的消息（界面线程）"""
+        msg_type = data.get('type')
+
+        if msg_type == 'register_response':
+            self.handle_register_response(data)
+        elif msg_type == 'login_response':
+            self.handle_login_response(data)
+        elif msg_type == 'resume_response':
+            self.handle_resume_response(data)
+        elif msg_type == 'system_message':
+            self.display_system_message(data.get('content', ''))
+        elif msg_type == 'chat_message':
+            username = data.get('username', '')
+            content = data.get('content', '')
+            self.last_message_id = max(self.last_message_id, data.get('id', 0))
+            if username != self.username:  # 不显示自己的消息
+                self.display_message(username, content)
+        elif msg_type == 'room_message':
+            if data.get('username') != self.username:
+                self.display_message(f"{data.get('username', '')}@{data.get('room', '')}",
+                                     data.get('content', ''), data.get('timestamp'))
+        elif msg_type == 'private_message':
+            self.display_private_message(data)
+        elif msg_type == 'offline_messages':
+            for message in data.get('messages', []):
+                self.display_private_message(message)
+        elif msg_type == 'private_message_response':
+            if not data.get('success'):
+                self.display_system_message(f"私信发送失败: {data.get('message', '')}")
+            elif data.get('queued'):
+                self.display_system_message(f"{data.get('to', '')} 不在线，私信将在其上线后送达")
+        elif msg_type in ('join_room_response', 'leave_room_response', 'room_event', 'room_list'):
+            self.handle_room_message(data)
+        elif msg_type == 'history':
+            self.handle_history(data)
+        elif msg_type == 'search_users_response':
+            self.handle_search_users_response(data)
+        elif msg_type in ('user_list', 'user_joined', 'user_left'):
+            self.handle_user_list(data)
+        elif msg_type == 'error':
+            self.display_system_message(f"错误: {data.get('message', '')}")
+
+    def handle_search_users_response(self, data):
+        """显示查找用户的结果"""
+        users = data.get('users', [])
+        if not users:
+            self.display_system_message(f"没有以 {data.get('prefix', '')} 开头的用户")
+            return
+        names = [f"{user['username']}{' (在线)' if user.get('online') else ''}" for user in users]
+        self.display_system_message("找到用户: " + ", ".join(names))
+
+    def display_private_message(self, data):
+        """显示收到的私信"""
+        self.display_message(f"{data.get('from', '')} (私信)", data.get('content', ''), data.get('timestamp'))
+
+    def handle_room_message(self, data):
+        """显示聊天室相关的通知"""
+        msg_type = data.get('type')
+        room = data.get('room', '')
+        if msg_type == 'room_list':
+            rooms = ', '.join(f"{r['name']}({r['members']})" for r in data.get('rooms', [])) or '无'
+            joined = ', '.join(data.get('joined', [])) or '无'
+            self.display_system_message(f"聊天室: {rooms}；已加入: {joined}")
+        elif msg_type == 'room_event':
+            action = '加入了' if data.get('event') == 'joined' else '离开了'
+            self.display_system_message(f"{data.get('username', '')} {action}聊天室 {room}")
+        elif not data.get('success'):
+            self.display_system_message(f"错误: {data.get('message', '')}")
+        elif msg_type == 'join_room_response':
+            members = ', '.join(data.get('members', []))
+            self.display_system_message(f"已加入聊天室 {room}，成员: {members}")
+        else:
+            self.display_system_message(f"已离开聊天室 {room}")
 
     def handle_register_response(self, data):
         """处理注册响应"""
@@ -363,6 +642,8 @@ class ChatClient:
         message = data.get('message', '')
 
         if success:
+            self.codec = get_codec(data.get('encoding', 'json'), data.get('compression'))
+            self.resume_token = data.get('resume_token')
             self.status_label.config(text="登录成功！", foreground="green")
             self.root.after(100, self.create_chat_window)
         else:
@@ -370,47 +651,204 @@ class ChatClient:
             messagebox.showerror("登录失败", message)
             self.disconnect()
 
+    def handle_resume_response(self, data):
+        """续连结果：成功时会话照常继续，失败时回到登录界面"""
+        if data.get('success'):
+            self.codec = get_codec(data.get('encoding', 'json'), data.get('compression'))
+            self.resume_token = data.get('resume_token')
+            self.connection_status.config(text="● 在线", foreground="green")
+            self.display_system_message("已重新连接")
+        else:
+            self.display_system_message(f"重新连接失败: {data.get('message', '')}")
+            self.disconnect()
+            self.root.after(1500, self.create_login_window)
+
     def handle_user_list(self, data):
-        """处理用户列表"""
-        users = data.get('users', [])
-        if hasattr(self, 'user_listbox'):
+        """处理用户列表：user_list 为完整快照，user_joined/user_left 为带版本号的增量"""
+        msg_type = data.get('type')
+        seq = data.get('seq')
+
+        if msg_type == 'user_list':
+            self.presence_seq = seq
+            self.online_users = [user for user in data.get('users', []) if user != self.username]
+            self.render_user_list()
+            return
+
+        # 还没有快照、正在重新同步，或是旧事件
+        if self.presence_seq is None or seq <= self.presence_seq:
+            return
+
+        # 版本号不连续说明漏掉了事件，请求完整列表重新同步
+        if seq != self.presence_seq + 1:
+            self.presence_seq = None
+            self.refresh_user_list()
+            return
+
+        self.presence_seq = seq
+        user = data.get('username')
+        if user == self.username:  # 不显示自己
+            return
+
+        # 同一轮的多个上下线事件只在 flush_ui 时重绘一次列表框
+        if msg_type == 'user_joined' and user not in self.online_users:
+            self.online_users.append(user)
+            self.user_list_dirty = True
+        elif msg_type == 'user_left' and user in self.online_users:
+            self.online_users.remove(user)
+            self.user_list_dirty = True
+        if not self.draining:
+            self.flush_ui()
+
+    def render_user_list(self):
+        """按当前在线列表重绘用户列表框"""
+        self.user_list_dirty = False
+        if hasattr(self, 'user_listbox') and self.user_listbox.winfo_exists():
             self.user_listbox.delete(0, tk.END)
-            for user in users:
-                if user != self.username:  # 不显示自己
-                    self.user_listbox.insert(tk.END, user)
+            for user in self.online_users:
+                self.user_listbox.insert(tk.END, user)
+
+    def handle_history(self, data):
+        """处理登录后补发的历史消息"""
+        messages = data.get('messages', [])
+        if messages:
+            self.last_message_id = max(self.last_message_id, messages[-1].get('id', 0))
+
+        if self.chat_ready:
+            self.display_history(messages)
+        else:
+            self.pending_history.extend(messages)
+
+    def display_history(self, messages):
+        """按原时间显示历史消息"""
+        for message in messages:
+            content = message.get('content', '')
+            timestamp = message.get('timestamp')
+            if message.get('username') == self.username:
+                self.display_my_message(content, timestamp)
+            else:
+                self.display_message(message.get('username', ''), content, timestamp)
 
     def display_system_message(self, message):
         """显示系统消息"""
-        if hasattr(self, 'chat_text'):
-            timestamp = time.strftime("%H:%M:%S")
-            formatted_message = f"[{timestamp}] 系统: {message}\n"
+        timestamp = time.strftime("%H:%M:%S")
+        self.append_chat(f"[{timestamp}] 系统: {message}\n", "system")
 
-            self.chat_text.config(state=tk.NORMAL)
-            self.chat_text.insert(tk.END, formatted_message, "system")
-            self.chat_text.config(state=tk.DISABLED)
-            self.chat_text.see(tk.END)
-
-    def display_message(self, username, message):
+    def display_message(self, username, message, timestamp=None):
         """显示其他用户的消息"""
-        if hasattr(self, 'chat_text'):
-            timestamp = time.strftime("%H:%M:%S")
-            formatted_message = f"[{timestamp}] {username}: {message}\n"
+        timestamp = time.strftime("%H:%M:%S", time.localtime(timestamp))
+        self.append_chat(f"[{timestamp}] {username}: {message}\n", "message")
 
-            self.chat_text.config(state=tk.NORMAL)
-            self.chat_text.insert(tk.END, formatted_message, "message")
-            self.chat_text.config(state=tk.DISABLED)
-            self.chat_text.see(tk.END)
-
-    def display_my_message(self, message):
+    def display_my_message(self, message, timestamp=None):
         """显示自己的消息"""
-        if hasattr(self, 'chat_text'):
-            timestamp = time.strftime("%H:%M:%S")
-            formatted_message = f"[{timestamp}] 我: {message}\n"
-
-            self.chat_text.config(state=tk.NORMAL)
-            self.chat_text.insert(tk.END, formatted_message, "my_message")
-            self.chat_text.config(state=tk.DISABLED)
-            self.chat_text.see(tk.END)
+        timestamp = time.strftime("%H:%M:%S", time.localtime(timestamp))
+        self.append_chat(f"[{timestamp}] 我: {message}\n", "my_message")
+
+    def append_chat(self, text, tag):
+        """追加一行到聊天框：排空接收队列期间先攒着，本轮结束时一次插入"""
+        self.chat_buffer.append((text, tag))
+        if not self.draining:
+            self.flush_ui()
+
+    def flush_ui(self):
+        """把攒下的聊天行一次插入聊天框（一次 NORMAL/insert/see），并按需重绘在线列表"""
+        if self.chat_buffer:
+            lines, self.chat_buffer = self.chat_buffer, []
+            if hasattr(self, 'chat_text') and self.chat_text.winfo_exists():
+                self.show_chat_lines(lines)
+        if self.user_list_dirty:
+            self.render_user_list()
+
+    def show_chat_lines(self, lines):
+        """保存到本地聊天记录并显示在聊天框末尾，超出 CHAT_MAX_LINES 条时成块删掉最旧的"""
+        last_id = self.transcript.append(lines)
+        self.chat_text.config(state=tk.NORMAL)
+        if self.view_last == last_id - len(lines):
+            self.insert_chat(tk.END, lines)
+        else:
+            # 聊天框里是读回的较早记录，不含之前的最新消息：直接换成最近的消息
+            self.chat_text.delete('1.0', tk.END)
+            self.view_rows.clear()
+            self.insert_chat(tk.END, self.transcript.before(last_id + 1, CHAT_MAX_LINES - CHAT_TRIM_CHUNK))
+        self.view_last = last_id
+        if len(self.view_rows) > CHAT_MAX_LINES:
+            self.trim_chat_top(CHAT_MAX_LINES - CHAT_TRIM_CHUNK)
+        self.chat_text.config(state=tk.DISABLED)
+        self.chat_text.see(tk.END)
+
+    def insert_chat(self, index, lines):
+        """一次插入多条 (文本, 标签) 或 (编号, 文本, 标签)，只能插在开头或末尾，返回插入的行数"""
+        lines = [line[-2:] for line in lines]
+        rows = [text.count('\n') for text, _ in lines]
+        if lines:
+            self.chat_text.insert(index, *chain.from_iterable(lines))
+        if index == tk.END:
+            self.view_rows.extend(rows)
+        else:
+            self.view_rows.extendleft(reversed(rows))
+        return sum(rows)
+
+    def trim_chat_top(self, keep):
+        """从聊天框顶部删掉最旧的消息，只保留 keep 条，返回删掉的行数"""
+        lines = 0
+        while len(self.view_rows) > keep:
+            lines += self.view_rows.popleft()
+        if lines:
+            self.chat_text.delete('1.0', f"{lines + 1}.0")
+        return lines
+
+    def on_chat_scroll(self, first, last):
+        """聊天框滚动时更新滚动条；滚到顶部（或底部）且还有没显示的记录时读回一批"""
+        self.chat_text.vbar.set(first, last)
+        if self.chat_loading:
+            return
+        if float(first) <= 0 and self.view_last - len(self.view_rows) > 0:
+            self.chat_loading = True
+            self.root.after_idle(self.load_older_chat)
+        elif float(last) >= 1 and self.view_last < self.transcript.last_id:
+            self.chat_loading = True
+            self.root.after_idle(self.load_newer_chat)
+
+    def load_older_chat(self):
+        """在聊天框顶部读回更早的一批记录，超出上限时从底部删掉同样多的"""
+        self.chat_loading = False
+        if not self.chat_text.winfo_exists():
+            return
+        rows = self.transcript.before(self.view_last - len(self.view_rows) + 1, CHAT_LOAD_CHUNK)
+        if not rows:
+            return
+        self.chat_text.config(state=tk.NORMAL)
+        added = self.insert_chat('1.0', rows)
+        dropped = 0
+        while len(self.view_rows) > CHAT_MAX_LINES:
+            dropped += self.view_rows.pop()
+            self.view_last -= 1
+        if dropped:
+            self.chat_text.delete(f"{sum(self.view_rows) + 1}.0", tk.END)
+        self.chat_text.config(state=tk.DISABLED)
+        # 原来的第一行仍留在顶部，不跳动
+        self.chat_text.yview(f"{added + 1}.0")
+
+    def load_newer_chat(self):
+        """滚回底部时接着读入之后的一批记录，超出上限时从顶部删掉同样多的"""
+        self.chat_loading = False
+        if not self.chat_text.winfo_exists():
+            return
+        rows = self.transcript.after(self.view_last, CHAT_LOAD_CHUNK)
+        if not rows:
+            return
+        top = int(self.chat_text.index('@0,0').split('.')[0])
+        self.chat_text.config(state=tk.NORMAL)
+        self.insert_chat(tk.END, rows)
+        self.view_last = rows[-1][0]
+        removed = self.trim_chat_top(CHAT_MAX_LINES)
+        self.chat_text.config(state=tk.DISABLED)
+        self.chat_text.yview(f"{max(top - removed, 1)}.0")
+
+    def reset_transcript(self):
+        """清空本地聊天记录（新的聊天窗口或清空聊天时）"""
+        self.transcript.clear()
+        self.view_rows.clear()
+        self.view_last = 0
 
     def refresh_user_list(self):
         """刷新用户列表"""
@@ -421,12 +859,14 @@ class ChatClient:
                 'timestamp': time.time()
             }
             try:
-                self.socket.send(json.dumps(user_list_request).encode('utf-8'))
+                self.send_data(user_list_request)
             except:
                 pass
 
     def clear_chat(self):
         """清空聊天记录"""
+        self.chat_buffer = []
+        self.reset_transcript()
         if hasattr(self, 'chat_text'):
             self.chat_text.config(state=tk.NORMAL)
             self.chat_text.delete(1.0, tk.END)
@@ -441,7 +881,7 @@ class ChatClient:
                 'timestamp': time.time()
             }
             try:
-                self.socket.send(json.dumps(logout_data).encode('utf-8'))
+                self.send_data(logout_data)
             except:
                 pass
 
@@ -451,6 +891,10 @@ class ChatClient:
     def disconnect(self):
         """断开连接"""
         self.connected = False
+        self.resume_token = None
+        self.codec = JSON_CODEC
+        self.presence_seq = None
+        self.online_users = []
         if self.socket:
             try:
                 self.socket.close()
@@ -465,6 +909,7 @@ class ChatClient:
         """窗口关闭事件"""
         if self.connected and self.username:
             self.logout()
+        self.transcript.close()
         self.root.quit()
 
     def run(self):
@@ -1,8 +1,123 @@
 # 服务器配置
 SERVER_HOST = 'localhost'
 SERVER_PORT = 8888
-BUFFER_SIZE = 1024
+BUFFER_SIZE = 65536
 ENCODING = 'utf-8'
 
-# 用户数据文件
-USER_DATA_FILE = 'users.json'
\ No newline at end of file
+# 服务模式: 'thread' 每个连接一个线程, 'asyncio' 单线程事件循环
+SERVER_MODE = 'thread'
+LISTEN_BACKLOG = 128
+# 多进程分片: worker 进程数（1 表示单进程），worker 之间通过本地 Unix 套接字总线同步
+SERVER_WORKERS = 1
+BUS_SOCKET_PATH = None  # None 表示按端口放在临时目录
+BUS_CLAIM_TIMEOUT = 5  # 登录时向总线申请在线名额的超时(秒)
+BUS_QUEUE_SIZE = 100000  # 总线中心发往单个 worker 的待发送帧上限，超出时断开该 worker
+
+# 消息帧: 4字节长度前缀 + JSON，单帧最大字节数
+MAX_FRAME_SIZE = 1024 * 1024
+# 协商启用压缩后，消息体超过该字节数才用 zlib 压缩
+COMPRESS_THRESHOLD = 512
+COMPRESS_LEVEL = 6
+
+# 每个连接的发送队列: 最大帧数、溢出策略('drop' / 'disconnect' / 'coalesce')
+# coalesce 只用新的状态快照（在线列表、聊天室列表等）覆盖同类旧快照，队列被其他消息占满时断开连接
+OUTBOUND_QUEUE_SIZE = 256
+OUTBOUND_OVERFLOW_POLICY = 'coalesce'
+# 事件循环模式下 transport 缓冲超过该字节数时暂停写入，消息留在发送队列
+OUTBOUND_HIGH_WATER = 64 * 1024
+# 发送合并窗口(秒): 连接有新消息后最多等待这么久，把期间入队的帧合并成一次 sendmsg 写出；0 表示立即发送
+OUTBOUND_COALESCE_WINDOW = 0.002
+# 单次 sendmsg 最多携带的帧数（不超过系统的 IOV_MAX）
+OUTBOUND_MAX_IOV = 512
+
+# 每个连接的接收限速（令牌桶）: 每秒消息数与突发上限、每秒字节数与突发上限，0 表示不限
+RATE_LIMIT_MESSAGES = 20
+RATE_LIMIT_MESSAGE_BURST = 40
+RATE_LIMIT_BYTES = 64 * 1024
+RATE_LIMIT_BYTE_BURST = 256 * 1024
+# 超出限额时: 'delay' 暂停读取该连接, 'drop' 丢弃消息, 'disconnect' 断开连接
+RATE_LIMIT_PENALTY = 'delay'
+
+# 心跳: 连接空闲多少秒后发送 ping，发出 ping 后多少秒内没有任何数据则断开；时间轮每格秒数与格数
+HEARTBEAT_INTERVAL = 30
+HEARTBEAT_TIMEOUT = 10
+HEARTBEAT_TICK = 1.0
+HEARTBEAT_WHEEL_SLOTS = 64
+
+# 续连: 连接意外断开后续连令牌的有效期(秒)、服务器保留的最近在线变化条数（续连时据此只补发增量）
+RESUME_TOKEN_TTL = 120
+PRESENCE_LOG_SIZE = 1000
+# 客户端断线后尝试续连的等待间隔(秒)
+RESUME_RETRY_DELAYS = (0.5, 1, 2, 4)
+
+# 送达确认: 每个连接最多保留的已发送未确认消息数（重传窗口），客户端累计收到多少条或隔多少秒确认一次
+ACK_WINDOW = 512
+ACK_BATCH = 32
+ACK_INTERVAL = 1.0
+
+# 客户端界面: 接收线程把消息放入队列，界面线程每隔多少秒取一次、每次最多处理多少条
+CLIENT_POLL_INTERVAL = 0.05
+CLIENT_POLL_BATCH = 500
+
+# 客户端聊天框: 最多保留多少条消息，超出时一次删掉最旧的 CHAT_TRIM_CHUNK 条；
+# 删掉的消息仍在本地聊天记录中，滚动到顶部时每次读回 CHAT_LOAD_CHUNK 条
+CHAT_MAX_LINES = 2000
+CHAT_TRIM_CHUNK = 500
+CHAT_LOAD_CHUNK = 200
+# 本地聊天记录文件，空字符串表示临时文件（关闭客户端后删除）
+CHAT_TRANSCRIPT_FILE = ''
+
+# 用户数据文件（JSON 格式，也用于导入/导出）
+USER_DATA_FILE = 'users.json'
+# 用户存储后端: 'sqlite' 单个用户修改只写一行, 'json' 每次重写整个文件
+USER_STORAGE_BACKEND = 'sqlite'
+USER_DB_FILE = 'users.db'
+
+
+# 密码哈希: PBKDF2-SHA256 迭代次数，校验在 'thread' 或 'process' 池中执行
+PASSWORD_ITERATIONS = 100000
+PASSWORD_POOL = 'thread'
+PASSWORD_POOL_WORKERS = None  # None 表示 CPU 核数
+
+# 批量导入账号: 每批提交给密码池的哈希任务数
+IMPORT_BATCH_SIZE = 1000
+# 账号查询: 分页列出时每页的默认个数、查找用户时最多返回的个数
+USER_PAGE_SIZE = 100
+USER_SEARCH_LIMIT = 20
+
+# 聊天记录: 内存中保留最近的条数，磁盘分段日志目录、每段条数、最多保留段数
+HISTORY_DIR = 'history'
+HISTORY_BUFFER_SIZE = 1000
+HISTORY_SEGMENT_SIZE = 10000
+HISTORY_MAX_SEGMENTS = 20
+# 登录补发: 未提供游标时补发最近的条数、单次最多补发条数、每批条数与批间隔(秒)
+HISTORY_REPLAY_DEFAULT = 50
+HISTORY_REPLAY_MAX = 1000
+HISTORY_REPLAY_BATCH = 50
+HISTORY_REPLAY_INTERVAL = 0.05
+
+# 聊天室: 名称最大长度、每个用户最多同时加入的聊天室数
+ROOM_NAME_MAX_LENGTH = 20
+ROOMS_PER_USER_MAX = 20
+
+# 离线私信: 存储文件、每个收件人最多保留的条数（超出丢弃最旧的）、过期时间(秒)、登录时每批补发条数与批间隔(秒)
+OFFLINE_DB_FILE = 'offline.db'
+OFFLINE_QUEUE_MAX = 200
+OFFLINE_MESSAGE_TTL = 7 * 24 * 3600
+OFFLINE_DRAIN_BATCH = 50
+OFFLINE_DRAIN_INTERVAL = 0.05
+
+# 日志: 级别、滚动日志文件（JSON 行，None 表示只输出到终端）、单个文件最大字节数与保留个数
+LOG_LEVEL = 'INFO'
+LOG_FILE = 'server.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# 日志队列长度（写满后丢弃新日志，不阻塞处理线程）、逐条消息事件的抽样比例（DEBUG 级别）
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_RATE = 0.01
+
+# 指标: 本地 HTTP 接口（/metrics 纯文本, /stats JSON），端口为 0 时不启动
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 8889
+# 可以通过 stats 协议消息查看指标的管理员用户
+ADMIN_USERS = ('admin',)
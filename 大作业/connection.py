@@ -0,0 +1,174 @@
+import asyncio
+import selectors
+import socket
+import time
+from collections import deque
+from config import OUTBOUND_QUEUE_SIZE, OUTBOUND_OVERFLOW_POLICY, OUTBOUND_HIGH_WATER, OUTBOUND_COALESCE_WINDOW
+from outbound import OutboundQueue
+from protocol import JSON_CODEC, FrameDecoder, encode_sequenced
+from ratelimit import RateLimiter
+
+
+class ClientConnection:
+    """客户端连接（线程模式，读线程阻塞接收，由共享写线程非阻塞发送）"""
+
+    def __init__(self, client_socket, address, writer=None,
+                 queue_size=OUTBOUND_QUEUE_SIZE, overflow_policy=OUTBOUND_OVERFLOW_POLICY):
+        self.socket = client_socket
+        self.address = address
+        self.username = None
+        self.decoder = FrameDecoder()
+        # 已收到、等待处理的消息体；限速时留在这里，暂停读取 socket
+        self.inbox = deque()
+        self.limiter = RateLimiter()
+        # 心跳: 最近一次收到数据的时间、已发出但尚未得到回应的 ping 的时间
+        self.last_seen = time.monotonic()
+        self.ping_sent = None
+        self.codec = JSON_CODEC  # 登录时协商，决定发给该连接的编码
+        self.delivery = None  # 登录时协商了送达确认后为 DeliveryWindow
+        self.login_started = None
+        self.outbound = OutboundQueue(queue_size, overflow_policy)
+        self.writer = writer
+        # 以下状态由写线程维护
+        self.pending = deque()  # 已取出但未写完的帧
+        self.write_scheduled = False
+        self.watched = False
+        self.aborted = False
+        self.released = False
+        self.read_selector = None
+        if writer is not None:
+            # 写线程需要非阻塞发送，读线程通过 selector 等待可读
+            self.socket.setblocking(False)
+            self.read_selector = selectors.DefaultSelector()
+            self.read_selector.register(self.socket, selectors.EVENT_READ)
+
+    def recv(self, size):
+        """阻塞接收，直到有数据或连接关闭"""
+        while True:
+            try:
+                return self.socket.recv(size)
+            except (BlockingIOError, InterruptedError):
+                self.read_selector.select()
+
+    def send_frame(self, frame, key=None, reliable=False):
+        """把已编码的帧放入发送队列；返回 False 表示应断开该连接"""
+        if not self.outbound.put(frame, key, reliable):
+            return False
+        self.writer.schedule(self)
+        return True
+
+    def send_tracked(self, message, payload):
+        """发送需要确认的消息：分配序号、记入重传窗口后入队；返回 (是否应保持连接, 帧长度)
+
+        带序号的帧不会被溢出策略丢弃，队列满时断开连接；入队失败的消息同样留在窗口里，
+        会话随断开保留，续连后会被重传。重传窗口已满时同样返回 False，消息留在窗口里不再发送。
+        """
+        with self.delivery.lock:
+            seq = self.delivery.track(message)
+            if self.delivery.overflowed():
+                return False, 0
+            frame = encode_sequenced(payload, seq)
+            return self.send_frame(frame, reliable=True), len(frame)
+
+    def closed(self):
+        """连接是否已关闭"""
+        return self.outbound.closed
+
+    def queue_depth(self):
+        """待发送的帧数：发送队列加上写线程已取出、还没写完的一批"""
+        return len(self.outbound) + len(self.pending)
+
+    def _shutdown(self, how):
+        try:
+            self.socket.shutdown(how)
+        except OSError:
+            pass
+
+    def close(self):
+        """关闭连接，写线程发送完已入队的帧后释放 socket"""
+        self.outbound.close()
+        # 唤醒阻塞在 recv 上的读线程
+        self._shutdown(socket.SHUT_RD)
+        self.writer.schedule(self)
+
+    def abort(self):
+        """立即断开连接，丢弃未发送的帧"""
+        self.aborted = True
+        self.outbound.close()
+        self._shutdown(socket.SHUT_RDWR)
+        self.writer.schedule(self)
+
+    def release(self):
+        """释放 socket（由写线程调用）"""
+        if self.released:
+            return
+        self.released = True
+        self._shutdown(socket.SHUT_RDWR)
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+        if self.read_selector:
+            self.read_selector.close()
+
+
+class AsyncConnection(ClientConnection):
+    """客户端连接（事件循环模式，transport 可写时排空发送队列）
+
+    入队后不立即写，而是在合并窗口结束（窗口为 0 时为本轮事件循环末尾）时把积攒的帧一次写出。
+    """
+
+    def __init__(self, transport,
+                 queue_size=OUTBOUND_QUEUE_SIZE, overflow_policy=OUTBOUND_OVERFLOW_POLICY,
+                 metrics=None, coalesce_window=OUTBOUND_COALESCE_WINDOW):
+        super().__init__(transport.get_extra_info('socket'),
+                         transport.get_extra_info('peername'),
+                         None, queue_size, overflow_policy)
+        self.transport = transport
+        self.transport.set_write_buffer_limits(high=OUTBOUND_HIGH_WATER)
+        self.paused = False
+        self.metrics = metrics
+        self.coalesce_window = coalesce_window
+        self.loop = asyncio.get_running_loop()
+        self.drain_scheduled = False
+
+    def send_frame(self, frame, key=None, reliable=False):
+        """入队，transport 未拥塞时安排在合并窗口结束时写出"""
+        if not self.outbound.put(frame, key, reliable):
+            return False
+        if not self.paused and not self.drain_scheduled:
+            self.drain_scheduled = True
+            if self.coalesce_window:
+                self.loop.call_later(self.coalesce_window, self.drain)
+            else:
+                self.loop.call_soon(self.drain)
+        return True
+
+    def drain(self):
+        """把发送队列一次写入 transport"""
+        self.drain_scheduled = False
+        if self.transport.is_closing():
+            return
+        frames = self.outbound.pop_all()
+        if frames:
+            self.transport.writelines(frames)
+            if self.metrics:
+                self.metrics.socket_write()
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.drain()
+
+    def close(self):
+        """关闭连接，transport 发送完缓冲数据后关闭"""
+        self.drain()
+        self.outbound.close()
+        self.transport.close()
+
+    def abort(self):
+        """立即断开连接"""
+        self.outbound.close()
+        self.transport.abort()
@@ -0,0 +1,52 @@
+import threading
+from collections import deque
+from config import ACK_WINDOW
+
+
+class DeliveryWindow:
+    """一个连接的送达确认状态：分配递增序号，保留已发送未确认的消息（重传窗口）
+
+    客户端累计确认（"序号 n 及之前的都已收到"），一批消息只需一次确认。
+    连接意外断开后窗口随续连会话保留，续连时只重传客户端没有确认的消息。
+    窗口不丢弃消息：超过 size 条未确认（客户端长时间不确认）时由调用方断开连接并作废会话，
+    未确认的私信转入离线队列。
+    """
+
+    def __init__(self, size=ACK_WINDOW):
+        self.size = size
+        self.seq = 0  # 最近分配的序号
+        self.acked = 0  # 客户端确认到的序号
+        self.unacked = deque()  # (seq, message)
+        # 分配序号与入队须在同一把锁内，保证序号按发送顺序递增
+        self.lock = threading.Lock()
+
+    def track(self, message):
+        """登记一条待确认的消息，返回它的序号（调用方持有 lock）"""
+        self.seq += 1
+        self.unacked.append((self.seq, message))
+        return self.seq
+
+    def overflowed(self):
+        """未确认的消息是否已超过窗口大小"""
+        return len(self.unacked) > self.size
+
+    def ack(self, seq):
+        """累计确认 seq 及之前的消息，返回新确认的条数"""
+        if not isinstance(seq, int) or isinstance(seq, bool):
+            return 0
+        with self.lock:
+            seq = min(seq, self.seq)
+            count = 0
+            while self.unacked and self.unacked[0][0] <= seq:
+                self.unacked.popleft()
+                count += 1
+            self.acked = max(self.acked, seq)
+            return count
+
+    def pending(self):
+        """按发送顺序返回尚未确认的消息"""
+        with self.lock:
+            return [message for _, message in self.unacked]
+
+    def __len__(self):
+        return len(self.unacked)
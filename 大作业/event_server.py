@@ -0,0 +1,133 @@
+import asyncio
+from config import (SERVER_HOST, SERVER_PORT, LISTEN_BACKLOG, OUTBOUND_OVERFLOW_POLICY, METRICS_PORT,
+                    RATE_LIMIT_PENALTY, HEARTBEAT_TICK)
+from connection import AsyncConnection
+from logger import get_logger
+from server import ChatServer
+
+log = get_logger('server')
+
+
+class ChatProtocol(asyncio.Protocol):
+    """单个客户端连接的协议处理"""
+
+    def __init__(self, server):
+        self.server = server
+        self.conn = None
+
+    def connection_made(self, transport):
+        self.conn = AsyncConnection(transport, overflow_policy=self.server.overflow_policy,
+                                    metrics=self.server.metrics)
+        self.server.connection_opened(self.conn)
+        log.debug("新的客户端连接", addr=self.conn.address)
+
+    def data_received(self, data):
+        try:
+            self.server.handle_data(self.conn, data)
+        except Exception as e:
+            log.error("处理客户端时出错", addr=self.conn.address, error=e)
+            self.conn.close()
+
+    def pause_writing(self):
+        self.conn.pause_writing()
+
+    def resume_writing(self):
+        self.conn.resume_writing()
+
+    def connection_lost(self, exc):
+        self.server.handle_disconnect(self.conn)
+
+
+class AsyncChatServer(ChatServer):
+    """单线程事件循环聊天服务器，协议与 UserManager 集成与线程模式相同"""
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, overflow_policy=OUTBOUND_OVERFLOW_POLICY,
+                 metrics_port=METRICS_PORT, rate_limit_penalty=RATE_LIMIT_PENALTY):
+        super().__init__(host, port, overflow_policy, metrics_port, rate_limit_penalty)
+        self.loop = None
+        self.listener = None
+
+    def on_complete(self, future, callback):
+        """密码池的结果回到事件循环线程后再执行回调，不阻塞事件循环"""
+        def on_done(done):
+            self.loop.call_soon_threadsafe(self.run_callback, done, callback)
+
+        future.add_done_callback(on_done)
+
+    def run_callback(self, future, callback):
+        try:
+            callback(future.result())
+        except Exception as e:
+            log.exception("处理异步结果时出错", error=e)
+
+    def start_heartbeat(self):
+        """在事件循环中每个 tick 转动一次时间轮"""
+        def tick():
+            if self.running:
+                self.heartbeat_tick()
+                self.loop.call_later(HEARTBEAT_TICK, tick)
+
+        self.loop.call_later(HEARTBEAT_TICK, tick)
+
+    def throttle_reading(self, conn, wait):
+        """暂停读取该连接 wait 秒，之后再继续处理积压的消息（不阻塞事件循环）"""
+        conn.transport.pause_reading()
+        self.loop.call_later(wait, self.resume_reading, conn)
+        return False
+
+    def resume_reading(self, conn):
+        if conn.transport.is_closing():
+            return
+        conn.transport.resume_reading()
+        self.process_inbox(conn)
+
+    def call_soon(self, callback, *args):
+        """在事件循环线程中执行回调（可从其他线程调用；事件循环启动前直接执行）"""
+        if self.loop is None:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        """延迟执行回调（在事件循环线程中）"""
+        self.loop.call_later(delay, callback, *args)
+
+    def start(self):
+        """启动服务器"""
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            log.exception("服务器启动失败", error=e)
+        finally:
+            self.stop()
+
+    async def serve(self):
+        """在事件循环中监听并处理所有连接"""
+        self.loop = asyncio.get_running_loop()
+        self.listener = await self.loop.create_server(
+            lambda: ChatProtocol(self),
+            self.host, self.port,
+            reuse_address=True,
+            reuse_port=self.reuse_port or None,
+            backlog=LISTEN_BACKLOG
+        )
+        self.start_metrics()
+        self.start_heartbeat()
+        self.print_banner()
+
+        try:
+            async with self.listener:
+                await self.listener.serve_forever()
+        except asyncio.CancelledError:
+            pass  # stop() 关闭了监听
+        finally:
+            # 事件循环关闭前通知客户端，transport 仍可写
+            self.stop()
+
+    def stop(self):
+        """停止服务器"""
+        if not self.running:
+            return
+        if self.listener:
+            self.listener.close()
+        super().stop()
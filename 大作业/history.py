@@ -0,0 +1,167 @@
+import bisect
+import itertools
+import json
+import os
+import threading
+from collections import deque
+from config import HISTORY_DIR, HISTORY_BUFFER_SIZE, HISTORY_SEGMENT_SIZE, HISTORY_MAX_SEGMENTS
+
+
+class MessageHistory:
+    """聊天记录：最近消息保存在内存环形缓冲中，全部消息追加写入磁盘分段日志
+
+    每条消息分配递增的 id，客户端用 id（或时间戳）作为补发游标。
+    分段文件名为 segment_<首条id>.log，每行一条 JSON，超过上限后删除最旧的分段。
+    append 只分配 id 并放入内存缓冲，由 flush 在调用方的锁外写盘，广播不必等待磁盘。
+    """
+
+    def __init__(self, directory=HISTORY_DIR, capacity=HISTORY_BUFFER_SIZE,
+                 segment_size=HISTORY_SEGMENT_SIZE, max_segments=HISTORY_MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.buffer = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # 串行写盘，保证分段文件按 id 顺序
+        self.unwritten = []  # 已分配 id、尚未写盘的消息
+        self.last_id = 0
+        self.segments = []  # 已有分段的首条 id，升序
+        self.segment_file = None
+        self.segment_count = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def segment_path(self, first_id):
+        return os.path.join(self.directory, f"segment_{first_id:012d}.log")
+
+    def list_segments(self):
+        """扫描目录，返回磁盘上各分段的首条 id（升序）"""
+        return sorted(int(name[len('segment_'):-len('.log')]) for name in os.listdir(self.directory)
+                      if name.startswith('segment_') and name.endswith('.log'))
+
+    def load(self):
+        """启动时从磁盘恢复最近的消息与 id"""
+        self.segments = self.list_segments()
+
+        # 从最新的分段往前读，直到填满内存缓冲
+        recent = []
+        for first_id in reversed(self.segments):
+            messages = self.read_segment(first_id)
+            if first_id == self.segments[-1]:
+                self.segment_count = len(messages)
+            recent[:0] = messages
+            if len(recent) >= self.buffer.maxlen:
+                break
+        self.buffer.extend(recent)
+        if self.buffer:
+            self.last_id = self.buffer[-1]['id']
+
+    def read_segment(self, first_id):
+        """读取一个分段中的全部消息（忽略写了一半的最后一行）"""
+        messages = []
+        try:
+            with open(self.segment_path(first_id), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        messages.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+        except FileNotFoundError:
+            pass
+        return messages
+
+    def append(self, message):
+        """记录一条消息，写入 message['id'] 并返回该 id；写盘由之后的 flush 完成"""
+        with self.lock:
+            self.last_id += 1
+            message['id'] = self.last_id
+            self.buffer.append(message)
+            self.unwritten.append(message)
+            return self.last_id
+
+    def flush(self):
+        """把已记录、尚未写盘的消息追加写入分段文件"""
+        with self.write_lock:
+            with self.lock:
+                messages, self.unwritten = self.unwritten, []
+            for message in messages:
+                self.write(message)
+            if messages:
+                self.segment_file.flush()
+
+    def record(self, message):
+        """记录已由其他进程分配 id 并写盘的消息，只更新内存缓冲（分片模式的 worker 使用）"""
+        with self.lock:
+            if message['id'] > self.last_id:
+                self.last_id = message['id']
+                self.buffer.append(message)
+
+    def write(self, message):
+        """追加写入当前分段，写满后换新分段（调用方持有 write_lock）"""
+        if self.segment_file is None or self.segment_count >= self.segment_size:
+            self.roll_segment(message['id'])
+        self.segment_file.write(json.dumps(message, ensure_ascii=False) + '\n')
+        self.segment_count += 1
+
+    def roll_segment(self, first_id):
+        if self.segment_file is not None:
+            self.segment_file.close()
+        # 重启后继续写未满的最后一个分段
+        if self.segments and self.segment_count < self.segment_size and self.segment_file is None:
+            first_id = self.segments[-1]
+        else:
+            self.segments.append(first_id)
+            self.segment_count = 0
+        self.segment_file = open(self.segment_path(first_id), 'a', encoding='utf-8')
+
+        while len(self.segments) > self.max_segments:
+            oldest = self.segments.pop(0)
+            try:
+                os.remove(self.segment_path(oldest))
+            except OSError:
+                pass
+
+    def read_after(self, cursor, limit):
+        """返回 id 大于 cursor 的最多 limit 条消息"""
+        with self.lock:
+            if self.buffer and cursor >= self.buffer[0]['id'] - 1:
+                newer = (message for message in self.buffer if message['id'] > cursor)
+                return list(itertools.islice(newer, limit))
+
+        # 游标早于内存缓冲，从磁盘分段读取（分段可能由其他进程写入，重新扫描目录）
+        segments = self.list_segments()
+        messages = []
+        index = max(0, bisect.bisect_right(segments, cursor + 1) - 1)
+        for first_id in segments[index:]:
+            for message in self.read_segment(first_id):
+                if message['id'] > cursor:
+                    messages.append(message)
+                    if len(messages) >= limit:
+                        return messages
+        return messages
+
+    def cursor_for_time(self, since):
+        """把时间戳游标换算为 id 游标：返回最后一条不晚于 since 的消息 id"""
+        with self.lock:
+            for message in reversed(self.buffer):
+                if message.get('timestamp', 0) <= since:
+                    return message['id']
+            if not self.buffer or self.buffer[0]['id'] == 1:
+                return 0
+
+        segments = self.list_segments()
+        cursor = 0
+        for first_id in segments:
+            for message in self.read_segment(first_id):
+                if message.get('timestamp', 0) > since:
+                    return cursor
+                cursor = message['id']
+        return cursor
+
+    def close(self):
+        self.flush()
+        with self.write_lock:
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
@@ -0,0 +1,361 @@
+"""无界面压测客户端：用与 ChatClient 相同的注册/登录/消息协议驱动大量并发会话
+
+每条消息正文里带上发送时刻，收到广播时计算端到端送达延迟，
+结束后报告延迟分位数、吞吐量和错误数。
+
+用法:
+    python loadgen.py --clients 1000 --rate 0.2 --duration 60
+    python loadgen.py --spawn asyncio --clients 2000 --churn 5   # 自动在本机启动一个服务器
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from config import ACK_BATCH, ACK_INTERVAL
+from protocol import FrameDecoder, FrameError, decode_payload, negotiate
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+CONTENT_TAG = 'lg|'  # 压测消息正文: lg|<发送时刻>|<填充>
+
+
+class LoadStats:
+    """压测统计（只在事件循环线程中修改，不需要加锁）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sent = 0
+        self.delivered = 0
+        self.logins = 0
+        self.sessions_active = 0
+        self.errors = Counter()
+        self.latencies = []
+        self.login_latencies = []
+
+    def reset_window(self):
+        """预热结束后清空计数，只统计稳定阶段"""
+        self.started = time.perf_counter()
+        self.sent = self.delivered = self.logins = 0
+        self.errors.clear()
+        self.latencies = []
+        self.login_latencies = []
+
+
+def percentile(values, p):
+    """values 需已排序，返回毫秒"""
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+class Bot:
+    """一个压测会话：连接、注册、登录、按速率发消息；开启 churn 时周期性下线重连"""
+
+    def __init__(self, index, args, stats, stop):
+        self.username = f"{args.prefix}{index}"
+        self.room = f"room{index % args.rooms}" if args.rooms else None
+        self.args = args
+        self.stats = stats
+        self.stop = stop
+        self.registered = False
+        self.reader = None
+        self.writer = None
+        self.waiters = {}  # 响应类型 -> Future
+        self.codec = negotiate(None, None)
+        self.delivered_seq = self.acked_seq = 0
+        self.last_ack = 0
+
+    async def run(self):
+        while not self.stop.is_set():
+            try:
+                await self.session()
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, FrameError) as e:
+                self.stats.errors[type(e).__name__] += 1
+                await self.sleep(random.uniform(0.5, 1.5))
+            finally:
+                self.close()
+
+    async def sleep(self, delay):
+        """可被 stop 提前唤醒的 sleep"""
+        try:
+            await asyncio.wait_for(self.stop.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def session(self):
+        """一次完整的会话"""
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        self.delivered_seq = self.acked_seq = 0
+        read_task = asyncio.ensure_future(self.read_loop())
+        try:
+            if not self.registered:
+                response = await self.request('register_response', {
+                    'type': 'register', 'username': self.username, 'password': self.args.password})
+                # 重复运行时账号已存在，直接登录即可
+                self.registered = response['success'] or response.get('message') == '用户名已存在'
+                if not self.registered:
+                    self.stats.errors['register_failed'] += 1
+                    return
+
+            login_started = time.perf_counter()
+            response = await self.request('login_response', {
+                'type': 'login', 'username': self.username, 'password': self.args.password,
+                'encodings': [self.args.encoding], 'since': time.time(), 'acks': self.args.acks})
+            if not response['success']:
+                self.stats.errors['login_failed'] += 1
+                return
+            self.stats.login_latencies.append(time.perf_counter() - login_started)
+            self.stats.logins += 1
+            self.codec = negotiate([response.get('encoding')], response.get('compression'))
+            if self.room:
+                response = await self.request('join_room_response', {'type': 'join_room', 'room': self.room})
+                if not response['success']:
+                    self.stats.errors['join_room_failed'] += 1
+                    return
+
+            self.stats.sessions_active += 1
+            try:
+                await self.chat(read_task)
+            finally:
+                self.stats.sessions_active -= 1
+
+            if not self.writer.is_closing():
+                self.send({'type': 'logout', 'username': self.username})
+                await self.writer.drain()
+        finally:
+            read_task.cancel()
+            if read_task.done() and not read_task.cancelled():
+                read_task.exception()
+
+    async def chat(self, read_task):
+        """按泊松过程发送消息，直到会话到期、压测结束或连接断开"""
+        lifetime = random.expovariate(self.args.churn_rate) if self.args.churn_rate else float('inf')
+        ends_at = time.perf_counter() + lifetime
+        padding = 'x' * self.args.size
+        while not self.stop.is_set() and not read_task.done():
+            delay = random.expovariate(self.args.rate) if self.args.rate > 0 else 3600
+            remaining = ends_at - time.perf_counter()
+            if remaining <= delay:
+                await self.sleep(max(remaining, 0))
+                return
+            await self.sleep(delay)
+            if self.stop.is_set() or read_task.done():
+                return
+            message = {
+                'type': 'message',
+                'username': self.username,
+                'content': f"{CONTENT_TAG}{time.perf_counter():.6f}|{padding}",
+                'timestamp': time.time()
+            }
+            if self.room:
+                message['room'] = self.room
+            self.send(message)
+            self.stats.sent += 1
+            await self.writer.drain()
+
+        if read_task.done() and read_task.exception():
+            raise read_task.exception()
+
+    def send(self, message):
+        self.writer.write(self.codec.encode(message))
+
+    async def request(self, response_type, message):
+        """发送请求并等待指定类型的响应"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[response_type] = future
+        self.send(message)
+        await self.writer.drain()
+        return await asyncio.wait_for(future, self.args.timeout)
+
+    async def read_loop(self):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    raise ConnectionResetError("服务器关闭了连接")
+                now = time.perf_counter()
+                for payload in decoder.feed(data):
+                    try:
+                        message = decode_payload(payload)
+                    except ValueError:
+                        self.stats.errors['decode'] += 1
+                        continue
+                    self.handle(message, now)
+                self.send_ack()
+        except (OSError, FrameError) as e:
+            # 连接断开时让等待响应的请求立即失败，不必等到超时
+            for future in self.waiters.values():
+                if not future.done():
+                    future.set_exception(e)
+            self.waiters.clear()
+            raise
+
+    def send_ack(self):
+        """与 ChatClient 相同：攒够一批或隔一段时间累计确认一次"""
+        unacked = self.delivered_seq - self.acked_seq
+        if unacked <= 0 or (unacked < ACK_BATCH and time.monotonic() - self.last_ack < ACK_INTERVAL):
+            return
+        self.acked_seq = self.delivered_seq
+        self.last_ack = time.monotonic()
+        self.send({'type': 'ack', 'seq': self.acked_seq})
+
+    def handle(self, message, now):
+        if message.get('delivery_seq'):
+            self.delivered_seq = message['delivery_seq']
+        msg_type = message.get('type')
+        if msg_type in ('chat_message', 'room_message'):
+            content = message.get('content', '')
+            if content.startswith(CONTENT_TAG):
+                sent_at = float(content.split('|', 2)[1])
+                self.stats.latencies.append(now - sent_at)
+                self.stats.delivered += 1
+        elif msg_type == 'ping':
+            self.send({'type': 'pong', 'timestamp': message.get('timestamp')})
+        elif msg_type == 'error':
+            self.stats.errors['server_error'] += 1
+        elif msg_type in self.waiters:
+            future = self.waiters.pop(msg_type)
+            if not future.done():
+                future.set_result(message)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        for future in self.waiters.values():
+            future.cancel()
+        self.waiters.clear()
+
+
+def raise_fd_limit(needed):
+    """尽量调高打开文件数上限"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < needed:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def spawn_server(mode, port):
+    """在临时目录中启动一个本机服务器"""
+    workdir = tempfile.mkdtemp(prefix='chat_loadgen_')
+    return subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT, '--mode', mode, '--port', str(port), '--metrics-port', '0'],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_for_server(host, port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.1)
+    return False
+
+
+def report(stats, elapsed, final=False):
+    latencies = sorted(stats.latencies)
+    errors = sum(stats.errors.values())
+    line = (f"[{elapsed:6.1f}s] 在线 {stats.sessions_active:>6}  登录 {stats.logins:>6}  "
+            f"发送 {stats.sent:>8}  送达 {stats.delivered:>10}  "
+            f"p50 {percentile(latencies, 0.5):8.1f}ms  p99 {percentile(latencies, 0.99):8.1f}ms  "
+            f"错误 {errors}")
+    print(line)
+    if not final:
+        return
+
+    window = time.perf_counter() - stats.started
+    login = sorted(stats.login_latencies)
+    print()
+    print(f"统计时长        {window:.1f}s")
+    print(f"发送            {stats.sent}  ({stats.sent / window:.1f} 条/秒)")
+    print(f"送达            {stats.delivered}  ({stats.delivered / window:.1f} 条/秒)")
+    print(f"送达延迟(ms)    p50 {percentile(latencies, 0.5):.1f}  p95 {percentile(latencies, 0.95):.1f}"
+          f"  p99 {percentile(latencies, 0.99):.1f}  max {percentile(latencies, 1.0):.1f}")
+    print(f"登录延迟(ms)    p50 {percentile(login, 0.5):.1f}  p95 {percentile(login, 0.95):.1f}"
+          f"  p99 {percentile(login, 0.99):.1f}  次数 {len(login)}")
+    print(f"错误            {dict(stats.errors) or 0}")
+
+
+async def run(args):
+    stats = LoadStats()
+    stop = asyncio.Event()
+    server = None
+    if args.spawn:
+        server = spawn_server(args.spawn, args.port)
+        if not await wait_for_server(args.host, args.port):
+            server.terminate()
+            raise SystemExit(f"{args.spawn} 模式服务器未能启动")
+
+    bots = [Bot(i, args, stats, stop) for i in range(args.clients)]
+    tasks = []
+    started = time.perf_counter()
+    try:
+        # 按 ramp 速率逐步建立连接，避免瞬间打满 accept 队列
+        for bot in bots:
+            tasks.append(asyncio.ensure_future(bot.run()))
+            if args.ramp > 0:
+                await asyncio.sleep(1 / args.ramp)
+
+        await asyncio.sleep(args.warmup)
+        stats.reset_window()
+
+        deadline = time.perf_counter() + args.duration
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(min(args.report_interval, max(deadline - time.perf_counter(), 0)))
+            report(stats, time.perf_counter() - started)
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        report(stats, time.perf_counter() - started, final=True)
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="聊天服务器压测")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--spawn', choices=('thread', 'asyncio'),
+                        help="在临时目录中启动指定模式的本机服务器")
+    parser.add_argument('--clients', type=int, default=100, help="并发会话数")
+    parser.add_argument('--rate', type=float, default=0.5, help="每个会话每秒发送的消息数")
+    parser.add_argument('--size', type=int, default=64, help="消息正文填充长度")
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help="每秒下线重连的会话数（0 表示不重连）")
+    parser.add_argument('--duration', type=float, default=30, help="统计时长（秒）")
+    parser.add_argument('--warmup', type=float, default=2, help="全部连上后的预热时长（秒）")
+    parser.add_argument('--ramp', type=float, default=200, help="每秒新建的会话数（0 表示一次全部建立）")
+    parser.add_argument('--rooms', type=int, default=0,
+                        help="把会话平均分到多少个聊天室，消息只发到所在聊天室（0 表示全部在大厅）")
+    parser.add_argument('--encoding', default='json', choices=('json', 'binary'))
+    parser.add_argument('--acks', action='store_true', help="协商送达确认（消息带序号，客户端累计确认）")
+    parser.add_argument('--prefix', default='bot', help="压测账号用户名前缀")
+    parser.add_argument('--password', default='loadtest')
+    parser.add_argument('--timeout', type=float, default=30, help="注册/登录响应超时（秒）")
+    parser.add_argument('--report-interval', type=float, default=5)
+    args = parser.parse_args()
+    # 全体会话每秒 churn 次重连 => 每个会话的平均在线时长为 clients / churn 秒
+    args.churn_rate = args.churn / args.clients if args.churn > 0 else 0
+
+    raise_fd_limit(args.clients + 256)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+
+from config import LOG_LEVEL, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时直接丢弃日志并计数，处理线程永远不会因为写日志而阻塞"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 格式化交给后台线程，这里只固定消息文本、去掉不能跨线程的异常对象
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BlockingStopListener(logging.handlers.QueueListener):
+    """停止时等待队列腾出位置再放入结束标记，队列已满也能正常写完并退出"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """终端输出: 时间 级别 [模块] 消息 key=value ..."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s [%(name)s] %(message)s', '%H:%M:%S')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """文件输出: 每行一个 JSON 对象"""
+
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _install_fallback():
+    """服务器入口调用 setup_logging 之前（以及导入本模块的工具脚本、压测脚本中）
+    只把警告及以上直接输出到 stderr：不创建日志文件，也不往 stdout 混入日志"""
+    root = logging.getLogger('chat')
+    fallback = logging.StreamHandler(sys.stderr)
+    fallback.setFormatter(ConsoleFormatter())
+    root.handlers[:] = [fallback]
+    root.setLevel(logging.WARNING)
+    root.propagate = False
+
+
+_install_fallback()
+
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                  queue_size=LOG_QUEUE_SIZE):
+    """配置日志管道: 处理线程只把记录放入队列，后台线程写终端与滚动文件
+
+    重复调用时先停掉旧的后台线程再按新参数重建。log_file 为空时只输出到终端。
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(ConsoleFormatter())
+        sinks = [console]
+        if log_file:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+            file_handler.setFormatter(JSONFormatter())
+            sinks.append(file_handler)
+
+        _queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+        root = logging.getLogger('chat')
+        root.handlers[:] = [_queue_handler]
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+        root.propagate = False
+
+        _listener = BlockingStopListener(_queue_handler.queue, *sinks)
+        _listener.start()
+
+
+def shutdown_logging():
+    """写完队列中剩余的日志并停止后台线程"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def dropped_count():
+    """因队列已满被丢弃的日志条数"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+atexit.register(shutdown_logging)
+
+
+class EventLogger:
+    """结构化日志: 消息文本加 key=value 字段
+
+    sampled() 用于每条消息都会触发的事件，按比例抽样且在级别关闭时不做任何格式化。
+    """
+
+    def __init__(self, name, sample_rate=LOG_SAMPLE_RATE):
+        self.logger = logging.getLogger(f'chat.{name}')
+        self.sample_rate = sample_rate
+
+    def log(self, level, message, exc_info=None, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, message, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, message, **fields):
+        self.log(logging.DEBUG, message, **fields)
+
+    def info(self, message, **fields):
+        self.log(logging.INFO, message, **fields)
+
+    def warning(self, message, **fields):
+        self.log(logging.WARNING, message, **fields)
+
+    def error(self, message, **fields):
+        self.log(logging.ERROR, message, **fields)
+
+    def exception(self, message, **fields):
+        self.log(logging.ERROR, message, exc_info=True, **fields)
+
+    def sampled(self, message, level=logging.DEBUG, **fields):
+        """按 sample_rate 抽样记录高频事件"""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        if self.sample_rate < 1:
+            fields['sample_rate'] = self.sample_rate
+        self.log(level, message, **fields)
+
+
+def get_logger(name):
+    return EventLogger(name)
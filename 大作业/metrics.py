@@ -0,0 +1,238 @@
+import bisect
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logger import dropped_count
+
+# 延迟直方图的桶上界（毫秒）
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图，记录一次 O(log 桶数)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶是 +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        """按桶估算分位数（返回所在桶的上界）"""
+        if not self.count:
+            return 0.0
+        target = self.count * p
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'avg_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max,
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+class ServerMetrics:
+    """聊天服务器的计数器与延迟直方图"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.messages_in = Counter()  # 消息类型 -> 条数
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.frames_out = 0
+        self.socket_writes = 0  # 实际写 socket 的次数（合并后一次可携带多帧）
+        self.acked = 0  # 客户端确认送达的消息数
+        self.connections_total = 0
+        self.connections_active = 0
+        self.errors = Counter()
+        self.throttle_actions = Counter()  # 限速处理方式 -> 次数
+        self.throttled_clients = Counter()  # 用户名或地址 -> 被限速次数
+        self.broadcast = LatencyHistogram()
+        self.login = LatencyHistogram()
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections_total += 1
+            self.connections_active += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.connections_active -= 1
+
+    def received(self, nbytes):
+        with self.lock:
+            self.bytes_in += nbytes
+
+    def message(self, msg_type):
+        with self.lock:
+            # type 字段来自客户端，可能不是字符串
+            self.messages_in[msg_type if isinstance(msg_type, str) and msg_type else 'unknown'] += 1
+
+    def sent(self, nbytes, frames=1):
+        with self.lock:
+            self.bytes_out += nbytes
+            self.frames_out += frames
+
+    def socket_write(self):
+        with self.lock:
+            self.socket_writes += 1
+
+    def acked_messages(self, count):
+        with self.lock:
+            self.acked += count
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+    def throttled(self, client, action):
+        with self.lock:
+            self.throttle_actions[action] += 1
+            self.throttled_clients[client] += 1
+
+    def observe_broadcast(self, seconds):
+        with self.lock:
+            self.broadcast.observe(seconds)
+
+    def observe_login(self, seconds):
+        with self.lock:
+            self.login.observe(seconds)
+
+    def snapshot(self, server):
+        """汇总当前指标（含从服务器读取的连接数与发送队列深度）"""
+        depths = {username: conn.queue_depth() for username, conn in server.clients.items()}
+        deepest = sorted(depths.items(), key=lambda item: item[1], reverse=True)[:10]
+        unacked = sum(len(conn.delivery) for conn in server.clients.values() if conn.delivery is not None)
+        with self.lock:
+            return {
+                'uptime_seconds': time.time() - self.started,
+                'active_connections': self.connections_active,
+                'online_users': len(depths),
+                'connections_total': self.connections_total,
+                'messages_in': dict(self.messages_in),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'frames_out': self.frames_out,
+                'socket_writes': self.socket_writes,
+                'acked': self.acked,
+                'unacked': unacked,
+                'errors': dict(self.errors),
+                'log_dropped': dropped_count(),
+                'throttled': {
+                    'total': dict(self.throttle_actions),
+                    'top': dict(self.throttled_clients.most_common(10)),
+                },
+                'broadcast_fanout': self.broadcast.snapshot(),
+                'login_latency': self.login.snapshot(),
+                'queue_depth': {
+                    'total': sum(depths.values()),
+                    'max': max(depths.values(), default=0),
+                    'top': dict(deepest),
+                },
+            }
+
+
+def label_value(value):
+    """按 Prometheus 文本格式转义标签值（用户名、消息类型等来自客户端，可能含 \\ " 或换行）"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_text(stats):
+    """把指标渲染为 Prometheus 风格的纯文本"""
+    lines = [
+        f"chat_uptime_seconds {stats['uptime_seconds']:.0f}",
+        f"chat_active_connections {stats['active_connections']}",
+        f"chat_online_users {stats['online_users']}",
+        f"chat_connections_total {stats['connections_total']}",
+        f"chat_bytes_in_total {stats['bytes_in']}",
+        f"chat_bytes_out_total {stats['bytes_out']}",
+        f"chat_frames_out_total {stats['frames_out']}",
+        f"chat_socket_writes_total {stats['socket_writes']}",
+        f"chat_acked_total {stats['acked']}",
+        f"chat_unacked_messages {stats['unacked']}",
+        f"chat_queue_depth_total {stats['queue_depth']['total']}",
+        f"chat_queue_depth_max {stats['queue_depth']['max']}",
+        f"chat_log_dropped_total {stats['log_dropped']}",
+    ]
+    for msg_type, count in sorted(stats['messages_in'].items()):
+        lines.append(f'chat_messages_in_total{{type="{label_value(msg_type)}"}} {count}')
+    for kind, count in sorted(stats['errors'].items()):
+        lines.append(f'chat_errors_total{{kind="{label_value(kind)}"}} {count}')
+    for action, count in sorted(stats['throttled']['total'].items()):
+        lines.append(f'chat_throttled_total{{action="{label_value(action)}"}} {count}')
+    for client, count in stats['throttled']['top'].items():
+        lines.append(f'chat_client_throttled_total{{client="{label_value(client)}"}} {count}')
+    for username, depth in stats['queue_depth']['top'].items():
+        lines.append(f'chat_client_queue_depth{{user="{label_value(username)}"}} {depth}')
+
+    for name in ('broadcast_fanout', 'login_latency'):
+        histogram = stats[name]
+        cumulative = 0
+        for bucket, count in histogram['buckets'].items():
+            cumulative += count
+            lines.append(f'chat_{name}_ms_bucket{{le="{bucket}"}} {cumulative}')
+        lines.append(f"chat_{name}_ms_count {histogram['count']}")
+        lines.append(f"chat_{name}_ms_sum {histogram['avg_ms'] * histogram['count']:.3f}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHTTPServer:
+    """本地 HTTP 指标接口：/metrics 返回纯文本，/stats 返回 JSON"""
+
+    def __init__(self, server, host, port):
+        chat_server = server
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stats = chat_server.metrics.snapshot(chat_server)
+                if self.path == '/metrics':
+                    body = render_text(stats).encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path == '/stats':
+                    body = json.dumps(stats, ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-http', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
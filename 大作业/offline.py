@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+import time
+from config import OFFLINE_DB_FILE, OFFLINE_QUEUE_MAX, OFFLINE_MESSAGE_TTL
+
+
+class OfflineQueue:
+    """离线私信队列（SQLite 持久化）
+
+    每个收件人最多保留 max_per_user 条，超出时丢弃最旧的；入队超过 ttl 秒的消息过期删除。
+    收件人登录后按 id 顺序分批取出，发出后再删除。
+    """
+
+    def __init__(self, path=OFFLINE_DB_FILE, max_per_user=OFFLINE_QUEUE_MAX, ttl=OFFLINE_MESSAGE_TTL):
+        self.path = path
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS offline_messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " recipient TEXT NOT NULL,"
+            " sender TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " timestamp REAL NOT NULL,"
+            " queued_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_offline_recipient ON offline_messages (recipient, id)"
+        )
+        self.conn.commit()
+
+    def enqueue(self, message):
+        """保存一条发给离线用户的私信"""
+        recipient = message['to']
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO offline_messages (recipient, sender, content, timestamp, queued_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (recipient, message['from'], message['content'], message['timestamp'], time.time())
+            )
+            # 超出上限时只保留最新的 max_per_user 条
+            self.conn.execute(
+                "DELETE FROM offline_messages WHERE recipient = ? AND id <= ("
+                " SELECT id FROM offline_messages WHERE recipient = ?"
+                " ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (recipient, recipient, self.max_per_user)
+            )
+
+    def fetch(self, recipient, limit):
+        """按顺序取出最多 limit 条未过期的私信（不删除）"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM offline_messages WHERE recipient = ? AND queued_at < ?",
+                (recipient, time.time() - self.ttl)
+            )
+            rows = self.conn.execute(
+                "SELECT id, sender, content, timestamp FROM offline_messages"
+                " WHERE recipient = ? ORDER BY id LIMIT ?",
+                (recipient, limit)
+            ).fetchall()
+        return [
+            {'type': 'private_message', 'id': row_id, 'from': sender, 'to': recipient,
+             'content': content, 'timestamp': timestamp}
+            for row_id, sender, content, timestamp in rows
+        ]
+
+    def remove(self, recipient, up_to_id):
+        """删除已送出的私信"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM offline_messages WHERE recipient = ? AND id <= ?", (recipient, up_to_id)
+            )
+
+    def count(self, recipient):
+        """收件人的待收私信数"""
+        with self.lock:
+            (count,) = self.conn.execute(
+                "SELECT COUNT(*) FROM offline_messages WHERE recipient = ?", (recipient,)
+            ).fetchone()
+        return count
+
+    def purge_expired(self):
+        """删除所有过期私信，返回删除条数"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM offline_messages WHERE queued_at < ?", (time.time() - self.ttl,)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,223 @@
+import itertools
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from config import OUTBOUND_QUEUE_SIZE, OUTBOUND_OVERFLOW_POLICY, OUTBOUND_COALESCE_WINDOW, OUTBOUND_MAX_IOV
+
+# 队列溢出策略
+POLICY_DROP = 'drop'              # 丢弃新消息
+POLICY_DISCONNECT = 'disconnect'  # 断开该连接
+POLICY_COALESCE = 'coalesce'      # 新状态覆盖同类（同 key）的旧状态，没有可覆盖的帧时断开该连接
+OVERFLOW_POLICIES = (POLICY_DROP, POLICY_DISCONNECT, POLICY_COALESCE)
+
+# 没有 sendmsg 的平台（Windows）退回拼接后 send
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+
+class OutboundQueue:
+    """单个连接的有界发送队列，元素是已编码好的共享帧"""
+
+    def __init__(self, max_frames=OUTBOUND_QUEUE_SIZE, policy=OUTBOUND_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {policy}")
+        self.frames = deque()  # (key, frame)
+        self.max_frames = max_frames
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.closed = False
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, frame, key=None, reliable=False):
+        """入队；返回 False 表示队列已关闭或按策略需要断开连接
+
+        reliable 的帧（带送达序号）不能丢弃：客户端累计确认，丢掉的序号会被之后的确认一并确认掉，
+        所以队列满时不论哪种策略都断开连接，由续连重传。
+        """
+        with self.lock:
+            if self.closed:
+                return False
+
+            if len(self.frames) >= self.max_frames:
+                if reliable or self.policy == POLICY_DISCONNECT:
+                    return False
+                if self.policy == POLICY_DROP:
+                    self.dropped += 1
+                    return True
+                if not self._evict_for(key):
+                    return False
+
+            self.frames.append((key, frame))
+            return True
+
+    def _evict_for(self, key):
+        """coalesce 策略：移除被新消息取代的同类帧；没有可取代的帧时返回 False
+
+        只有带 key 的状态快照（在线列表等）可以被取代，聊天消息、在线增量等没有 key 的帧不会被丢弃。
+        """
+        if key is None:
+            return False
+        for index, (queued_key, _) in enumerate(self.frames):
+            if queued_key == key:
+                del self.frames[index]
+                self.dropped += 1
+                return True
+        return False
+
+    def pop_all(self):
+        """取出所有待发送帧（不阻塞）"""
+        with self.lock:
+            frames = [frame for _, frame in self.frames]
+            self.frames.clear()
+            return frames
+
+    def close(self):
+        """关闭队列，已入队的帧仍可被取出"""
+        with self.lock:
+            self.closed = True
+
+
+class OutboundWriter(threading.Thread):
+    """线程模式下共享的写线程：非阻塞地排空所有连接的发送队列
+
+    慢速接收者只会让自己的数据留在有界队列中，不会阻塞其他连接：每个连接最多取出一批
+    （上一批写完才取下一批），写不出去的帧留在队列里，队列满时按溢出策略处理。
+    被唤醒后先等待合并窗口，再把每个连接积攒的一批帧用一次 sendmsg 写出，
+    登录等突发场景下一个连接的多条消息只需要一次系统调用。
+    """
+
+    def __init__(self, metrics=None, coalesce_window=OUTBOUND_COALESCE_WINDOW):
+        super().__init__(name='outbound-writer', daemon=True)
+        self.metrics = metrics
+        self.coalesce_window = coalesce_window
+        self.batch_started = 0.0
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        self.lock = threading.Lock()
+        self.scheduled = []
+        self.running = True
+
+    def schedule(self, conn):
+        """通知写线程该连接有新数据或已关闭"""
+        with self.lock:
+            if conn.write_scheduled:
+                return
+            conn.write_scheduled = True
+            self.scheduled.append(conn)
+            need_wakeup = len(self.scheduled) == 1
+            if need_wakeup:
+                self.batch_started = time.monotonic()
+        if need_wakeup:
+            try:
+                self.wakeup_send.send(b'\0')
+            except (BlockingIOError, OSError):
+                pass
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.wakeup_recv:
+                    self._drain_wakeup()
+                else:
+                    self.flush(key.data)
+
+            # 合并窗口：从本批第一个连接被调度起等满窗口，期间入队的帧一起写出
+            if self.coalesce_window and self.scheduled:
+                remaining = self.batch_started + self.coalesce_window - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+
+            with self.lock:
+                scheduled, self.scheduled = self.scheduled, []
+                for conn in scheduled:
+                    conn.write_scheduled = False
+            for conn in scheduled:
+                self.flush(conn)
+
+    def _drain_wakeup(self):
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def flush(self, conn):
+        """尽可能多地写出连接的待发送数据，写不完的部分等 socket 可写后继续"""
+        if conn.released:
+            return
+        if conn.aborted:
+            self._finish(conn)
+            return
+
+        # 上一批写完后才从队列取下一批：写不出去时帧留在有界队列里，溢出策略照常生效
+        if not conn.pending:
+            conn.pending.extend(conn.outbound.pop_all())
+
+        try:
+            while conn.pending:
+                if HAS_SENDMSG:
+                    sent = conn.socket.sendmsg(list(itertools.islice(conn.pending, OUTBOUND_MAX_IOV)))
+                else:
+                    sent = conn.socket.send(b''.join(conn.pending))
+                if self.metrics:
+                    self.metrics.socket_write()
+                self._consume(conn.pending, sent)
+                if not conn.pending:
+                    conn.pending.extend(conn.outbound.pop_all())
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._finish(conn)
+            return
+
+        if conn.pending:
+            self._watch(conn)
+        elif conn.outbound.closed:
+            self._finish(conn)
+        else:
+            self._unwatch(conn)
+
+    @staticmethod
+    def _consume(pending, sent):
+        """从待发送帧中去掉已写出的 sent 字节，部分写出的帧只保留剩余部分"""
+        while sent:
+            head = pending[0]
+            if sent < len(head):
+                pending[0] = memoryview(head)[sent:]
+                return
+            sent -= len(head)
+            pending.popleft()
+
+    def _watch(self, conn):
+        if not conn.watched:
+            self.selector.register(conn.socket, selectors.EVENT_WRITE, conn)
+            conn.watched = True
+
+    def _unwatch(self, conn):
+        if conn.watched:
+            self.selector.unregister(conn.socket)
+            conn.watched = False
+
+    def _finish(self, conn):
+        """连接已关闭且数据已写完（或出错），释放 socket"""
+        try:
+            self._unwatch(conn)
+        except (KeyError, ValueError):
+            conn.watched = False
+        conn.pending.clear()
+        conn.release()
+
+    def stop(self):
+        """停止写线程"""
+        self.running = False
+        try:
+            self.wakeup_send.send(b'\0')
+        except OSError:
+            pass
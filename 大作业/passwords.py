@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from config import PASSWORD_ITERATIONS, PASSWORD_POOL, PASSWORD_POOL_WORKERS
+from logger import get_logger
+
+log = get_logger('users')
+
+# 存储格式: pbkdf2_sha256$迭代次数$盐(hex)$哈希(hex)
+SCHEME = 'pbkdf2_sha256'
+
+
+def hash_password(password, iterations=PASSWORD_ITERATIONS, salt=None):
+    """PBKDF2-SHA256 加盐哈希"""
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored, iterations=PASSWORD_ITERATIONS):
+    """校验密码，返回 (是否正确, 需要升级时的新哈希或 None)
+
+    兼容旧版不加盐的 SHA-256；旧格式或迭代次数偏低的记录在校验成功后重新哈希。
+    损坏的记录（字段数、迭代次数或 hex 不对）按密码错误处理并记录日志。
+    """
+    try:
+        if stored.startswith(SCHEME + '$'):
+            _, stored_iterations, salt_hex, digest_hex = stored.split('$')
+            stored_iterations = int(stored_iterations)
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(),
+                                         bytes.fromhex(salt_hex), stored_iterations)
+            ok = hmac.compare_digest(digest.hex(), digest_hex)
+            needs_rehash = stored_iterations < iterations
+        else:
+            legacy = hashlib.sha256(password.encode()).hexdigest()
+            ok = hmac.compare_digest(legacy, stored)
+            needs_rehash = True
+    except (ValueError, TypeError, AttributeError) as e:
+        log.error("密码记录格式损坏", error=e)
+        return False, None
+
+    if ok and needs_rehash:
+        return True, hash_password(password, iterations)
+    return ok, None
+
+
+def is_password_hash(stored):
+    """是否是可以直接保存的密码哈希（PBKDF2 格式或旧版 SHA-256），用于导入已哈希的账号"""
+    if not isinstance(stored, str):
+        return False
+    if stored.startswith(SCHEME + '$'):
+        parts = stored.split('$')
+        if len(parts) != 4 or not parts[1].isdigit():
+            return False
+        stored_hex = parts[2] + parts[3]
+    else:
+        if len(stored) != 64:
+            return False
+        stored_hex = stored
+    try:
+        bytes.fromhex(stored_hex)
+    except ValueError:
+        return False
+    return True
+
+
+class PasswordHasher:
+    """在线程池/进程池中执行密码哈希与校验，不阻塞 IO 线程
+
+    hashlib.pbkdf2_hmac 计算时会释放 GIL，线程池即可利用多核。
+    """
+
+    def __init__(self, pool=PASSWORD_POOL, workers=PASSWORD_POOL_WORKERS,
+                 iterations=PASSWORD_ITERATIONS):
+        self.pool = pool
+        self.workers = workers or os.cpu_count() or 1
+        self.iterations = iterations
+        self.executor = None
+
+    def _get_executor(self):
+        if self.executor is None:
+            if self.pool == 'process':
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                   thread_name_prefix='password')
+        return self.executor
+
+    def submit_hash(self, password):
+        """提交哈希任务，返回 Future"""
+        return self._get_executor().submit(hash_password, password, self.iterations)
+
+    def submit_verify(self, password, stored):
+        """提交校验任务，返回 Future，结果为 (是否正确, 新哈希或 None)"""
+        return self._get_executor().submit(verify_password, password, stored, self.iterations)
+
+    async def verify_async(self, password, stored):
+        """协程接口"""
+        return await asyncio.wrap_future(self.submit_verify(password, stored))
+
+    def shutdown(self):
+        """关闭线程池/进程池"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+def chain_future(future, callback):
+    """future 完成后在回调线程中执行 callback(结果)，返回新的 Future"""
+    result = Future()
+
+    def on_done(done):
+        try:
+            result.set_result(callback(done.result()))
+        except Exception as e:
+            result.set_exception(e)
+
+    future.add_done_callback(on_done)
+    return result
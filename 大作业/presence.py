@@ -0,0 +1,65 @@
+import threading
+import time
+from concurrent.futures import Future
+from nameindex import NameIndex
+
+
+class PresenceRegistry:
+    """在线状态登记表（只在内存中，由服务器持有，不落盘）"""
+
+    def __init__(self):
+        self.online = {}  # username -> 上线时间，dict 保持上线顺序
+        self.index = NameIndex()  # 在线用户名的有序索引，分页列出时不复制整个列表
+        self.lock = threading.Lock()
+
+    def set_online(self, username):
+        """标记上线；已在线时返回 False"""
+        with self.lock:
+            if username in self.online:
+                return False
+            self.online[username] = time.time()
+            self.index.add(username)
+            return True
+
+    def begin_set_online(self, username):
+        """标记上线，返回结果的 Future（本地登记表立即完成）"""
+        future = Future()
+        future.set_result(self.set_online(username))
+        return future
+
+    def set_offline(self, username):
+        """标记下线；原本不在线时返回 False"""
+        with self.lock:
+            self.index.discard(username)
+            return self.online.pop(username, None) is not None
+
+    def settle(self, username):
+        """申请成功的登录已登记（或放弃）时调用，返回申请期间该用户是否已在别处登录（本地登记表没有这种情况）"""
+        return False
+
+    def is_online(self, username):
+        """检查用户是否在线"""
+        return username in self.online
+
+    def get_online_users(self):
+        """获取在线用户列表（按上线顺序，复制全部用户名；只需部分时用 page）"""
+        with self.lock:
+            return list(self.online)
+
+    def page(self, after=None, limit=100):
+        """按用户名顺序返回排在 after 之后的最多 limit 个在线用户"""
+        return self.index.page(after, limit)
+
+    def search(self, prefix, limit=20):
+        """以 prefix 开头的在线用户"""
+        return self.index.prefix(prefix, limit)
+
+    def count(self):
+        """在线用户数"""
+        return len(self.online)
+
+    def reset(self):
+        """清空所有在线状态"""
+        with self.lock:
+            self.online.clear()
+            self.index.clear()
@@ -0,0 +1,274 @@
+import json
+import struct
+import zlib
+from config import ENCODING, MAX_FRAME_SIZE, COMPRESS_THRESHOLD, COMPRESS_LEVEL
+
+# 帧格式: 4字节大端长度 + 消息体
+# 消息体以 '{' 开头时是普通 JSON（旧客户端）；否则首字节是标志位，后面是正文：
+#   FLAG_ZLIB   正文经过 zlib 压缩
+#   FLAG_JSON   正文是 JSON，否则是紧凑二进制编码
+#   FLAG_SEQ    标志位后先是 8 字节的送达序号，再是正文（只发给协商了送达确认的客户端）
+# 所以接收方不需要知道协商结果也能解码，协商只决定各自发送时用哪种编码。
+FRAME_HEADER = struct.Struct('!I')
+FLAG_ZLIB = 0x01
+FLAG_JSON = 0x02
+FLAG_SEQ = 0x04
+SEQ_HEADER = struct.Struct('!IBQ')  # 帧长度 + 标志位 + 送达序号
+SEQ = struct.Struct('!Q')
+JSON_START = ord('{')
+
+# 需要客户端确认送达的消息类型；解码后序号放在消息的 delivery_seq 字段
+# offline_messages 是一批离线私信，从离线队列取出后只保存在重传窗口里，必须确认
+SEQUENCED_TYPES = frozenset({'chat_message', 'room_message', 'private_message', 'offline_messages'})
+
+ENCODING_JSON = 'json'
+ENCODING_BINARY = 'binary'
+COMPRESSION_ZLIB = 'zlib'
+SUPPORTED_ENCODINGS = (ENCODING_BINARY, ENCODING_JSON)
+SUPPORTED_COMPRESSION = (COMPRESSION_ZLIB,)
+
+# 二进制编码：常用消息类型用类型码 + 固定字段布局，字段名不上线。
+# 字段类型: 'uint' 无符号64位整数, 'double' 浮点, 'str' UTF-8 字符串
+BINARY_SCHEMAS = {
+    'chat_message': (1, (('id', 'uint'), ('timestamp', 'double'), ('username', 'str'), ('content', 'str'))),
+    'message': (2, (('timestamp', 'double'), ('username', 'str'), ('content', 'str'))),
+    'user_joined': (3, (('seq', 'uint'), ('timestamp', 'double'), ('username', 'str'))),
+    'user_left': (4, (('seq', 'uint'), ('timestamp', 'double'), ('username', 'str'))),
+    'system_message': (5, (('timestamp', 'double'), ('content', 'str'))),
+    'room_message': (6, (('timestamp', 'double'), ('room', 'str'), ('username', 'str'), ('content', 'str'))),
+    'private_message': (7, (('timestamp', 'double'), ('from', 'str'), ('to', 'str'), ('content', 'str'))),
+}
+BINARY_TYPE_JSON = 0  # 没有固定布局的消息，类型码 0 后接紧凑 JSON
+
+
+class FrameError(ValueError):
+    """帧格式错误（长度超限等）"""
+
+
+def encode_frame(payload):
+    """为消息体加上长度前缀"""
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+class BinarySchema:
+    """一种消息类型的二进制布局：定长字段与字符串长度一次 struct 打包，字符串正文随后"""
+
+    FORMAT_CHARS = {'uint': 'Q', 'double': 'd'}
+
+    def __init__(self, msg_type, code, fields):
+        self.msg_type = msg_type
+        self.code = code
+        self.fields = fields
+        self.names = frozenset(name for name, _ in fields)
+        self.fixed = [name for name, kind in fields if kind != 'str']
+        self.strings = [name for name, kind in fields if kind == 'str']
+        fmt = '!B' + ''.join(self.FORMAT_CHARS[kind] for _, kind in fields if kind != 'str')
+        self.header = struct.Struct(fmt + 'I' * len(self.strings))
+
+    def accepts(self, message):
+        """消息字段与布局完全一致才用二进制，否则退回 JSON，避免丢字段"""
+        if message.keys() - {'type'} != self.names:
+            return False
+        for name, kind in self.fields:
+            value = message[name]
+            if kind == 'str' and not isinstance(value, str):
+                return False
+            if kind == 'uint' and not (isinstance(value, int) and value >= 0):
+                return False
+            if kind == 'double' and not isinstance(value, (int, float)):
+                return False
+        return True
+
+    def encode(self, message):
+        encoded = [message[name].encode(ENCODING) for name in self.strings]
+        values = [message[name] for name in self.fixed]
+        values.extend(len(data) for data in encoded)
+        return self.header.pack(self.code, *values) + b''.join(encoded)
+
+    def decode(self, body):
+        values = self.header.unpack_from(body)
+        message = {'type': self.msg_type}
+        fixed_count = len(self.fixed)
+        for name, value in zip(self.fixed, values[1:1 + fixed_count]):
+            message[name] = value
+        offset = self.header.size
+        for name, length in zip(self.strings, values[1 + fixed_count:]):
+            message[name] = body[offset:offset + length].decode(ENCODING)
+            offset += length
+        if offset != len(body):
+            raise ValueError("二进制消息长度不符")
+        return message
+
+
+SCHEMAS_BY_TYPE = {msg_type: BinarySchema(msg_type, code, fields)
+                   for msg_type, (code, fields) in BINARY_SCHEMAS.items()}
+SCHEMAS_BY_CODE = {schema.code: schema for schema in SCHEMAS_BY_TYPE.values()}
+
+
+def encode_binary(message):
+    """紧凑二进制编码"""
+    schema = SCHEMAS_BY_TYPE.get(message.get('type'))
+    if schema and schema.accepts(message):
+        return schema.encode(message)
+    return bytes([BINARY_TYPE_JSON]) + json.dumps(
+        message, ensure_ascii=False, separators=(',', ':')).encode(ENCODING)
+
+
+def decode_binary(body):
+    """解析紧凑二进制编码"""
+    if not body:
+        raise ValueError("空的二进制消息")
+    if body[0] == BINARY_TYPE_JSON:
+        return json.loads(body[1:].decode(ENCODING))
+    schema = SCHEMAS_BY_CODE.get(body[0])
+    if schema is None:
+        raise ValueError(f"未知的消息类型码: {body[0]}")
+    return schema.decode(body)
+
+
+class Codec:
+    """一个连接协商出的发送编码"""
+
+    def __init__(self, encoding=ENCODING_JSON, compression=None,
+                 threshold=COMPRESS_THRESHOLD, level=COMPRESS_LEVEL):
+        self.encoding = encoding
+        self.compression = compression
+        self.threshold = threshold
+        self.level = level
+
+    def encode_payload(self, message):
+        """把消息字典编码为消息体"""
+        if self.encoding == ENCODING_BINARY:
+            flags, body = 0, encode_binary(message)
+        else:
+            body = json.dumps(message, ensure_ascii=False).encode(ENCODING)
+            if not self.compression:
+                return body  # 与旧客户端兼容的普通 JSON
+            flags = FLAG_JSON
+
+        if self.compression == COMPRESSION_ZLIB and len(body) >= self.threshold:
+            compressed = zlib.compress(body, self.level)
+            if len(compressed) < len(body):
+                flags, body = flags | FLAG_ZLIB, compressed
+        return bytes([flags]) + body
+
+    def encode(self, message):
+        """把消息字典编码为一帧"""
+        return encode_frame(self.encode_payload(message))
+
+
+_codecs = {}
+
+
+def get_codec(encoding=ENCODING_JSON, compression=None):
+    """取得共享的编码器实例（广播时按编码器缓存已编码的帧）"""
+    key = (encoding, compression)
+    if key not in _codecs:
+        _codecs[key] = Codec(encoding, compression)
+    return _codecs[key]
+
+
+JSON_CODEC = get_codec()
+
+
+def negotiate(encodings, compression):
+    """按客户端提供的偏好选择编码与压缩方式，不认识的一律退回 JSON/不压缩"""
+    encoding = ENCODING_JSON
+    for candidate in encodings or ():
+        if candidate in SUPPORTED_ENCODINGS:
+            encoding = candidate
+            break
+    if compression not in SUPPORTED_COMPRESSION:
+        compression = None
+    return get_codec(encoding, compression)
+
+
+def encode_sequenced(payload, seq):
+    """给已编码的消息体加上送达序号并组成一帧（广播时消息体各连接共享，只有帧头按连接生成）"""
+    if payload[0] == JSON_START:
+        flags, body = FLAG_JSON, payload
+    else:
+        flags, body = payload[0], memoryview(payload)[1:]
+    return SEQ_HEADER.pack(len(body) + SEQ_HEADER.size - FRAME_HEADER.size, flags | FLAG_SEQ, seq) + body
+
+
+def encode_message(message, codec=JSON_CODEC):
+    """把消息字典编码为一帧"""
+    return codec.encode(message)
+
+
+def encode_messages(messages, codec=JSON_CODEC):
+    """把多条消息编码为连续的帧，便于一次发送"""
+    return b''.join(codec.encode(message) for message in messages)
+
+
+def decompress(body, max_size=MAX_FRAME_SIZE):
+    """解压 zlib 正文，解压后超过 max_size 时抛出 ValueError（防止很小的压缩帧解压出巨大的消息）"""
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(body, max_size)
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"解压后超过上限 {max_size}")
+    if not decompressor.eof:
+        raise ValueError("压缩数据不完整")
+    return data
+
+
+def decode_payload(payload, allow_compressed=True):
+    """把消息体解析为消息字典（自动识别 JSON / 二进制 / 压缩），格式错误时抛出 ValueError
+
+    allow_compressed 为 False 时拒绝压缩帧（对方没有协商压缩，不应发来）。
+    """
+    if not payload:
+        raise ValueError("空消息")
+    if payload[0] == JSON_START:
+        return json.loads(payload.decode(ENCODING))
+
+    flags, body = payload[0], payload[1:]
+    try:
+        seq = None
+        if flags & FLAG_SEQ:
+            (seq,) = SEQ.unpack_from(body)
+            body = body[SEQ.size:]
+        if flags & FLAG_ZLIB:
+            if not allow_compressed:
+                raise ValueError("未协商压缩，不接受压缩消息")
+            body = decompress(body)
+        if flags & FLAG_JSON:
+            message = json.loads(body.decode(ENCODING))
+        else:
+            message = decode_binary(body)
+        if seq is not None:
+            message['delivery_seq'] = seq
+        return message
+    except (zlib.error, struct.error) as e:
+        raise ValueError(f"消息解码失败: {e}") from e
+
+
+class FrameDecoder:
+    """增量帧重组缓冲区：处理 TCP 粘包与拆包"""
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        """追加收到的数据，一次返回所有完整帧的消息体"""
+        self.buffer += data
+        payloads = []
+        offset = 0
+        buffer_len = len(self.buffer)
+        header_size = FRAME_HEADER.size
+
+        while buffer_len - offset >= header_size:
+            (length,) = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if length > self.max_frame_size:
+                raise FrameError(f"帧长度 {length} 超过上限 {self.max_frame_size}")
+            end = offset + header_size + length
+            if end > buffer_len:
+                break
+            payloads.append(bytes(self.buffer[offset + header_size:end]))
+            offset = end
+
+        if offset:
+            del self.buffer[:offset]
+        return payloads
@@ -0,0 +1,68 @@
+import time
+from config import (RATE_LIMIT_MESSAGES, RATE_LIMIT_MESSAGE_BURST,
+                    RATE_LIMIT_BYTES, RATE_LIMIT_BYTE_BURST)
+
+# 超出限额时的处理: 'delay' 暂停读取该连接直到令牌足够, 'drop' 丢弃该消息, 'disconnect' 断开连接
+PENALTY_DELAY = 'delay'
+PENALTY_DROP = 'drop'
+PENALTY_DISCONNECT = 'disconnect'
+RATE_LIMIT_PENALTIES = (PENALTY_DELAY, PENALTY_DROP, PENALTY_DISCONNECT)
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积攒 burst 个"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """令牌足够时返回 0，否则返回还需等待的秒数"""
+        self.refill(now)
+        amount = min(amount, self.burst)  # 超过桶容量的单条消息按满桶计
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.burst)
+
+
+class RateLimiter:
+    """单个连接的限速：每秒消息数与每秒字节数两个令牌桶，rate 为 0 表示不限"""
+
+    def __init__(self, messages=RATE_LIMIT_MESSAGES, message_burst=RATE_LIMIT_MESSAGE_BURST,
+                 nbytes=RATE_LIMIT_BYTES, byte_burst=RATE_LIMIT_BYTE_BURST):
+        self.buckets = []
+        if messages:
+            self.buckets.append((TokenBucket(messages, message_burst), False))
+        if nbytes:
+            self.buckets.append((TokenBucket(nbytes, byte_burst), True))
+        self.throttled = 0  # 被限速的消息数
+        self.notified = 0.0
+
+    def should_notify(self, interval=1.0):
+        """丢弃消息时每 interval 秒最多提醒客户端一次"""
+        now = time.monotonic()
+        if now - self.notified < interval:
+            return False
+        self.notified = now
+        return True
+
+    def acquire(self, nbytes):
+        """为一条 nbytes 字节的消息取令牌：成功返回 0，否则不扣令牌并返回需等待的秒数"""
+        now = time.monotonic()
+        wait = 0.0
+        for bucket, by_bytes in self.buckets:
+            wait = max(wait, bucket.wait_time(nbytes if by_bytes else 1, now))
+        if wait:
+            return wait
+        for bucket, by_bytes in self.buckets:
+            bucket.consume(nbytes if by_bytes else 1)
+        return 0.0
@@ -0,0 +1,60 @@
+import threading
+
+
+class ClientRegistry:
+    """在线连接表（username -> 连接），写时复制
+
+    写操作在锁内复制当前字典、修改后整体替换引用；读操作直接取当前快照，不加锁。
+    已发布的快照不再修改，广播遍历期间有人登录或下线也不会出现
+    "dictionary changed size during iteration"，遍历看到的是开始时的一致视图。
+    写一次的代价与在线人数成正比，适合读（广播、查找）远多于写（登录、下线）的场景。
+    """
+
+    def __init__(self):
+        self._snapshot = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """当前快照（只读，调用方不得修改）"""
+        return self._snapshot
+
+    def get(self, username, default=None):
+        return self._snapshot.get(username, default)
+
+    def __contains__(self, username):
+        return username in self._snapshot
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __iter__(self):
+        return iter(self._snapshot)
+
+    def keys(self):
+        return self._snapshot.keys()
+
+    def values(self):
+        return self._snapshot.values()
+
+    def items(self):
+        return self._snapshot.items()
+
+    def add(self, username, conn):
+        """登记连接，返回被替换的旧连接（没有则为 None）"""
+        with self._lock:
+            clients = dict(self._snapshot)
+            previous = clients.get(username)
+            clients[username] = conn
+            self._snapshot = clients
+            return previous
+
+    def remove(self, username, conn=None):
+        """移除用户；指定 conn 时只有当前登记的仍是该连接才移除。返回被移除的连接，未移除时为 None"""
+        with self._lock:
+            current = self._snapshot.get(username)
+            if current is None or (conn is not None and current is not conn):
+                return None
+            clients = dict(self._snapshot)
+            del clients[username]
+            self._snapshot = clients
+            return current
@@ -0,0 +1,72 @@
+import threading
+
+
+class RoomRegistry:
+    """聊天室成员索引：room -> 成员，username -> 所在聊天室
+
+    房间内广播只遍历该房间的成员，开销与房间人数成正比，与在线总人数无关。
+    最后一个成员离开后房间自动删除。
+    """
+
+    def __init__(self):
+        self.rooms = {}  # room -> {username: None}，dict 保持加入顺序
+        self.memberships = {}  # username -> {room: None}
+        self.lock = threading.Lock()
+
+    def join(self, room, username):
+        """加入房间；已在房间中时返回 False"""
+        with self.lock:
+            members = self.rooms.setdefault(room, {})
+            if username in members:
+                return False
+            members[username] = None
+            self.memberships.setdefault(username, {})[room] = None
+            return True
+
+    def leave(self, room, username):
+        """离开房间；原本不在房间中时返回 False"""
+        with self.lock:
+            members = self.rooms.get(room)
+            if members is None or username not in members:
+                return False
+            del members[username]
+            if not members:
+                del self.rooms[room]
+            joined = self.memberships.get(username)
+            if joined is not None:
+                joined.pop(room, None)
+                if not joined:
+                    del self.memberships[username]
+            return True
+
+    def members(self, room):
+        """房间成员列表"""
+        with self.lock:
+            return list(self.rooms.get(room, ()))
+
+    def is_member(self, room, username):
+        return username in self.rooms.get(room, ())
+
+    def rooms_of(self, username):
+        """用户加入的房间列表"""
+        with self.lock:
+            return list(self.memberships.get(username, ()))
+
+    def list_rooms(self):
+        """所有房间及人数"""
+        with self.lock:
+            return [{'name': room, 'members': len(members)} for room, members in self.rooms.items()]
+
+    def snapshot(self):
+        """room -> 成员列表"""
+        with self.lock:
+            return {room: list(members) for room, members in self.rooms.items()}
+
+    def load(self, rooms):
+        """用快照重建索引"""
+        with self.lock:
+            self.rooms = {room: dict.fromkeys(members) for room, members in rooms.items()}
+            self.memberships = {}
+            for room, members in self.rooms.items():
+                for username in members:
+                    self.memberships.setdefault(username, {})[room] = None
@@ -1,48 +1,103 @@
+import argparse
 import socket
 import threading
-import json
 import time
 import os
+from collections import deque
+from config import (SERVER_HOST, SERVER_PORT, BUFFER_SIZE, SERVER_MODE, LISTEN_BACKLOG, SERVER_WORKERS,
+                    OUTBOUND_OVERFLOW_POLICY, HISTORY_REPLAY_DEFAULT, HISTORY_REPLAY_MAX,
+                    HISTORY_REPLAY_BATCH, HISTORY_REPLAY_INTERVAL, METRICS_HOST, METRICS_PORT, ADMIN_USERS,
+                    ROOM_NAME_MAX_LENGTH, ROOMS_PER_USER_MAX, OFFLINE_DRAIN_BATCH, OFFLINE_DRAIN_INTERVAL,
+                    RATE_LIMIT_PENALTY, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, HEARTBEAT_TICK,
+                    HEARTBEAT_WHEEL_SLOTS, LOG_LEVEL, LOG_FILE, RESUME_TOKEN_TTL, PRESENCE_LOG_SIZE,
+                    USER_SEARCH_LIMIT)
+from connection import ClientConnection
+from delivery import DeliveryWindow
+from history import MessageHistory
+from logger import get_logger, setup_logging
+from metrics import MetricsHTTPServer, ServerMetrics
+from offline import OfflineQueue
+from outbound import OVERFLOW_POLICIES, OutboundWriter
+from presence import PresenceRegistry
+from protocol import SEQUENCED_TYPES, FrameError, decode_payload, negotiate
+from ratelimit import PENALTY_DISCONNECT, PENALTY_DROP, RATE_LIMIT_PENALTIES
+from registry import ClientRegistry
+from rooms import RoomRegistry
+from sessions import ResumeSessions
+from timerwheel import TimerWheel
 from user_manager import UserManager
 
+log = get_logger('server')
+
 
 class ChatServer:
-    def __init__(self):
-        self.host = 'localhost'
-        self.port = 8888
-        self.clients = {}  # username -> (socket, address)
-        self.user_manager = UserManager()
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, overflow_policy=OUTBOUND_OVERFLOW_POLICY,
+                 metrics_port=METRICS_PORT, rate_limit_penalty=RATE_LIMIT_PENALTY):
+        self.host = host
+        self.port = port
+        self.overflow_policy = overflow_policy
+        self.rate_limit_penalty = rate_limit_penalty
+        self.metrics = ServerMetrics()
+        self.metrics_port = metrics_port
+        self.metrics_http = None
+        self.writer = OutboundWriter(self.metrics)
+        # username -> ClientConnection，写时复制，广播遍历快照无需加锁
+        self.clients = ClientRegistry()
+        # 在线状态由服务器持有，只在内存中
+        self.presence = PresenceRegistry()
+        # 在线列表版本号：每次上线/下线加一，随增量事件下发
+        self.presence_seq = 0
+        self.presence_lock = threading.RLock()
+        # 最近的上线/下线事件，续连时只补发客户端错过的部分
+        self.presence_log = deque(maxlen=PRESENCE_LOG_SIZE)
+        self.user_manager = UserManager(presence=self.presence)
+        # 最近聊天记录，登录时按游标补发
+        self.history = MessageHistory()
+        self.chat_lock = threading.Lock()
+        # 聊天室成员索引，房间消息只发给房间成员
+        self.rooms = RoomRegistry()
+        # 发给离线用户的私信，登录后分批补发
+        self.offline = OfflineQueue()
+        # 续连令牌，网络中断后客户端可以不经密码校验恢复会话；没有被续连的会话里未确认的私信转入离线队列
+        self.sessions = ResumeSessions(on_drop=self.requeue_unacked)
+        # 心跳检查的时间轮，每个连接登记一项
+        self.heartbeats = TimerWheel(HEARTBEAT_TICK, HEARTBEAT_WHEEL_SLOTS)
         self.running = True
         self.server_socket = None
+        # 多进程分片模式下各 worker 用 SO_REUSEPORT 监听同一端口
+        self.reuse_port = False
 
         # 启动时清理所有在线状态
         self.cleanup_all_users()
 
     def cleanup_all_users(self):
         """启动时清理所有用户的在线状态"""
-        print("清理用户在线状态...")
-        for username in self.user_manager.get_all_users():
-            self.user_manager.force_logout(username)
-        print("用户状态清理完成")
+        self.user_manager.reset_online()
+        expired = self.offline.purge_expired()
+        if expired:
+            log.info("已删除过期的离线私信", count=expired)
+        log.info("用户状态清理完成")
 
     def start(self):
         """启动服务器"""
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket.listen(LISTEN_BACKLOG)
+            self.writer.start()
+            self.start_metrics()
+            self.start_heartbeat()
 
-            print(f"=== Python聊天服务器 ===")
-            print(f"地址: {self.host}:{self.port}")
-            print(f"等待客户端连接...")
-            print("=" * 30)
+            self.print_banner()
 
             # 接受客户端连接
             while self.running:
                 try:
                     client_socket, address = self.server_socket.accept()
-                    print(f"新的客户端连接: {address}")
+                    log.debug("新的客户端连接", addr=address)
 
                     # 为每个客户端创建线程
                     client_thread = threading.Thread(
@@ -54,124 +109,296 @@ class ChatServer:
 
                 except Exception as e:
                     if self.running:
-                        print(f"接受连接时出错: {e}")
+                        log.error("接受连接时出错", error=e)
 
         except Exception as e:
-            print(f"服务器启动失败: {e}")
+            log.exception("服务器启动失败", error=e)
         finally:
             self.stop()
 
+    def start_metrics(self):
+        """启动本地 HTTP 指标接口"""
+        if not self.metrics_port:
+            return
+        try:
+            self.metrics_http = MetricsHTTPServer(self, METRICS_HOST, self.metrics_port)
+            self.metrics_http.start()
+            log.info("指标接口已启动", url=f"http://{METRICS_HOST}:{self.metrics_port}/metrics")
+        except OSError as e:
+            log.error("指标接口启动失败", error=e)
+            self.metrics_http = None
+
+    def print_banner(self):
+        """打印启动信息"""
+        print(f"=== Python聊天服务器 ===")
+        print(f"地址: {self.host}:{self.port}")
+        print(f"等待客户端连接...")
+        print("=" * 30)
+
     def handle_client(self, client_socket, address):
         """处理客户端连接"""
-        username = None
+        conn = ClientConnection(client_socket, address, self.writer,
+                                overflow_policy=self.overflow_policy)
+        self.connection_opened(conn)
         try:
             while self.running:
                 # 接收数据
-                data = client_socket.recv(1024)
+                data = conn.recv(BUFFER_SIZE)
                 if not data:
                     break
 
-                # 处理消息
-                message = data.decode('utf-8')
-                print(f"收到来自 {address} 的消息: {message}")
-
-                try:
-                    msg_data = json.loads(message)
-                    username = self.process_message(client_socket, address, msg_data)
-                except json.JSONDecodeError as e:
-                    print(f"JSON解析错误: {e}")
-                    error_msg = {
-                        'type': 'error',
-                        'message': '消息格式错误'
-                    }
-                    client_socket.send(json.dumps(error_msg).encode('utf-8'))
+                self.handle_data(conn, data)
 
         except Exception as e:
-            print(f"处理客户端 {address} 时出错: {e}")
+            log.error("处理客户端时出错", addr=address, error=e)
         finally:
-            if username and username in self.clients:
-                self.user_manager.logout(username)
-                del self.clients[username]
-                self.broadcast_user_list()
-                self.broadcast_system_message(f"{username} 离开了聊天室")
-                print(f"用户 {username} 已下线")
+            self.handle_disconnect(conn)
+
+    def connection_opened(self, conn):
+        """新连接：计数并登记心跳检查"""
+        self.metrics.connection_opened()
+        self.heartbeats.add(conn, HEARTBEAT_INTERVAL)
+
+    def start_heartbeat(self):
+        """启动心跳线程，每个 tick 转动一次时间轮"""
+        def run():
+            while self.running:
+                time.sleep(HEARTBEAT_TICK)
+                self.heartbeat_tick()
+
+        threading.Thread(target=run, name='heartbeat', daemon=True).start()
+
+    def heartbeat_tick(self):
+        """处理时间轮当前格中到期的连接，顺带清理过期的续连会话"""
+        for conn in self.heartbeats.advance():
+            try:
+                self.check_heartbeat(conn)
+            except Exception as e:
+                log.exception("心跳检查出错", error=e)
+        self.sessions.purge()
+
+    def check_heartbeat(self, conn):
+        """空闲的连接发送 ping；ping 之后一直没有数据的连接断开"""
+        if conn.closed():
+            return
+        now = time.monotonic()
+        if conn.ping_sent is not None and conn.last_seen < conn.ping_sent:
+            if now - conn.ping_sent >= HEARTBEAT_TIMEOUT:
+                self.expire_connection(conn)
+            else:
+                self.heartbeats.add(conn, HEARTBEAT_TIMEOUT - (now - conn.ping_sent))
+            return
+
+        conn.ping_sent = None
+        idle = now - conn.last_seen
+        if idle < HEARTBEAT_INTERVAL:
+            # 期间有过活动，按最近一次活动重新计时
+            self.heartbeats.add(conn, HEARTBEAT_INTERVAL - idle)
+            return
+
+        conn.ping_sent = now
+        self.send_to_client(conn, {'type': 'ping', 'timestamp': time.time()}, key='ping')
+        self.heartbeats.add(conn, HEARTBEAT_TIMEOUT)
+
+    def expire_connection(self, conn):
+        """心跳超时：按正常的下线流程移除用户，再断开连接"""
+        username = conn.username
+        log.info("心跳超时，断开连接", addr=conn.address, user=username)
+        self.metrics.error('heartbeat_timeout')
+        if username and self.detach_client(username, conn):
+            self.broadcast_system_message(f"{username} 连接超时，离开了聊天室")
+        conn.abort()
+
+    def handle_data(self, conn, data):
+        """处理收到的数据（线程模式与事件循环模式共用）"""
+        self.metrics.received(len(data))
+        conn.last_seen = time.monotonic()
+        try:
+            payloads = conn.decoder.feed(data)
+        except FrameError as e:
+            log.warning("帧格式错误", addr=conn.address, error=e)
+            self.metrics.error('frame')
+            self.send_to_client(conn, {'type': 'error', 'message': '消息格式错误'})
+            conn.close()
+            return
+
+        conn.inbox.extend(payloads)
+        self.process_inbox(conn)
+
+    def process_inbox(self, conn):
+        """按限速依次处理已收到的消息，超出限额时按配置延迟、丢弃或断开"""
+        while conn.inbox and not conn.closed():
+            payload = conn.inbox[0]
+            wait = conn.limiter.acquire(len(payload))
+            if not wait:
+                conn.inbox.popleft()
+                self.handle_payload(conn, payload)
+                continue
+
+            conn.limiter.throttled += 1
+            self.metrics.throttled(conn.username or str(conn.address), self.rate_limit_penalty)
+            if self.rate_limit_penalty == PENALTY_DROP:
+                conn.inbox.popleft()
+                if conn.limiter.should_notify():
+                    self.send_to_client(conn, {'type': 'error', 'message': '发送过快，部分消息已被丢弃'})
+            elif self.rate_limit_penalty == PENALTY_DISCONNECT:
+                log.info("发送过快，断开连接", addr=conn.address, user=conn.username)
+                conn.inbox.clear()
+                self.send_to_client(conn, {'type': 'error', 'message': '发送过快，连接已断开'})
+                conn.close()
+                return
+            elif not self.throttle_reading(conn, wait):
+                return
+
+    def throttle_reading(self, conn, wait):
+        """暂停处理该连接 wait 秒；返回 True 表示已等待完毕可继续处理
+
+        线程模式直接在该连接的读线程上等待，期间不读 socket，对端的发送窗口会逐渐被填满。
+        """
+        time.sleep(wait)
+        return True
+
+    def handle_payload(self, conn, payload):
+        """处理一帧完整消息"""
+        try:
+            # 只有协商了压缩的连接才能发来压缩帧
+            msg_data = decode_payload(payload, conn.codec.compression is not None)
+            log.sampled("收到消息", addr=conn.address, type=msg_data.get('type'), bytes=len(payload))
+            self.metrics.message(msg_data.get('type'))
+            self.process_message(conn, msg_data)
+        except ValueError as e:
+            log.warning("消息解析错误", addr=conn.address, error=e)
+            self.metrics.error('decode')
+            error_msg = {
+                'type': 'error',
+                'message': '消息格式错误'
+            }
+            self.send_to_client(conn, error_msg)
+
+    def handle_disconnect(self, conn):
+        """处理连接断开"""
+        username = conn.username
+        if username and self.detach_client(username, conn):
+            self.broadcast_system_message(f"{username} 离开了聊天室")
+            log.info("用户已下线", user=username)
 
-            client_socket.close()
-            print(f"客户端 {address} 断开连接")
+        conn.close()
+        self.metrics.connection_closed()
+        log.debug("客户端断开连接", addr=conn.address)
 
-    def process_message(self, client_socket, address, data):
+    def process_message(self, conn, data):
         """处理消息"""
         msg_type = data.get('type')
-        username = data.get('username')
 
         if msg_type == 'register':
-            self.handle_register(client_socket, data)
-            return None
+            self.handle_register(conn, data)
         elif msg_type == 'login':
-            return self.handle_login(client_socket, address, data)
+            self.handle_login(conn, data)
+        elif msg_type == 'resume':
+            self.handle_resume(conn, data)
         elif msg_type == 'message':
-            self.handle_chat_message(data)
-            return username
+            self.handle_chat_message(conn, data)
         elif msg_type == 'logout':
-            self.handle_logout(data)
-            return username
+            self.handle_logout(conn)
         elif msg_type == 'get_user_list':
-            self.send_user_list(client_socket)
-            return username
+            self.send_user_list(conn)
+        elif msg_type == 'stats':
+            self.handle_stats(conn)
+        elif msg_type == 'ping':
+            self.send_to_client(conn, {'type': 'pong', 'timestamp': data.get('timestamp')})
+        elif msg_type == 'pong':
+            pass  # 收到数据时已更新 last_seen
+        elif msg_type == 'ack':
+            self.handle_ack(conn, data)
+        elif msg_type == 'private_message':
+            self.handle_private_message(conn, data)
+        elif msg_type == 'join_room':
+            self.handle_join_room(conn, data)
+        elif msg_type == 'leave_room':
+            self.handle_leave_room(conn, data)
+        elif msg_type == 'list_rooms':
+            self.handle_list_rooms(conn)
+        elif msg_type == 'search_users':
+            self.handle_search_users(conn, data)
+
+    def handle_ack(self, conn, data):
+        """客户端累计确认：seq 及之前的消息都已收到，从重传窗口移除"""
+        if conn.delivery is not None:
+            self.metrics.acked_messages(conn.delivery.ack(data.get('seq')))
 
-        return username
+    def on_complete(self, future, callback):
+        """等待密码池的结果后执行回调（线程模式：直接在当前处理线程上等待）"""
+        callback(future.result())
 
-    def handle_register(self, client_socket, data):
+    def handle_register(self, conn, data):
         """处理用户注册"""
         username = data.get('username', '').strip()
         password = data.get('password', '').strip()
 
-        print(f"处理注册请求 - 用户名: {username}")
+        log.debug("处理注册请求", user=username)
 
-        success, message = self.user_manager.register(username, password)
+        future = self.user_manager.begin_register(username, password)
+        self.on_complete(future, lambda result: self.finish_register(conn, *result))
 
+    def finish_register(self, conn, success, message):
+        """注册完成，发送结果"""
         response = {
             'type': 'register_response',
             'success': success,
             'message': message
         }
 
-        self.send_to_client(client_socket, response)
-        print(f"注册结果: {message}")
+        self.send_to_client(conn, response)
+        log.info("注册结果", success=success, result=message)
 
-    def handle_login(self, client_socket, address, data):
+    def handle_login(self, conn, data):
         """处理用户登录"""
         username = data.get('username', '').strip()
         password = data.get('password', '').strip()
 
-        print(f"处理登录请求 - 用户名: {username}")
+        log.debug("处理登录请求", user=username)
+        conn.login_started = time.perf_counter()
 
         # 如果用户已在线，先强制下线
         if username in self.clients:
-            print(f"用户 {username} 已在线，强制下线")
-            self.remove_client(username)
+            log.info("用户已在线，强制下线", user=username)
+            self.drop_session(username)
 
-        success, message = self.user_manager.login(username, password)
+        cursor = self.resolve_history_cursor(data)
+        codec = negotiate(data.get('encodings'), data.get('compression'))
+        acks = data.get('acks') is True
+        future = self.user_manager.begin_login(username, password)
+        self.on_complete(future, lambda result: self.finish_login(conn, username, *result, cursor, codec, acks))
 
-        if success:
-            # 登录成功
-            self.clients[username] = (client_socket, address)
+    def finish_login(self, conn, username, success, message, cursor=None, codec=None, acks=False):
+        """密码校验完成，更新在线列表并发送结果"""
+        if conn.login_started is not None:
+            self.metrics.observe_login(time.perf_counter() - conn.login_started)
+            conn.login_started = None
 
-            response = {
-                'type': 'login_response',
-                'success': True,
-                'message': '登录成功',
-                'username': username
-            }
+        if success and conn.closed():
+            # 校验期间客户端已断开
+            self.presence.settle(username)
+            self.user_manager.logout(username)
+            return
 
-            # 发送在线用户列表
-            self.send_user_list(client_socket)
+        if success:
+            # 登记连接与读取补发上界在 chat_lock 内完成（与 publish_chat 互斥）：
+            # 上界及之前的消息只补发，之后的只直播，既不重复也不遗漏
+            with self.chat_lock, self.presence_lock:
+                # 分片模式: 申请上线期间同名用户已在其他 worker 登录，放弃本次登录
+                if self.presence.settle(username):
+                    success, message = False, "用户已在其他位置登录"
+                    self.user_manager.logout(username)
+                else:
+                    response = self.register_login(conn, username, codec, acks)
+                    replay_end = self.history.last_id
 
+        if success:
             # 广播用户上线消息
             self.broadcast_system_message(f"欢迎 {username} 加入聊天室！")
-            self.broadcast_user_list()
 
-            print(f"用户 {username} 登录成功")
+            log.info("用户登录成功", user=username, addr=conn.address)
 
         else:
             # 登录失败
@@ -180,19 +407,293 @@ class ChatServer:
                 'success': False,
                 'message': message
             }
-            print(f"用户 {username} 登录失败: {message}")
+            log.info("用户登录失败", user=username, reason=message)
+
+        self.send_to_client(conn, response)
+
+        # 登录响应之后的消息按协商的编码发送
+        if success and codec is not None:
+            conn.codec = codec
+
+        if success and cursor is not None:
+            # 登记之后的新消息会直接广播过来，只补发到登记时最新的 id
+            self.replay_history(conn, cursor, replay_end)
+
+        if success:
+            self.drain_offline(conn)
+
+    def register_login(self, conn, username, codec, acks):
+        """登记登录成功的连接并通知其他用户，返回登录响应（调用方持有 presence_lock）"""
+        conn.username = username
+
+        response = {
+            'type': 'login_response',
+            'success': True,
+            'message': '登录成功',
+            'username': username,
+            'resume_token': self.sessions.issue(username),
+            'resume_ttl': RESUME_TOKEN_TTL
+        }
+        # 告知协商结果；旧客户端不发 encodings，仍然只收到 JSON
+        if codec is not None:
+            response['encoding'] = codec.encoding
+            response['compression'] = codec.compression
+        # 客户端支持送达确认时，聊天消息与私信带上序号
+        if acks:
+            conn.delivery = DeliveryWindow()
+            response['acks'] = True
+
+        # 新用户收到一份完整列表，其他用户只收到上线增量
+        self.clients.add(username, conn)
+        self.broadcast_presence('user_joined', username, exclude=conn)
+        self.send_user_list(conn)
+        return response
+
+    def handle_resume(self, conn, data):
+        """凭续连令牌恢复会话：不校验密码、不广播欢迎消息，只补发断线期间错过的消息与在线变化"""
+        session = self.sessions.claim(data.get('token'))
+        if session is None:
+            self.send_to_client(conn, {'type': 'resume_response', 'success': False,
+                                       'message': '会话已过期，请重新登录'})
+            return
+
+        cursor = self.resolve_history_cursor(data)
+        codec = negotiate(data.get('encodings'), data.get('compression'))
+        presence_seq = data.get('presence_seq')
+        # 客户端在旧连接上确认到的序号（包括断线前没来得及发出的确认）
+        options = {'acks': data.get('acks') is True, 'acked': data.get('ack')}
+        if session.username in self.clients:
+            # 服务器还没发现旧连接已断开：由新连接直接接替，在线状态不变
+            self.finish_resume(conn, session, True, '', cursor, codec, presence_seq, claimed=False, **options)
+            return
+        future = self.user_manager.begin_resume(session.username)
+        self.on_complete(future, lambda result: self.finish_resume(conn, session, *result, cursor, codec,
+                                                                   presence_seq, **options))
+
+    def finish_resume(self, conn, session, success, message, cursor, codec, presence_seq, acks=False, acked=None,
+                      claimed=True):
+        """恢复在线状态后接替旧连接，补发在线变化、未确认的消息、聊天记录与离线私信，并重新加入原来的聊天室
+
+        claimed 为 False 表示旧连接仍在线、由新连接直接接替，没有重新申请上线。
+        """
+        username = session.username
+        if success and conn.closed():
+            if claimed:
+                self.presence.settle(username)
+            if username not in self.clients:
+                self.user_manager.logout(username)
+            self.requeue_unacked(session)
+            return
+        if success:
+            # 与 finish_login 相同，登记与读取补发上界在 chat_lock 内完成
+            with self.chat_lock, self.presence_lock:
+                # 分片模式: 申请上线期间同名用户已在其他 worker 登录，放弃本次续连
+                if claimed and self.presence.settle(username):
+                    success, message = False, "用户已在其他位置登录"
+                    self.user_manager.logout(username)
+                else:
+                    previous = self.register_resume(conn, session, codec, presence_seq, acks)
+                    replay_end = self.history.last_id
+        if not success:
+            log.info("续连失败", user=username, reason=message)
+            self.requeue_unacked(session)
+            self.send_to_client(conn, {'type': 'resume_response', 'success': False, 'message': message})
+            return
+
+        if previous is not None and previous is not conn:
+            previous.abort()
+            # 服务器还没发现旧连接断开时，未确认的消息在旧连接上
+            window = previous.delivery
+        else:
+            window = session.window
+        log.info("用户已续连", user=username, addr=conn.address)
+
+        if codec is not None:
+            conn.codec = codec
+        for room in session.rooms:
+            if not self.rooms.is_member(room, username):
+                self.publish_room_event('joined', room, username)
+        self.retransmit(conn, window, acked)
+        self.replay_history(conn, cursor, replay_end)
+        self.drain_offline(conn)
+
+    def register_resume(self, conn, session, codec, presence_seq, acks):
+        """登记续连的新连接，发送续连响应与断线期间的在线变化，返回被接替的旧连接"""
+        username = session.username
+        conn.username = username
+        response = {
+            'type': 'resume_response',
+            'success': True,
+            'username': username,
+            'resume_token': self.sessions.issue(username),
+            'resume_ttl': RESUME_TOKEN_TTL,
+            'rooms': session.rooms
+        }
+        if codec is not None:
+            response['encoding'] = codec.encoding
+            response['compression'] = codec.compression
+        if acks:
+            conn.delivery = DeliveryWindow()
+            response['acks'] = True
+
+        with self.presence_lock:
+            previous = self.clients.add(username, conn)
+            if previous is None:
+                self.broadcast_presence('user_joined', username, exclude=conn)
+            self.send_to_client(conn, response)
+            changes = self.presence_changes_since(presence_seq)
+            if changes is None:
+                self.send_user_list(conn)
+            for change in changes or ():
+                self.send_to_client(conn, change)
+        return previous
+
+    def retransmit(self, conn, window, acked):
+        """续连后重传旧连接上客户端没有确认的消息
+
+        公共聊天消息不在这里重传：它们带 id，由 replay_history 从客户端收到的最后一条之后补发，
+        两条路径互不重叠，客户端不会收到重复的消息。
+        """
+        if window is None:
+            return
+        window.ack(acked)
+        missed = [message for message in window.pending() if message['type'] != 'chat_message']
+        for message in missed:
+            self.send_to_client(conn, message)
+        if missed:
+            log.info("重传未确认的消息", user=conn.username, count=len(missed))
+
+    def requeue_unacked(self, session):
+        """续连会话过期或作废：未确认的私信转入离线队列，下次登录时补发"""
+        self.requeue_window(session.username, session.window)
+
+    def requeue_window(self, username, window):
+        """把重传窗口中未确认的私信（包括补发的离线私信批次）转入离线队列"""
+        if window is None:
+            return
+        messages = []
+        for message in window.pending():
+            if message['type'] == 'private_message':
+                messages.append(message)
+            elif message['type'] == 'offline_messages':
+                messages.extend(message['messages'])
+        for message in messages:
+            self.offline.enqueue(message)
+        if messages:
+            log.info("未确认的私信转入离线队列", user=username, count=len(messages))
+
+    def presence_changes_since(self, seq):
+        """版本号 seq 之后的在线变化；已超出保留范围（或没有提供 seq）时返回 None，改发完整列表"""
+        if not isinstance(seq, int):
+            return None
+        with self.presence_lock:
+            if seq >= self.presence_seq:
+                return []
+            if not self.presence_log or self.presence_log[0]['seq'] > seq + 1:
+                return None
+            return [change for change in self.presence_log if change['seq'] > seq]
+
+    def resolve_history_cursor(self, data):
+        """根据登录请求中的 after_id（消息 id）或 since（时间戳）确定补发起点"""
+        last_id = self.history.last_id
+        try:
+            if data.get('after_id') is not None:
+                cursor = int(data['after_id'])
+            elif data.get('since') is not None:
+                cursor = self.history.cursor_for_time(float(data['since']))
+            else:
+                cursor = last_id - HISTORY_REPLAY_DEFAULT
+        except (TypeError, ValueError):
+            cursor = last_id - HISTORY_REPLAY_DEFAULT
+
+        # 离线太久的只补发最近的一部分
+        return max(cursor, last_id - HISTORY_REPLAY_MAX, 0)
+
+    def replay_history(self, conn, cursor, end_id):
+        """分批补发 (cursor, end_id] 的聊天记录，只写入该连接的发送队列，不经过广播"""
+        if conn.closed() or self.clients.get(conn.username) is not conn:
+            return
+
+        # 上一批还没发出去，稍后再试
+        if conn.queue_depth() > HISTORY_REPLAY_BATCH:
+            self.call_later(HISTORY_REPLAY_INTERVAL, self.replay_history, conn, cursor, end_id)
+            return
+
+        limit = min(HISTORY_REPLAY_BATCH, end_id - cursor)
+        messages = self.history.read_after(cursor, limit) if limit > 0 else []
+        if not messages:
+            return
+
+        last_id = messages[-1]['id']
+        more = last_id < end_id
+        self.send_to_client(conn, {
+            'type': 'history',
+            'messages': messages,
+            'more': more
+        })
+        if more:
+            self.call_later(HISTORY_REPLAY_INTERVAL, self.replay_history, conn, last_id, end_id)
 
-        self.send_to_client(client_socket, response)
-        return username if success else None
+    def drain_offline(self, conn):
+        """分批补发离线期间收到的私信，送出后从队列删除
 
-    def handle_chat_message(self, data):
-        """处理聊天消息"""
-        username = data.get('username')
+        协商了送达确认的连接上每批私信记入重传窗口（offline_messages 需要确认），删除后
+        客户端没有确认的批次随续连重传，或在会话作废、过期时由 requeue_window 放回离线队列。
+        旧客户端没有确认机制，送出即删除。
+        """
+        if conn.closed() or self.clients.get(conn.username) is not conn:
+            return
+
+        if conn.queue_depth() > OFFLINE_DRAIN_BATCH:
+            self.call_later(OFFLINE_DRAIN_INTERVAL, self.drain_offline, conn)
+            return
+
+        # 多取一条用来判断后面是否还有
+        messages = self.offline.fetch(conn.username, OFFLINE_DRAIN_BATCH + 1)
+        if not messages:
+            return
+        more = len(messages) > OFFLINE_DRAIN_BATCH
+        messages = messages[:OFFLINE_DRAIN_BATCH]
+
+        self.send_to_client(conn, {
+            'type': 'offline_messages',
+            'messages': messages,
+            'more': more
+        })
+        self.offline.remove(conn.username, messages[-1]['id'])
+        if more:
+            self.call_later(OFFLINE_DRAIN_INTERVAL, self.drain_offline, conn)
+
+    def call_soon(self, callback, *args):
+        """在服务器的处理线程上执行回调（线程模式直接在调用线程执行）"""
+        callback(*args)
+
+    def call_later(self, delay, callback, *args):
+        """延迟执行回调（线程模式使用定时器线程）"""
+        timer = threading.Timer(delay, callback, args)
+        timer.daemon = True
+        timer.start()
+
+    def handle_chat_message(self, conn, data):
+        """处理聊天消息（带 room 字段时只发给该聊天室的成员）
+
+        发送者以该连接登录的用户为准，不使用消息里的 username 字段；时间戳由服务器生成，
+        不使用客户端提供的值（聊天记录按时间戳换算 since 补发游标，要求时间戳单调且是数值）。
+        """
+        username = conn.username
         content = data.get('content', '')
-        timestamp = data.get('timestamp', time.time())
+        timestamp = time.time()
+
+        if not username or self.clients.get(username) is not conn:
+            self.send_to_client(conn, {'type': 'error', 'message': '请先登录'})
+            return
 
-        if username in self.clients and content.strip():
-            print(f"聊天消息 - {username}: {content}")
+        if data.get('room'):
+            self.handle_room_message(conn, data['room'], username, content, timestamp)
+            return
+
+        if content.strip():
+            log.sampled("聊天消息", user=username, length=len(content))
 
             message = {
                 'type': 'chat_message',
@@ -200,38 +701,261 @@ class ChatServer:
                 'content': content,
                 'timestamp': timestamp
             }
+            self.publish_chat(message)
+
+    def publish_chat(self, message):
+        """记录并广播一条聊天消息"""
+        # 记录与广播在同一把锁内，保证各连接收到的消息 id 有序；
+        # 登录/续连也在这把锁内登记连接，见 finish_login（加锁顺序: chat_lock -> presence_lock）
+        with self.chat_lock:
+            self.history.append(message)
             self.broadcast_message(message)
+        # 写盘放在锁外，广播与登录不必排队等待磁盘
+        self.history.flush()
+
+    def handle_private_message(self, conn, data):
+        """处理私信：收件人在线时直接发给对方，否则存入离线队列"""
+        sender = conn.username
+        recipient = str(data.get('to', '')).strip()
+        content = data.get('content', '')
+
+        error = None
+        if not sender or self.clients.get(sender) is not conn:
+            error = "请先登录"
+        elif not content.strip():
+            error = "消息内容不能为空"
+        elif recipient == sender:
+            error = "不能给自己发私信"
+        elif not self.user_manager.user_exists(recipient):
+            error = "用户不存在"
+        if error:
+            self.send_to_client(conn, {'type': 'private_message_response', 'success': False,
+                                       'to': recipient, 'message': error})
+            return
+
+        message = {
+            'type': 'private_message',
+            'from': sender,
+            'to': recipient,
+            'content': content,
+            'timestamp': data.get('timestamp', time.time())
+        }
+        delivered = self.route_private(message)
+        log.sampled("私信", sender=sender, to=recipient, delivered=delivered)
+        self.send_to_client(conn, {
+            'type': 'private_message_response',
+            'success': True,
+            'to': recipient,
+            'queued': not delivered
+        })
+
+    def route_private(self, message):
+        """投递私信，收件人不在线时存入离线队列；返回是否已直接投递"""
+        if self.deliver_private(message):
+            return True
+        self.offline.enqueue(message)
+        return False
+
+    def deliver_private(self, message):
+        """发给本服务器上在线的收件人"""
+        conn = self.clients.get(message['to'])
+        if conn is None:
+            return False
+        self.send_to_client(conn, message)
+        return True
+
+    def handle_room_message(self, conn, room, username, content, timestamp):
+        """处理聊天室消息（调用方已确认 username 是该连接登录的用户）"""
+        if not content.strip():
+            return
+        if not self.rooms.is_member(room, username):
+            self.send_to_client(conn, {'type': 'error', 'message': f'你不在聊天室 {room} 中'})
+            return
+
+        log.sampled("聊天室消息", room=room, user=username, length=len(content))
+        self.publish_room_message(room, {
+            'type': 'room_message',
+            'room': room,
+            'username': username,
+            'content': content,
+            'timestamp': timestamp
+        })
+
+    def publish_room_message(self, room, message):
+        """发给聊天室成员"""
+        self.broadcast_message(message, usernames=self.rooms.members(room))
+
+    def validate_room(self, conn, room):
+        """检查聊天室请求，合法时返回 None"""
+        if not conn.username or self.clients.get(conn.username) is not conn:
+            return "请先登录"
+        if not room or len(room) > ROOM_NAME_MAX_LENGTH:
+            return f"聊天室名称长度应在1-{ROOM_NAME_MAX_LENGTH}个字符之间"
+        return None
+
+    def handle_join_room(self, conn, data):
+        """加入聊天室（不存在时自动创建）"""
+        room = str(data.get('room', '')).strip()
+        error = self.validate_room(conn, room)
+        if (error is None and not self.rooms.is_member(room, conn.username)
+                and len(self.rooms.rooms_of(conn.username)) >= ROOMS_PER_USER_MAX):
+            error = f"最多同时加入 {ROOMS_PER_USER_MAX} 个聊天室"
+        if error:
+            self.send_to_client(conn, {'type': 'join_room_response', 'success': False,
+                                       'room': room, 'message': error})
+            return
+        self.publish_room_event('joined', room, conn.username)
+
+    def handle_leave_room(self, conn, data):
+        """离开聊天室"""
+        room = str(data.get('room', '')).strip()
+        error = self.validate_room(conn, room)
+        if error is None and not self.rooms.is_member(room, conn.username):
+            error = f"你不在聊天室 {room} 中"
+        if error:
+            self.send_to_client(conn, {'type': 'leave_room_response', 'success': False,
+                                       'room': room, 'message': error})
+            return
+        self.publish_room_event('left', room, conn.username)
+
+    def handle_list_rooms(self, conn):
+        """发送聊天室列表与自己加入的聊天室"""
+        self.send_to_client(conn, {
+            'type': 'room_list',
+            'rooms': self.rooms.list_rooms(),
+            'joined': self.rooms.rooms_of(conn.username) if conn.username else []
+        }, key='room_list')
 
-    def handle_logout(self, data):
-        """处理用户登出"""
-        username = data.get('username')
-        if username and username in self.clients:
-            print(f"用户 {username} 主动登出")
-            self.remove_client(username)
+    def publish_room_event(self, event, room, username):
+        """聊天室成员变化"""
+        self.apply_room_event(event, room, username)
 
-    def send_to_client(self, client_socket, message):
-        """发送消息给指定客户端"""
+    def apply_room_event(self, event, room, username):
+        """更新成员索引，通知房间里的其他成员，并回复发起请求的用户"""
+        if event == 'joined':
+            changed = self.rooms.join(room, username)
+        else:
+            changed = self.rooms.leave(room, username)
+
+        conn = self.clients.get(username)
+        if changed:
+            self.broadcast_message({
+                'type': 'room_event',
+                'event': event,
+                'room': room,
+                'username': username,
+                'timestamp': time.time()
+            }, usernames=self.rooms.members(room), exclude=conn)
+        if conn is not None:
+            self.send_to_client(conn, {
+                'type': 'join_room_response' if event == 'joined' else 'leave_room_response',
+                'success': True,
+                'room': room,
+                'members': self.rooms.members(room)
+            })
+
+    def leave_all_rooms(self, username):
+        """用户下线时退出所有聊天室"""
+        for room in self.rooms.rooms_of(username):
+            self.publish_room_event('left', room, username)
+
+    def handle_search_users(self, conn, data):
+        """查找用户：按用户名前缀返回匹配的用户及是否在线"""
+        if not conn.username or self.clients.get(conn.username) is not conn:
+            self.send_to_client(conn, {'type': 'error', 'message': '请先登录'})
+            return
+        prefix = str(data.get('prefix', '')).strip()
         try:
-            message_json = json.dumps(message, ensure_ascii=False)
-            client_socket.send(message_json.encode('utf-8'))
+            limit = min(max(int(data.get('limit', USER_SEARCH_LIMIT)), 1), USER_SEARCH_LIMIT)
+        except (TypeError, ValueError):
+            limit = USER_SEARCH_LIMIT
+        users = self.user_manager.search_users(prefix, limit, online_only=bool(data.get('online_only')))
+        self.send_to_client(conn, {
+            'type': 'search_users_response',
+            'prefix': prefix,
+            'users': [{'username': username, 'online': self.user_manager.is_online(username)}
+                      for username in users]
+        })
+
+    def handle_stats(self, conn):
+        """管理员查询服务器指标"""
+        if conn.username not in ADMIN_USERS or self.clients.get(conn.username) is not conn:
+            self.send_to_client(conn, {'type': 'error', 'message': '没有权限查看统计信息'})
+            return
+        self.send_to_client(conn, {
+            'type': 'stats_response',
+            'stats': self.metrics.snapshot(self),
+            'timestamp': time.time()
+        }, key='stats')
+
+    def handle_logout(self, conn):
+        """处理用户登出（登出该连接登录的用户，不使用消息里的 username 字段）"""
+        username = conn.username
+        if username and self.clients.get(username) is conn:
+            log.info("用户主动登出", user=username)
+            self.sessions.revoke(username)
+            self.remove_client(username, conn)
+
+    def send_to_client(self, conn, message, key=None):
+        """发送消息给指定客户端；key 标记可以被同类新快照取代的状态消息（见 coalesce 溢出策略）"""
+        try:
+            if conn.delivery is not None and message.get('type') in SEQUENCED_TYPES:
+                sent, size = conn.send_tracked(message, conn.codec.encode_payload(message))
+            else:
+                frame = conn.codec.encode(message)
+                sent, size = conn.send_frame(frame, key), len(frame)
+            if not sent:
+                log.warning("发送队列已满，断开连接", addr=conn.address, user=conn.username)
+                self.disconnect_overflowed(conn)
+            else:
+                self.metrics.sent(size)
         except Exception as e:
-            print(f"发送消息到客户端失败: {e}")
+            log.error("发送消息到客户端失败", addr=conn.address, error=e)
 
-    def broadcast_message(self, message):
-        """广播消息给所有客户端"""
-        message_json = json.dumps(message, ensure_ascii=False)
-        disconnected_users = []
+    def broadcast_message(self, message, key=None, exclude=None, usernames=None):
+        """广播消息给所有客户端（或 usernames 指定的用户）：每种编码只编码一次，共享帧放入各连接的发送队列
 
-        for username, (client_socket, _) in self.clients.items():
-            try:
-                client_socket.send(message_json.encode('utf-8'))
-            except Exception as e:
-                print(f"发送消息给 {username} 失败: {e}")
-                disconnected_users.append(username)
+        需要确认送达的消息共享消息体，只为协商了确认的连接单独生成带序号的帧头。
+        """
+        started = time.perf_counter()
+        frames = {}  # codec -> 已编码的帧
+        payloads = {}  # codec -> 已编码的消息体（带序号的帧共用）
+        tracked = message.get('type') in SEQUENCED_TYPES
+        overflowed = []
+        sent_bytes = sent_frames = 0
+
+        if usernames is None:
+            targets = self.clients.items()
+        else:
+            clients = self.clients.snapshot()
+            targets = [(username, clients.get(username)) for username in usernames]
+
+        for username, conn in targets:
+            if conn is None or conn is exclude:
+                continue
+            if tracked and conn.delivery is not None:
+                payload = payloads.get(conn.codec)
+                if payload is None:
+                    payload = payloads[conn.codec] = conn.codec.encode_payload(message)
+                sent, size = conn.send_tracked(message, payload)
+            else:
+                frame = frames.get(conn.codec)
+                if frame is None:
+                    frame = frames[conn.codec] = conn.codec.encode(message)
+                sent, size = conn.send_frame(frame, key), len(frame)
+            if not sent:
+                log.warning("发送队列已满", user=username)
+                overflowed.append(conn)
+            else:
+                sent_bytes += size
+                sent_frames += 1
+
+        self.metrics.sent(sent_bytes, sent_frames)
+        self.metrics.observe_broadcast(time.perf_counter() - started)
 
-        # 清理断开连接的客户端
-        for username in disconnected_users:
-            self.remove_client(username)
+        # 断开跟不上的客户端
+        for conn in overflowed:
+            self.disconnect_overflowed(conn)
 
     def broadcast_system_message(self, content):
         """广播系统消息"""
@@ -240,42 +964,94 @@ class ChatServer:
             'content': content,
             'timestamp': time.time()
         }
+        self.publish(message)
+
+    def publish(self, message):
+        """把消息发给所有在线用户"""
         self.broadcast_message(message)
 
-    def send_user_list(self, client_socket):
-        """发送用户列表给指定客户端"""
-        online_users = list(self.clients.keys())
-        message = {
-            'type': 'user_list',
-            'users': online_users,
-            'timestamp': time.time()
-        }
-        self.send_to_client(client_socket, message)
+    def online_users(self):
+        """当前在线用户名列表"""
+        return list(self.clients.keys())
 
-    def broadcast_user_list(self):
-        """广播用户列表给所有客户端"""
-        online_users = list(self.clients.keys())
-        message = {
-            'type': 'user_list',
-            'users': online_users,
-            'timestamp': time.time()
-        }
-        self.broadcast_message(message)
-        print(f"在线用户列表更新: {online_users}")
+    def send_user_list(self, conn):
+        """发送完整的在线用户列表（快照）给指定客户端，客户端发现版本号缺口时也会请求"""
+        with self.presence_lock:
+            message = {
+                'type': 'user_list',
+                'users': self.online_users(),
+                'seq': self.presence_seq,
+                'timestamp': time.time()
+            }
+            self.send_to_client(conn, message, key='user_list')
 
-    def remove_client(self, username):
-        """移除客户端"""
-        if username in self.clients:
-            print(f"移除客户端: {username}")
+    def broadcast_presence(self, event, username, exclude=None):
+        """广播上线/下线增量事件（user_joined / user_left），带递增版本号"""
+        with self.presence_lock:
+            self.presence_seq += 1
+            message = {
+                'type': event,
+                'username': username,
+                'seq': self.presence_seq,
+                'timestamp': time.time()
+            }
+            self.presence_log.append(message)
+            self.broadcast_message(message, exclude=exclude)
+            log.debug("在线用户变化", event=event, user=username, seq=self.presence_seq)
+
+    def drop_session(self, username):
+        """强制下线：移除并断开该用户当前的连接，作废其续连令牌，连接上未确认的私信转入离线队列
+
+        没有这样的连接时返回 False。
+        """
+        conn = self.clients.get(username)
+        if conn is None or not self.remove_client(username, conn):
+            return False
+        conn.abort()
+        self.sessions.revoke(username)
+        self.requeue_window(username, conn.delivery)
+        return True
+
+    def disconnect_overflowed(self, conn):
+        """发送队列或重传窗口溢出：断开连接
+
+        发送队列满时会话保留，续连后重传未确认的消息。重传窗口满（客户端长时间不确认）时续连也补不回来，
+        会话作废，未确认的私信转入离线队列，重新登录后公共聊天由 replay_history 补发。
+        """
+        username = conn.username
+        if conn.delivery is not None and conn.delivery.overflowed():
+            self.metrics.error('ack_window_overflow')
+            if username and self.remove_client(username, conn):
+                self.sessions.revoke(username)
+                self.requeue_window(username, conn.delivery)
+        else:
+            self.metrics.error('queue_overflow')
+            if username:
+                self.detach_client(username, conn)
+        conn.abort()
+
+    def detach_client(self, username, conn):
+        """连接意外断开：移除连接，令牌在有效期内仍可用来续连，所在聊天室与未确认的消息随会话保留"""
+        rooms = self.rooms.rooms_of(username)
+        if not self.remove_client(username, conn):
+            return False
+        self.sessions.detach(username, rooms, conn.delivery)
+        return True
+
+    def remove_client(self, username, conn=None):
+        """移除客户端；指定 conn 时只有当前登记的仍是该连接才移除，不会误删同名的新会话"""
+        with self.presence_lock:
+            if self.clients.remove(username, conn) is None:
+                return False
             self.user_manager.logout(username)
-            del self.clients[username]
-            self.broadcast_user_list()
-            return True
-        return False
+            self.broadcast_presence('user_left', username)
+        log.debug("移除客户端", user=username)
+        self.leave_all_rooms(username)
+        return True
 
     def stop(self):
         """停止服务器"""
-        print("正在停止服务器...")
+        log.info("正在停止服务器")
         self.running = False
 
         # 通知所有客户端
@@ -287,25 +1063,66 @@ class ChatServer:
         self.broadcast_message(shutdown_msg)
 
         # 关闭所有客户端连接
-        for username, (client_socket, _) in self.clients.items():
-            try:
-                client_socket.close()
-            except:
-                pass
+        clients = self.clients.snapshot()
+        for conn in clients.values():
+            conn.close()
 
         # 清理所有在线状态
-        for username in self.clients.keys():
+        for username in clients:
             self.user_manager.logout(username)
 
         if self.server_socket:
             self.server_socket.close()
 
-        print("服务器已停止")
+        self.history.close()
+        self.offline.close()
+        if self.metrics_http:
+            self.metrics_http.stop()
+            self.metrics_http = None
+        log.info("服务器已停止")
+
+
+def create_server(mode=SERVER_MODE, host=SERVER_HOST, port=SERVER_PORT,
+                  overflow_policy=OUTBOUND_OVERFLOW_POLICY, metrics_port=METRICS_PORT,
+                  rate_limit_penalty=RATE_LIMIT_PENALTY):
+    """按服务模式创建服务器"""
+    if mode == 'asyncio':
+        from event_server import AsyncChatServer
+        return AsyncChatServer(host, port, overflow_policy, metrics_port, rate_limit_penalty)
+    return ChatServer(host, port, overflow_policy, metrics_port, rate_limit_penalty)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Python聊天服务器")
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default=SERVER_MODE,
+                        help="服务模式: thread 每连接一线程, asyncio 单线程事件循环")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--overflow-policy', choices=OVERFLOW_POLICIES, default=OUTBOUND_OVERFLOW_POLICY,
+                        help="客户端发送队列溢出时的处理策略")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help="本地 HTTP 指标接口端口，0 表示不启动")
+    parser.add_argument('--rate-limit-penalty', choices=RATE_LIMIT_PENALTIES, default=RATE_LIMIT_PENALTY,
+                        help="客户端超出接收限速时的处理: delay 暂停读取, drop 丢弃消息, disconnect 断开")
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS,
+                        help="worker 进程数，大于 1 时多个进程共同监听端口并通过本地总线同步")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default=LOG_LEVEL,
+                        help="日志级别，DEBUG 时按抽样比例记录逐条消息")
+    parser.add_argument('--log-file', default=LOG_FILE,
+                        help="滚动日志文件（JSON 行），传空字符串时只输出到终端")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        from sharding import run_sharded
+        run_sharded(args.mode, args.host, args.port, args.workers, args.overflow_policy, args.metrics_port,
+                    args.rate_limit_penalty, args.log_level, args.log_file)
+        raise SystemExit
+
+    setup_logging(args.log_level, args.log_file)
+
     print("正在启动聊天服务器...")
-    server = ChatServer()
+    server = create_server(args.mode, args.host, args.port, args.overflow_policy, args.metrics_port,
+                           args.rate_limit_penalty)
 
     try:
         server.start()
@@ -313,6 +1130,6 @@ if __name__ == "__main__":
         print("\n接收到 Ctrl+C，正在关闭服务器...")
         server.stop()
     except Exception as e:
-        print(f"服务器运行出错: {e}")
+        log.exception("服务器运行出错", error=e)
     finally:
         print("程序退出")
\ No newline at end of file
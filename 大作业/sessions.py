@@ -0,0 +1,121 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from config import RESUME_TOKEN_TTL
+
+
+class Session:
+    """一个可续连的会话"""
+
+    def __init__(self, username):
+        self.username = username
+        self.expires = None  # 连接断开后的过期时间（monotonic），连接存续期间为 None
+        self.rooms = []  # 断开时所在的聊天室，续连后自动重新加入
+        self.window = None  # 断开时未确认的消息（DeliveryWindow），续连后重传
+
+
+class ResumeSessions:
+    """续连令牌：登录时签发，连接意外断开后 ttl 秒内可凭令牌恢复会话
+
+    令牌只能使用一次，恢复成功后换发新令牌；主动登出或重新登录时作废。
+    断开的会话按过期时间顺序排在 detached 中（ttl 固定，断开顺序即过期顺序），
+    清理时只需从头部弹出，不扫描全部会话。
+    断开的会话过期或作废（而不是被续连取回）时调用 on_drop(session)，在锁外执行。
+    """
+
+    def __init__(self, ttl=RESUME_TOKEN_TTL, on_drop=None):
+        self.ttl = ttl
+        self.on_drop = on_drop
+        self.sessions = {}  # token -> Session
+        self.tokens = {}  # username -> token
+        self.detached = OrderedDict()  # token -> None，按过期时间排序
+        self.lock = threading.Lock()
+
+    def issue(self, username):
+        """签发新令牌，同一用户之前的令牌作废"""
+        token = secrets.token_urlsafe(24)
+        with self.lock:
+            dropped = self._purge_expired()
+            dropped += self._revoke(username)
+            self.sessions[token] = Session(username)
+            self.tokens[username] = token
+        self._dropped(dropped)
+        return token
+
+    def detach(self, username, rooms=(), window=None):
+        """连接断开：令牌在 ttl 秒内仍然有效"""
+        with self.lock:
+            token = self.tokens.get(username)
+            if token is None:
+                return
+            session = self.sessions[token]
+            session.expires = time.monotonic() + self.ttl
+            session.rooms = list(rooms)
+            session.window = window
+            self.detached.pop(token, None)
+            self.detached[token] = None
+            dropped = self._purge_expired()
+        self._dropped(dropped)
+
+    def claim(self, token):
+        """凭令牌取回会话（令牌随即作废）；无效或已过期时返回 None
+
+        旧连接尚未被发现断开时会话仍处于连接状态，同样可以取回，由新连接接替。
+        """
+        if not isinstance(token, str):
+            return None
+        with self.lock:
+            dropped = self._purge_expired()
+            session = self.sessions.pop(token, None)
+            if session is not None:
+                self.detached.pop(token, None)
+                if self.tokens.get(session.username) == token:
+                    del self.tokens[session.username]
+        self._dropped(dropped)
+        return session
+
+    def revoke(self, username):
+        """作废用户的令牌（主动登出）"""
+        with self.lock:
+            dropped = self._revoke(username)
+        self._dropped(dropped)
+
+    def purge(self):
+        """清理过期会话（定时调用，使 on_drop 不必等到下一次签发或续连）"""
+        with self.lock:
+            dropped = self._purge_expired()
+        self._dropped(dropped)
+
+    def _dropped(self, sessions):
+        if self.on_drop is not None:
+            for session in sessions:
+                self.on_drop(session)
+
+    def _revoke(self, username):
+        token = self.tokens.pop(username, None)
+        if token is None:
+            return []
+        session = self.sessions.pop(token, None)
+        self.detached.pop(token, None)
+        return [session] if session is not None else []
+
+    def _purge_expired(self):
+        """清理过期会话，返回被清理的会话"""
+        now = time.monotonic()
+        dropped = []
+        while self.detached:
+            token = next(iter(self.detached))
+            session = self.sessions.get(token)
+            if session is not None and session.expires > now:
+                break
+            del self.detached[token]
+            if session is not None:
+                del self.sessions[token]
+                if self.tokens.get(session.username) == token:
+                    del self.tokens[session.username]
+                dropped.append(session)
+        return dropped
+
+    def __len__(self):
+        return len(self.sessions)
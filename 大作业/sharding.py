@@ -0,0 +1,623 @@
+"""多进程分片模式：N 个 worker 进程用 SO_REUSEPORT 监听同一端口，经本地总线同步
+
+总线中心 BusHub 运行在父进程中，通过 Unix 套接字与各 worker 相连，负责：
+  - 为聊天消息分配 id 并写入磁盘聊天记录，再转发给所有 worker
+  - 转发系统广播
+  - 维护全局在线表并统一编号上线/下线事件，保证同一用户全局只有一个会话
+  - 维护聊天室成员索引，房间消息只转发给有该房间成员的 worker
+  - 按全局在线表把私信转发给收件人所在的 worker，收件人已下线时存入离线队列
+所有转发都在同一把锁内按顺序放入各 worker 的发送队列，各 worker 看到的消息顺序一致；
+实际的 socket 写由每个 worker 各自的写线程完成，锁内不做阻塞写。
+"""
+import itertools
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from config import (BUFFER_SIZE, BUS_SOCKET_PATH, BUS_CLAIM_TIMEOUT, BUS_QUEUE_SIZE, USER_STORAGE_BACKEND, LOG_LEVEL,
+                    LOG_FILE)
+from history import MessageHistory
+from logger import get_logger, setup_logging
+from nameindex import NameIndex
+from offline import OfflineQueue
+from presence import PresenceRegistry
+from protocol import FrameDecoder, decode_payload, encode_message
+from rooms import RoomRegistry
+from server import ChatServer
+from user_manager import UserManager
+
+log = get_logger('bus')
+
+
+def default_bus_path(port):
+    """总线套接字路径"""
+    return BUS_SOCKET_PATH or os.path.join(tempfile.gettempdir(), f'chat_bus_{port}.sock')
+
+
+def read_messages(sock):
+    """逐条读取总线消息，连接关闭时结束"""
+    decoder = FrameDecoder()
+    while True:
+        data = sock.recv(BUFFER_SIZE)
+        if not data:
+            return
+        for payload in decoder.feed(data):
+            yield decode_payload(payload)
+
+
+class WorkerLink:
+    """总线中心到一个 worker 的发送端：帧放入队列，由该 worker 专用的写线程发出
+
+    BusHub 在全局锁内转发，只入队不阻塞。worker 的总线处理函数会回写总线（如强制下线后归还名额），
+    若在锁内阻塞写，双方 socket 缓冲写满后会互相等待而死锁；现在 worker 读得慢只会积压它自己的队列，
+    积压超过 max_frames 时断开该 worker（由父进程重新拉起）。
+    """
+
+    def __init__(self, sock, worker_id, max_frames=BUS_QUEUE_SIZE):
+        self.sock = sock
+        self.worker_id = worker_id
+        self.max_frames = max_frames
+        self.frames = deque()
+        self.ready = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name=f'bus-hub-writer-{worker_id}', daemon=True)
+        self.thread.start()
+
+    def send(self, frame):
+        with self.ready:
+            if self.closed:
+                return
+            if len(self.frames) >= self.max_frames:
+                log.error("worker 接收过慢，断开总线连接", worker=self.worker_id, queued=len(self.frames))
+                self._close()
+                return
+            self.frames.append(frame)
+            self.ready.notify()
+
+    def run(self):
+        while True:
+            with self.ready:
+                while not self.frames and not self.closed:
+                    self.ready.wait()
+                if self.closed:
+                    return
+                frames = list(self.frames)
+                self.frames.clear()
+            try:
+                self.sock.sendall(b''.join(frames))
+            except OSError:
+                self.close()
+                return
+
+    def _close(self):
+        """关闭发送端并唤醒读取线程（调用方持有 ready）；socket 由 serve_worker 关闭"""
+        self.closed = True
+        self.frames.clear()
+        self.ready.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        with self.ready:
+            self._close()
+
+
+class BusHub:
+    """总线中心（父进程）：转发广播、分配聊天消息 id、裁决全局登录唯一"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.workers = {}  # worker_id -> WorkerLink
+        self.owners = {}  # username -> 所在 worker，dict 保持上线顺序
+        self.pending = {}  # username -> (worker_id, req)，等原会话下线后再授予
+        self.seq = 0  # 全局在线列表版本号
+        self.history = MessageHistory()
+        self.rooms = RoomRegistry()
+        self.offline = OfflineQueue()
+        self.listener = None
+        self.running = True
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen()
+        threading.Thread(target=self.accept_loop, name='bus-hub', daemon=True).start()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.serve_worker, args=(sock,), daemon=True).start()
+
+    def serve_worker(self, sock):
+        """处理一个 worker 的总线连接"""
+        worker_id = None
+        link = None
+        try:
+            for message in read_messages(sock):
+                with self.lock:
+                    if message['op'] == 'hello':
+                        worker_id = message['worker']
+                        link = self.workers[worker_id] = WorkerLink(sock, worker_id)
+                        self.send(link, {'op': 'snapshot', 'users': list(self.owners), 'seq': self.seq,
+                                         'rooms': self.rooms.snapshot()})
+                    else:
+                        self.handle(worker_id, message)
+        except (OSError, ValueError) as e:
+            log.error("总线连接出错", worker=worker_id, error=e)
+        finally:
+            with self.lock:
+                if link is not None and self.workers.get(worker_id) is link:
+                    del self.workers[worker_id]
+                    # worker 退出后，它上面的用户全部下线
+                    for username, owner in list(self.owners.items()):
+                        if owner == worker_id:
+                            self.release(username)
+            if link is not None:
+                link.close()
+            sock.close()
+
+    def handle(self, worker_id, message):
+        op = message['op']
+        if op == 'chat':
+            self.history.append(message['message'])
+            self.publish({'op': 'chat', 'message': message['message']})
+            self.history.flush()
+        elif op == 'broadcast':
+            self.publish(message)
+        elif op == 'claim':
+            self.claim(worker_id, message['username'], message['req'])
+        elif op == 'release':
+            if self.owners.get(message['username']) == worker_id:
+                self.release(message['username'])
+        elif op == 'private':
+            owner = self.owners.get(message['message']['to'])
+            if owner is None:
+                self.offline.enqueue(message['message'])
+            else:
+                self.send(self.workers.get(owner), message)
+        elif op == 'room_event':
+            self.room_event(message['event'], message['room'], message['username'])
+        elif op == 'room_message':
+            # 只发给有该房间成员的 worker
+            targets = {self.owners.get(username) for username in self.rooms.members(message['room'])}
+            frame = encode_message(message)
+            for target in targets:
+                link = self.workers.get(target)
+                if link is not None:
+                    link.send(frame)
+
+    def room_event(self, event, room, username):
+        """更新总线中心的房间索引并通知所有 worker（各 worker 按同样顺序更新副本）"""
+        if event == 'joined':
+            if username not in self.owners:
+                return
+            self.rooms.join(room, username)
+        else:
+            self.rooms.leave(room, username)
+        self.publish({'op': 'room_event', 'event': event, 'room': room, 'username': username})
+
+    def claim(self, worker_id, username, req):
+        """申请上线：用户在其他 worker 上在线时先让那边下线，等释放后再授予"""
+        owner = self.owners.get(username)
+        if owner is None:
+            self.grant(worker_id, username, req)
+        elif owner == worker_id:
+            self.reply(worker_id, req, username, False)
+        else:
+            previous = self.pending.pop(username, None)
+            if previous:
+                self.reply(*previous, username, False)
+            self.pending[username] = (worker_id, req)
+            self.send(self.workers.get(owner), {'op': 'kick', 'username': username})
+
+    def grant(self, worker_id, username, req):
+        if worker_id not in self.workers:
+            return
+        self.owners[username] = worker_id
+        self.reply(worker_id, req, username, True)
+        self.publish_presence('user_joined', username)
+
+    def release(self, username):
+        del self.owners[username]
+        self.publish_presence('user_left', username)
+        for room in self.rooms.rooms_of(username):
+            self.room_event('left', room, username)
+        waiting = self.pending.pop(username, None)
+        if waiting:
+            worker_id, req = waiting
+            self.grant(worker_id, username, req)
+
+    def publish_presence(self, event, username):
+        self.seq += 1
+        self.publish({'op': 'presence', 'event': event, 'username': username, 'seq': self.seq})
+
+    def reply(self, worker_id, req, username, ok):
+        self.send(self.workers.get(worker_id), {'op': 'reply', 'req': req, 'username': username, 'ok': ok})
+
+    def send(self, link, message):
+        if link is not None:
+            link.send(encode_message(message))
+
+    def publish(self, message):
+        """发给所有 worker（调用方持有 self.lock）"""
+        frame = encode_message(message)
+        for link in self.workers.values():
+            link.send(frame)
+
+    def stop(self):
+        self.running = False
+        if self.listener:
+            self.listener.close()
+        with self.lock:
+            for link in self.workers.values():
+                link.close()
+            self.workers.clear()
+        self.history.close()
+        self.offline.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class BusClient:
+    """worker 一侧的总线连接：后台线程读取总线消息，交给 handler 处理"""
+
+    def __init__(self, path, worker_id, handler):
+        self.worker_id = worker_id
+        self.handler = handler
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.send_lock = threading.Lock()
+        self.requests = {}  # req -> Future
+        self.request_ids = itertools.count(1)
+        self.thread = threading.Thread(target=self.run, name='bus-client', daemon=True)
+
+    def start(self):
+        self.send({'op': 'hello', 'worker': self.worker_id})
+        self.thread.start()
+
+    def send(self, message):
+        try:
+            with self.send_lock:
+                self.sock.sendall(encode_message(message))
+        except OSError as e:
+            log.error("总线发送失败", error=e)
+
+    def claim(self, username, timeout=BUS_CLAIM_TIMEOUT):
+        """向总线中心申请上线，返回是否成功（会阻塞，只在密码池线程中调用）"""
+        req = next(self.request_ids)
+        future = self.requests[req] = Future()
+        self.send({'op': 'claim', 'username': username, 'req': req})
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            return False
+        finally:
+            self.requests.pop(req, None)
+
+    def run(self):
+        try:
+            for message in read_messages(self.sock):
+                if message['op'] == 'reply':
+                    future = self.requests.pop(message['req'], None)
+                    if future is not None:
+                        future.set_result(message['ok'])
+                    elif message['ok']:
+                        # 申请已超时放弃，归还名额
+                        self.send({'op': 'release', 'username': message['username']})
+                else:
+                    self.handler(message)
+        except (OSError, ValueError) as e:
+            log.error("总线连接出错", error=e)
+        self.handler({'op': 'closed'})
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class BusPresence(PresenceRegistry):
+    """分片模式的在线状态：本地只是全局在线表的副本，上线要向总线中心申请"""
+
+    def __init__(self, bus=None):
+        super().__init__()
+        self.bus = bus
+        # 进行中的申请数（从发出申请到登录登记进 clients 或放弃），以及期间收到强制下线的用户
+        self.claiming = {}
+        self.kicked = set()
+
+    def set_online(self, username):
+        with self.lock:
+            self.claiming[username] = self.claiming.get(username, 0) + 1
+        if self.bus.claim(username):
+            return True
+        with self.lock:
+            count = self.claiming.pop(username) - 1
+            if count:
+                self.claiming[username] = count
+                return False
+            kicked = username in self.kicked
+            self.kicked.discard(username)
+        if kicked:
+            # 没有申请成功的登录来处理这次强制下线，直接归还名额
+            self.set_offline(username)
+        return False
+
+    def defer_kick(self, username):
+        """有进行中的申请时记下强制下线，由申请成功的登录在登记时放弃；返回是否已记下"""
+        with self.lock:
+            if not self.claiming.get(username):
+                return False
+            self.kicked.add(username)
+            return True
+
+    def settle(self, username):
+        with self.lock:
+            count = self.claiming.pop(username, 0) - 1
+            if count > 0:
+                self.claiming[username] = count
+            kicked = username in self.kicked
+            self.kicked.discard(username)
+            return kicked
+
+    def begin_set_online(self, username):
+        """向总线申请需要等待应答，放到后台线程，不阻塞事件循环"""
+        future = Future()
+        threading.Thread(target=lambda: future.set_result(self.set_online(username)),
+                         name='bus-claim', daemon=True).start()
+        return future
+
+    def set_offline(self, username):
+        self.bus.send({'op': 'release', 'username': username})
+        return True
+
+    def reset(self):
+        """全局在线状态由总线中心维护，worker 启动时不清空"""
+
+    def load(self, users):
+        """用总线中心的快照初始化副本"""
+        with self.lock:
+            now = time.time()
+            self.online = {username: now for username in users}
+            self.index = NameIndex(users)
+
+    def apply(self, event, username):
+        """应用总线中心下发的上线/下线事件"""
+        with self.lock:
+            if event == 'user_joined':
+                self.online[username] = time.time()
+                self.index.add(username)
+            else:
+                self.online.pop(username, None)
+                self.index.discard(username)
+
+
+class ShardedServerMixin:
+    """分片模式 worker：聊天消息、系统广播与在线状态经总线同步到所有 worker"""
+
+    def setup_bus(self, worker_id, bus_path):
+        self.worker_id = worker_id
+        self.reuse_port = True
+        self.presence = self.user_manager.presence = BusPresence()
+        self.bus = BusClient(bus_path, worker_id, self.on_bus_message)
+        self.presence.bus = self.bus
+        self.bus.start()
+
+    def on_bus_message(self, message):
+        """总线读取线程收到消息，转到服务器的处理线程执行"""
+        op = message['op']
+        try:
+            if op == 'snapshot':
+                self.presence.load(message['users'])
+                self.rooms.load(message['rooms'])
+                with self.presence_lock:
+                    self.presence_seq = message['seq']
+            elif op == 'chat':
+                self.call_soon(self.deliver_chat, message['message'])
+            elif op == 'broadcast':
+                self.call_soon(self.broadcast_message, message['message'])
+            elif op == 'presence':
+                self.call_soon(self.apply_presence, message['event'], message['username'], message['seq'])
+            elif op == 'room_event':
+                self.call_soon(self.apply_room_event, message['event'], message['room'], message['username'])
+            elif op == 'room_message':
+                self.call_soon(self.deliver_room_message, message['room'], message['message'])
+            elif op == 'private':
+                self.call_soon(self.deliver_forwarded_private, message['message'])
+            elif op == 'kick':
+                self.call_soon(self.kick, message['username'])
+            elif op == 'closed' and self.running:
+                log.warning("总线已断开，worker 退出")
+                self.call_soon(self.stop)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def deliver_chat(self, message):
+        """总线中心已分配 id 的聊天消息：记入内存记录并发给本 worker 的用户"""
+        with self.chat_lock:
+            self.history.record(message)
+            self.broadcast_message(message)
+
+    def apply_presence(self, event, username, seq):
+        with self.presence_lock:
+            self.presence.apply(event, username)
+            self.presence_seq = seq
+            message = {
+                'type': event,
+                'username': username,
+                'seq': seq,
+                'timestamp': time.time()
+            }
+            self.presence_log.append(message)
+            self.broadcast_message(message)
+
+    def deliver_room_message(self, room, message):
+        """发给本 worker 上的房间成员"""
+        self.broadcast_message(message, usernames=self.rooms.members(room))
+
+    def kick(self, username):
+        """用户在其他 worker 上重新登录：断开本 worker 上的会话并归还名额
+
+        名额可能已授予本 worker 上还没登记进 clients 的登录，此时不能直接归还，
+        否则两边会同时登录成功；改为记下，由那次登录登记时放弃（见 finish_login/finish_resume）。
+        与登记在同一把 presence_lock 内，两者不会交错。
+        """
+        with self.presence_lock:
+            log.info("用户在其他 worker 登录，强制下线", user=username)
+            dropped = self.drop_session(username)
+            if self.presence.defer_kick(username):
+                return
+            if not dropped:
+                self.presence.set_offline(username)
+
+    def publish_chat(self, message):
+        self.bus.send({'op': 'chat', 'message': message})
+
+    def publish(self, message):
+        self.bus.send({'op': 'broadcast', 'message': message})
+
+    def route_private(self, message):
+        """收件人在其他 worker 上在线时经总线转发"""
+        if self.deliver_private(message):
+            return True
+        if self.presence.is_online(message['to']):
+            self.bus.send({'op': 'private', 'message': message})
+            return True
+        self.offline.enqueue(message)
+        return False
+
+    def deliver_forwarded_private(self, message):
+        """其他 worker 转发来的私信；收件人刚好已离开本 worker 时存入离线队列，不再转发"""
+        if not self.deliver_private(message):
+            self.offline.enqueue(message)
+
+    def publish_room_message(self, room, message):
+        self.bus.send({'op': 'room_message', 'room': room, 'message': message})
+
+    def publish_room_event(self, event, room, username):
+        self.bus.send({'op': 'room_event', 'event': event, 'room': room, 'username': username})
+
+    def leave_all_rooms(self, username):
+        """下线时由总线中心统一退出所有聊天室，见 BusHub.release"""
+
+    def broadcast_presence(self, event, username, exclude=None):
+        """上线/下线事件由总线中心统一编号后下发，见 apply_presence"""
+
+    def online_users(self):
+        return self.presence.get_online_users()
+
+    def print_banner(self):
+        super().print_banner()
+        print(f"worker {self.worker_id} (pid {os.getpid()})")
+
+    def stop(self):
+        if not self.running:
+            return
+        super().stop()
+        self.bus.close()
+
+
+class ShardedChatServer(ShardedServerMixin, ChatServer):
+    """线程模式的分片 worker"""
+
+
+def create_sharded_server(mode, host, port, overflow_policy, metrics_port, rate_limit_penalty):
+    if mode == 'asyncio':
+        from event_server import AsyncChatServer
+
+        class ShardedAsyncChatServer(ShardedServerMixin, AsyncChatServer):
+            """事件循环模式的分片 worker"""
+
+        return ShardedAsyncChatServer(host, port, overflow_policy, metrics_port, rate_limit_penalty)
+    return ShardedChatServer(host, port, overflow_policy, metrics_port, rate_limit_penalty)
+
+
+def worker_log_file(log_file, worker_id):
+    """每个 worker 写各自的日志文件（server.log -> server-0.log），避免多进程同时滚动同一文件"""
+    if not log_file:
+        return log_file
+    root, ext = os.path.splitext(log_file)
+    return f'{root}-{worker_id}{ext}'
+
+
+def run_worker(worker_id, mode, host, port, overflow_policy, metrics_port, rate_limit_penalty, bus_path,
+               log_level=LOG_LEVEL, log_file=LOG_FILE):
+    """worker 进程入口"""
+    setup_logging(log_level, worker_log_file(log_file, worker_id))
+    # 每个 worker 的指标接口使用不同端口
+    server = create_sharded_server(mode, host, port, overflow_policy,
+                                   metrics_port + worker_id if metrics_port else 0, rate_limit_penalty)
+    server.setup_bus(worker_id, bus_path)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+def run_sharded(mode, host, port, workers, overflow_policy, metrics_port, rate_limit_penalty,
+                log_level=LOG_LEVEL, log_file=LOG_FILE):
+    """父进程：启动总线中心与 worker 进程，worker 异常退出时重新拉起"""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise SystemExit("当前平台不支持 SO_REUSEPORT，不能使用多进程模式")
+    if USER_STORAGE_BACKEND != 'sqlite':
+        raise SystemExit("多进程模式需要 sqlite 用户存储后端")
+
+    # 在启动 worker 之前完成 users.json 的首次导入，避免多个进程同时导入
+    setup_logging(log_level, log_file)
+    UserManager().storage.close()
+
+    bus_path = default_bus_path(port)
+    hub = BusHub(bus_path)
+    hub.start()
+
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+
+    def spawn(worker_id):
+        process = context.Process(
+            target=run_worker, name=f'chat-worker-{worker_id}', daemon=True,
+            args=(worker_id, mode, host, port, overflow_policy, metrics_port, rate_limit_penalty, bus_path,
+                  log_level, log_file))
+        process.start()
+        processes[worker_id] = process
+
+    # 收到 SIGTERM 时同样走下面的清理流程，关闭所有 worker
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print(f"正在启动 {workers} 个 worker ({mode} 模式)，总线: {bus_path}")
+    for worker_id in range(workers):
+        spawn(worker_id)
+
+    try:
+        while True:
+            time.sleep(1)
+            for worker_id, process in list(processes.items()):
+                if not process.is_alive():
+                    log.warning("worker 已退出，重新启动", worker=worker_id, exitcode=process.exitcode)
+                    spawn(worker_id)
+    except KeyboardInterrupt:
+        print("\n接收到 Ctrl+C，正在关闭服务器...")
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(5)
+        hub.stop()
+        print("程序退出")
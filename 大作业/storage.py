@@ -0,0 +1,357 @@
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+from nameindex import NameIndex
+
+# 批量导入/导出的账号文件格式；导出时密码只写哈希
+ACCOUNT_FORMATS = ('csv', 'jsonl')
+ACCOUNT_FIELDS = ('username', 'password_hash', 'register_time', 'last_login')
+
+
+class UserStorage:
+    """用户数据存储后端接口"""
+
+    def load_all(self):
+        """加载全部用户，返回 username -> info 字典"""
+        raise NotImplementedError
+
+    def load_user(self, username):
+        """读取单个用户，不存在时返回 None"""
+        return self.load_all().get(username)
+
+    def save_user(self, username, info):
+        """保存（新增或更新）单个用户"""
+        raise NotImplementedError
+
+    def add_user(self, username, info):
+        """新增用户，同名用户已存在时返回 False（多个进程共用存储时由存储保证唯一）"""
+        if self.load_user(username) is not None:
+            return False
+        self.save_user(username, info)
+        return True
+
+    def delete_user(self, username):
+        """删除单个用户"""
+        raise NotImplementedError
+
+    def save_all(self, users):
+        """整体保存全部用户"""
+        raise NotImplementedError
+
+    def add_users(self, users, overwrite=False):
+        """批量新增用户（overwrite 时覆盖同名用户），一次提交；返回写入的数量"""
+        count = 0
+        for username, info in users.items():
+            if overwrite:
+                self.save_user(username, info)
+                count += 1
+            elif self.add_user(username, info):
+                count += 1
+        return count
+
+    def iter_users(self, batch_size=1000):
+        """按用户名顺序逐个产出 (username, info)，不一次性构造全部用户"""
+        yield from sorted(self.load_all().items())
+
+    def count_users(self):
+        """用户总数"""
+        return len(self.load_all())
+
+    def page_users(self, after=None, limit=100):
+        """按用户名顺序返回排在 after 之后的最多 limit 个用户名"""
+        names = sorted(self.load_all())
+        if after is not None:
+            names = [name for name in names if name > after]
+        return names[:limit]
+
+    def search_users(self, prefix, limit=20):
+        """以 prefix 开头的前 limit 个用户名（按用户名排序）"""
+        return sorted(name for name in self.load_all() if name.startswith(prefix))[:limit]
+
+    def close(self):
+        """关闭存储"""
+
+
+class JsonFileStorage(UserStorage):
+    """JSON 文件存储：每次修改整体重写文件（先写临时文件再替换，避免写一半损坏）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.users = {}
+        self.index = NameIndex()  # 有序用户名，分页与前缀查找用
+        self.lock = threading.Lock()
+
+    def load_all(self):
+        self.users = load_json_users(self.path)
+        self.index = NameIndex(self.users)
+        return dict(self.users)
+
+    def load_user(self, username):
+        # 文件只由本进程写入，内存中的副本即最新数据，不必每次重读整个文件
+        return self.users.get(username)
+
+    def save_user(self, username, info):
+        with self.lock:
+            self.users[username] = info
+            self.index.add(username)
+            dump_json_users(self.users, self.path)
+
+    def delete_user(self, username):
+        with self.lock:
+            self.users.pop(username, None)
+            self.index.discard(username)
+            dump_json_users(self.users, self.path)
+
+    def save_all(self, users):
+        with self.lock:
+            self.users = dict(users)
+            self.index = NameIndex(self.users)
+            dump_json_users(self.users, self.path)
+
+    def add_users(self, users, overwrite=False):
+        with self.lock:
+            count = 0
+            for username, info in users.items():
+                if overwrite or username not in self.users:
+                    self.users[username] = info
+                    count += 1
+            self.index = NameIndex(self.users)
+            dump_json_users(self.users, self.path)
+            return count
+
+    def iter_users(self, batch_size=1000):
+        for username in self.index:
+            info = self.users.get(username)
+            if info is not None:
+                yield username, info
+
+    def count_users(self):
+        return len(self.users)
+
+    def page_users(self, after=None, limit=100):
+        return self.index.page(after, limit)
+
+    def search_users(self, prefix, limit=20):
+        return self.index.prefix(prefix, limit)
+
+
+class SQLiteStorage(UserStorage):
+    """SQLite 存储：单个用户的修改只写一行
+
+    online 列只为兼容旧数据保留，在线状态由 PresenceRegistry 在内存中维护。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " username TEXT PRIMARY KEY,"
+            " password TEXT NOT NULL,"
+            " online INTEGER NOT NULL DEFAULT 0,"
+            " register_time TEXT,"
+            " last_login TEXT)"
+        )
+        self.conn.commit()
+
+    def _row(self, username, info):
+        return (username, info.get('password'), info.get('register_time'), info.get('last_login'))
+
+    def load_all(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT username, password, register_time, last_login FROM users ORDER BY username"
+            ).fetchall()
+        return {
+            username: {
+                'password': password,
+                'register_time': register_time,
+                'last_login': last_login
+            }
+            for username, password, register_time, last_login in rows
+        }
+
+    def load_user(self, username):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT password, register_time, last_login FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None:
+            return None
+        password, register_time, last_login = row
+        return {'password': password, 'register_time': register_time, 'last_login': last_login}
+
+    def is_empty(self):
+        """数据库中是否还没有用户"""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+
+    def save_user(self, username, info):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO users (username, password, register_time, last_login)"
+                " VALUES (?, ?, ?, ?)",
+                self._row(username, info)
+            )
+
+    def add_user(self, username, info):
+        try:
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "INSERT INTO users (username, password, register_time, last_login)"
+                    " VALUES (?, ?, ?, ?)",
+                    self._row(username, info)
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def delete_user(self, username):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM users WHERE username = ?", (username,))
+
+    def add_users(self, users, overwrite=False):
+        verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                f"{verb} INTO users (username, password, register_time, last_login) VALUES (?, ?, ?, ?)",
+                (self._row(username, info) for username, info in users.items())
+            )
+            return self.conn.total_changes - before
+
+    def iter_users(self, batch_size=1000):
+        """按用户名分页读取（WHERE username > 上一页末尾），每页单独加锁，导出期间不阻塞其他读写"""
+        last = ''
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT username, password, register_time, last_login FROM users"
+                    " WHERE username > ? ORDER BY username LIMIT ?", (last, batch_size)
+                ).fetchall()
+            for username, password, register_time, last_login in rows:
+                yield username, {'password': password, 'register_time': register_time, 'last_login': last_login}
+            if len(rows) < batch_size:
+                return
+            last = rows[-1][0]
+
+    def count_users(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def page_users(self, after=None, limit=100):
+        """主键索引上的范围扫描，与翻到第几页无关"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT username FROM users WHERE username > ? ORDER BY username LIMIT ?",
+                (after or '', limit)
+            ).fetchall()
+        return [username for (username,) in rows]
+
+    def search_users(self, prefix, limit=20):
+        """前缀查找转换为主键索引上的范围查询 [prefix, prefix + 最大字符)"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT username FROM users WHERE username >= ? AND username < ? ORDER BY username LIMIT ?",
+                (prefix, prefix + '\U0010ffff', limit)
+            ).fetchall()
+        return [username for (username,) in rows]
+
+    def save_all(self, users):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM users")
+            self.conn.executemany(
+                "INSERT INTO users (username, password, register_time, last_login)"
+                " VALUES (?, ?, ?, ?)",
+                (self._row(username, info) for username, info in users.items())
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def load_json_users(path):
+    """从 users.json 格式的文件读取用户"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def dump_json_users(users, path):
+    """把用户写成 users.json 格式（原子替换）"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(users, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def account_format(path, fmt=None):
+    """确定账号文件格式：显式指定或按扩展名判断"""
+    if fmt is None:
+        ext = os.path.splitext(path)[1].lower()
+        fmt = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(ext)
+    if fmt not in ACCOUNT_FORMATS:
+        raise ValueError(f"无法确定账号文件格式: {path}（支持 {', '.join(ACCOUNT_FORMATS)}）")
+    return fmt
+
+
+def read_accounts(path, fmt=None):
+    """逐行读取账号文件，产出 (行号, 记录)；记录含 username 与 password 或 password_hash，无法解析时为 None
+
+    CSV 第一行为表头。
+    """
+    fmt = account_format(path, fmt)
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError:
+                yield line_no, None
+
+
+def write_accounts(users, path, fmt=None):
+    """把 (username, info) 逐条写入账号文件（path 为 '-' 时写到标准输出），返回写入数量"""
+    fmt = account_format(path, fmt)
+    f = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+    count = 0
+    try:
+        writer = csv.writer(f) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(ACCOUNT_FIELDS)
+        for username, info in users:
+            row = (username, info.get('password'), info.get('register_time'), info.get('last_login'))
+            if writer:
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(dict(zip(ACCOUNT_FIELDS, row)), ensure_ascii=False) + '\n')
+            count += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return count
+
+
+def create_storage(backend, path):
+    """按名称创建存储后端: 'sqlite' 或 'json'"""
+    if backend == 'sqlite':
+        return SQLiteStorage(path)
+    if backend == 'json':
+        return JsonFileStorage(path)
+    raise ValueError(f"未知的存储后端: {backend}")
@@ -0,0 +1,168 @@
+"""服务器级测试的公共部分：在临时目录中启动回环服务器，用阻塞 socket 模拟客户端"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from collections import deque
+from concurrent.futures import Future
+
+from protocol import FrameDecoder, decode_payload, encode_message
+from server import create_server
+
+ITERATIONS = 1000  # 测试中降低密码哈希迭代次数
+TIMEOUT = 5
+
+
+class TestClient:
+    """测试用客户端：收到的消息按顺序缓存，wait_for 取出第一条匹配的消息，其余的留着"""
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=TIMEOUT)
+        self.decoder = FrameDecoder()
+        self.received = deque()
+        self.eof = False
+
+    def send(self, message):
+        self.sock.sendall(encode_message(message))
+
+    def read(self, timeout):
+        """读取一次 socket，没有数据时最多等待 timeout 秒"""
+        if self.eof:
+            return
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(65536)
+        except socket.timeout:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.eof = True
+            return
+        self.received.extend(decode_payload(payload) for payload in self.decoder.feed(data))
+
+    def wait_for(self, msg_type, timeout=TIMEOUT, **fields):
+        """等待并取出第一条类型为 msg_type（且字段匹配 fields）的消息"""
+        deadline = time.monotonic() + timeout
+        while True:
+            for message in self.received:
+                if message.get('type') == msg_type and all(message.get(k) == v for k, v in fields.items()):
+                    self.received.remove(message)
+                    return message
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.eof:
+                raise AssertionError(f"没有收到 {msg_type} {fields}，已收到 {list(self.received)}")
+            self.read(remaining)
+
+    def collect(self, msg_type, duration=0.3):
+        """在 duration 秒内收到的所有 msg_type 消息"""
+        deadline = time.monotonic() + duration
+        while not self.eof and time.monotonic() < deadline:
+            self.read(deadline - time.monotonic())
+        messages = [message for message in self.received if message.get('type') == msg_type]
+        for message in messages:
+            self.received.remove(message)
+        return messages
+
+    def wait_closed(self, timeout=TIMEOUT):
+        """等待服务器关闭连接"""
+        deadline = time.monotonic() + timeout
+        while not self.eof:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AssertionError("连接没有被关闭")
+            self.read(remaining)
+
+    def login(self, username, password='123456', **fields):
+        self.send({'type': 'login', 'username': username, 'password': password, **fields})
+        return self.wait_for('login_response')
+
+    def close(self):
+        self.sock.close()
+
+
+class ServerTestCase(unittest.TestCase):
+    """在临时目录中启动服务器（用户库、聊天记录、离线队列都写在这里），监听随机端口
+
+    子类设置 mode 选择线程模式或事件循环模式，server_options 传给 create_server。
+    """
+
+    mode = 'thread'
+    server_options = {}
+    users = ('alice', 'bob', 'carol')
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.clients = []
+        self.server = create_server(self.mode, '127.0.0.1', 0, metrics_port=0, **self.server_options)
+        self.server.print_banner = lambda: None
+        self.server.user_manager.hasher.iterations = ITERATIONS
+        for username in self.users:
+            self.server.user_manager.register(username, '123456')
+        self.thread = threading.Thread(target=self.server.start, daemon=True)
+        self.thread.start()
+        self.port = self.wait_listening()
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        if self.mode == 'asyncio':
+            self.server.loop.call_soon_threadsafe(self.server.stop)
+        else:
+            # 关闭 socket 不会唤醒阻塞的 accept，shutdown 之后 start 退出循环并调用 stop
+            self.server.running = False
+            try:
+                self.server.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.thread.join(TIMEOUT)
+        self.server.writer.stop()
+        self.server.user_manager.hasher.shutdown()
+        self.server.user_manager.storage.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def wait_listening(self):
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            if self.mode == 'asyncio':
+                listener = self.server.listener
+                if listener is not None and listener.sockets:
+                    return listener.sockets[0].getsockname()[1]
+            elif self.server.server_socket is not None:
+                port = self.server.server_socket.getsockname()[1]
+                if port:
+                    time.sleep(0.05)  # bind 之后还要 listen
+                    return port
+            time.sleep(0.01)
+        raise AssertionError("服务器没有启动")
+
+    def call(self, callback, *args):
+        """在服务器的处理线程上执行回调并返回结果（事件循环模式下发送必须在事件循环线程上进行）"""
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(callback(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        self.server.call_soon(run)
+        return future.result(TIMEOUT)
+
+    def connect(self):
+        client = TestClient(self.port)
+        self.clients.append(client)
+        return client
+
+    def login(self, username, **fields):
+        """连接并登录，返回 (客户端, 登录响应)"""
+        client = self.connect()
+        response = client.login(username, **fields)
+        self.assertTrue(response['success'], response)
+        return client, response
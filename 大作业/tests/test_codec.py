@@ -0,0 +1,38 @@
+import unittest
+import zlib
+
+from config import MAX_FRAME_SIZE
+from protocol import FLAG_JSON, FLAG_ZLIB, decode_payload, decompress, get_codec
+
+
+class CodecTest(unittest.TestCase):
+    def test_round_trip_codecs(self):
+        message = {'type': 'chat_message', 'id': 7, 'timestamp': 1.5, 'username': 'alice', 'content': 'x' * 500}
+        for encoding in ('json', 'binary'):
+            for compression in (None, 'zlib'):
+                codec = get_codec(encoding, compression)
+                payload = codec.encode_payload(message)
+                self.assertEqual(decode_payload(payload), message, (encoding, compression))
+
+    def test_reject_unnegotiated_compression(self):
+        payload = get_codec('json', 'zlib').encode_payload({'type': 'message', 'content': 'y' * 500})
+        self.assertEqual(payload[0] & FLAG_ZLIB, FLAG_ZLIB)
+        with self.assertRaises(ValueError):
+            decode_payload(payload, allow_compressed=False)
+
+    def test_decompress_limit(self):
+        """压缩炸弹：很小的压缩正文解压后超过上限"""
+        bomb = zlib.compress(b'\0' * 1024 * 1024, 9)
+        self.assertEqual(len(decompress(bomb, 1024 * 1024)), 1024 * 1024)
+        with self.assertRaises(ValueError):
+            decompress(bomb, 1024)
+        with self.assertRaises(ValueError):
+            decode_payload(bytes([FLAG_JSON | FLAG_ZLIB]) + zlib.compress(b'{}' + b' ' * (2 * MAX_FRAME_SIZE)))
+
+    def test_truncated_compression(self):
+        with self.assertRaises(ValueError):
+            decompress(zlib.compress(b'{"type": "message"}')[:-4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import socket
+import unittest
+
+from connection import ClientConnection
+from delivery import DeliveryWindow
+from outbound import POLICY_COALESCE, POLICY_DROP, OutboundWriter
+from protocol import JSON_CODEC, FrameDecoder, decode_payload, encode_sequenced, get_codec
+
+
+class DeliveryWindowTest(unittest.TestCase):
+    def track(self, window, count):
+        with window.lock:
+            return [window.track({'n': i}) for i in range(count)]
+
+    def test_cumulative_ack(self):
+        window = DeliveryWindow(size=10)
+        self.assertEqual(self.track(window, 5), [1, 2, 3, 4, 5])
+        self.assertEqual(window.ack(3), 3)
+        self.assertEqual(window.pending(), [{'n': 3}, {'n': 4}])
+        self.assertEqual(window.ack(2), 0)  # 重复或过期的确认
+        self.assertEqual(window.acked, 3)
+        self.assertEqual(window.ack(5), 2)
+        self.assertEqual(len(window), 0)
+
+    def test_ack_beyond_sent(self):
+        """确认超过已分配的序号时只确认到最新序号"""
+        window = DeliveryWindow(size=10)
+        self.track(window, 2)
+        self.assertEqual(window.ack(100), 2)
+        self.assertEqual(window.acked, 2)
+        self.track(window, 1)
+        self.assertEqual(window.pending(), [{'n': 0}])
+
+    def test_invalid_ack(self):
+        window = DeliveryWindow(size=10)
+        self.track(window, 3)
+        for seq in (True, '3', 2.0, None):
+            self.assertEqual(window.ack(seq), 0)
+        self.assertEqual(len(window), 3)
+
+    def test_overflow_keeps_messages(self):
+        """窗口满时不丢弃消息，由调用方断开连接"""
+        window = DeliveryWindow(size=3)
+        self.track(window, 3)
+        self.assertFalse(window.overflowed())
+        self.track(window, 2)
+        self.assertTrue(window.overflowed())
+        self.assertEqual(len(window.pending()), 5)
+        self.assertEqual(window.ack(2), 2)
+        self.assertFalse(window.overflowed())
+
+    def test_sequenced_frame(self):
+        payload = get_codec('binary', None).encode_payload({'type': 'system_message', 'timestamp': 2.0,
+                                                            'content': 'hi'})
+        decoder = FrameDecoder()
+        (framed,) = decoder.feed(encode_sequenced(payload, 42))
+        self.assertEqual(decode_payload(framed)['delivery_seq'], 42)
+
+
+
+class SendTrackedTest(unittest.TestCase):
+    """带序号的帧在发送队列满时不能被溢出策略丢弃"""
+
+    def setUp(self):
+        self.sock, self.peer = socket.socketpair()
+        self.writer = OutboundWriter()  # 不启动，帧留在发送队列中
+
+    def tearDown(self):
+        for sock in (self.sock, self.peer, self.writer.wakeup_send, self.writer.wakeup_recv):
+            sock.close()
+        self.writer.selector.close()
+
+    def test_full_queue_keeps_message_in_window(self):
+        for policy in (POLICY_COALESCE, POLICY_DROP):
+            conn = ClientConnection(self.sock, ('test', 0), self.writer, queue_size=2, overflow_policy=policy)
+            conn.delivery = DeliveryWindow(size=10)
+            conn.send_frame(b'snapshot', key='user_list')  # 可被取代的快照不影响带序号的帧
+            results = [conn.send_tracked({'n': i}, JSON_CODEC.encode_payload({'n': i}))[0] for i in range(3)]
+            self.assertEqual(results, [True, False, False], policy)
+            self.assertEqual(len(conn.outbound), 2)
+            self.assertEqual(conn.outbound.dropped, 0)
+            # 客户端只收到了序号 1，确认它不会把没能入队的 2、3 一并确认掉
+            self.assertEqual(conn.delivery.ack(1), 1)
+            self.assertEqual(conn.delivery.pending(), [{'n': 1}, {'n': 2}])
+
+    def test_full_window_is_not_sent(self):
+        conn = ClientConnection(self.sock, ('test', 0), self.writer, queue_size=10)
+        conn.delivery = DeliveryWindow(size=2)
+        results = [conn.send_tracked({'n': i}, JSON_CODEC.encode_payload({'n': i}))[0] for i in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(len(conn.outbound), 2)
+        self.assertEqual(len(conn.delivery.pending()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from history import MessageHistory
+
+
+class MessageHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.histories = []
+
+    def tearDown(self):
+        for history in self.histories:
+            history.close()
+        shutil.rmtree(self.dir)
+
+    def history(self, capacity=5, segment_size=4, max_segments=10):
+        history = MessageHistory(self.dir, capacity, segment_size, max_segments)
+        self.histories.append(history)
+        return history
+
+    def fill(self, history, count, start=0):
+        for i in range(start, start + count):
+            history.append({'type': 'chat_message', 'content': f'm{i}', 'timestamp': 1000.0 + i})
+        history.flush()
+
+    def segment_files(self):
+        return sorted(name for name in os.listdir(self.dir) if name.startswith('segment_'))
+
+    def test_append_writes_on_flush(self):
+        """append 只记入内存，flush 后才写入分段文件"""
+        history = self.history()
+        self.assertEqual(history.append({'content': 'a', 'timestamp': 1.0}), 1)
+        self.assertEqual(self.segment_files(), [])
+        self.assertEqual([m['content'] for m in history.read_after(0, 10)], ['a'])
+        history.flush()
+        self.assertEqual(self.segment_files(), ['segment_000000000001.log'])
+
+    def test_segments_roll_and_expire(self):
+        history = self.history(segment_size=4, max_segments=2)
+        self.fill(history, 10)
+        # 分段 1, 5, 9 中最旧的已被删除
+        self.assertEqual(self.segment_files(), ['segment_000000000005.log', 'segment_000000000009.log'])
+
+    def test_read_after_from_disk(self):
+        """游标早于内存缓冲时从分段读取，并与内存中的消息衔接"""
+        history = self.history(capacity=3, segment_size=4)
+        self.fill(history, 10)
+        self.assertEqual([m['id'] for m in history.read_after(2, 4)], [3, 4, 5, 6])
+        self.assertEqual([m['id'] for m in history.read_after(6, 10)], [7, 8, 9, 10])
+        self.assertEqual(history.read_after(10, 10), [])
+
+    def test_restart_continues_ids(self):
+        history = self.history(capacity=3, segment_size=4)
+        self.fill(history, 6)
+        history.close()
+        reopened = self.history(capacity=3, segment_size=4)
+        self.assertEqual(reopened.last_id, 6)
+        self.fill(reopened, 3, start=6)
+        self.assertEqual([m['content'] for m in reopened.read_after(0, 20)], [f'm{i}' for i in range(9)])
+        # 重启后接着写未满的最后一个分段
+        self.assertEqual(self.segment_files(), ['segment_000000000001.log', 'segment_000000000005.log',
+                                                'segment_000000000009.log'])
+
+    def test_cursor_for_time(self):
+        history = self.history(capacity=3, segment_size=4)
+        self.fill(history, 10)  # 时间戳 1000 .. 1009
+        self.assertEqual(history.cursor_for_time(1008.5), 9)  # 内存缓冲
+        self.assertEqual(history.cursor_for_time(1002), 3)  # 分段文件
+        self.assertEqual(history.cursor_for_time(999), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
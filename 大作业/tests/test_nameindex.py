@@ -0,0 +1,51 @@
+import unittest
+
+from nameindex import NameIndex
+
+
+class NameIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = NameIndex(['carol', 'alice', 'bob', 'alex', 'alice'])
+
+    def test_add_discard(self):
+        self.assertEqual(len(self.index), 4)
+        self.assertFalse(self.index.add('bob'))
+        self.assertTrue(self.index.add('bea'))
+        self.assertIn('bea', self.index)
+        self.assertTrue(self.index.discard('bea'))
+        self.assertFalse(self.index.discard('bea'))
+        self.assertNotIn('bea', self.index)
+
+    def test_page(self):
+        self.assertEqual(self.index.page(limit=2), ['alex', 'alice'])
+        self.assertEqual(self.index.page('alice', 2), ['bob', 'carol'])
+        self.assertEqual(self.index.page('carol', 2), [])
+        # after 不必是索引中的名字（例如上一页最后一个已被移除）
+        self.assertEqual(self.index.page('alf', 10), ['alice', 'bob', 'carol'])
+
+    def test_prefix(self):
+        self.assertEqual(self.index.prefix('al'), ['alex', 'alice'])
+        self.assertEqual(self.index.prefix('al', limit=1), ['alex'])
+        self.assertEqual(self.index.prefix('b'), ['bob'])
+        self.assertEqual(self.index.prefix('z'), [])
+
+    def test_iter_pages(self):
+        """遍历跨多页，结果有序且不重不漏"""
+        names = [f'user{i:05d}' for i in range(2500)]
+        index = NameIndex(reversed(names))
+        index.ITER_PAGE = 100
+        self.assertEqual(list(index), names)
+
+    def test_iter_with_concurrent_removal(self):
+        index = NameIndex(f'u{i:03d}' for i in range(10))
+        index.ITER_PAGE = 3
+        seen = []
+        for name in index:
+            seen.append(name)
+            index.discard(name)
+        self.assertEqual(seen, [f'u{i:03d}' for i in range(10)])
+        self.assertEqual(len(index), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
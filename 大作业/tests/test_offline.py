@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from config import OFFLINE_DRAIN_BATCH
+from offline import OfflineQueue
+from tests.support import ServerTestCase
+
+
+def private(sender, recipient, content):
+    return {'from': sender, 'to': recipient, 'content': content, 'timestamp': time.time()}
+
+
+class OfflineQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue = OfflineQueue(os.path.join(self.dir, 'offline.db'), max_per_user=5, ttl=60)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_fetch_in_order(self):
+        for i in range(3):
+            self.queue.enqueue(private('bob', 'alice', f'pm{i}'))
+        self.queue.enqueue(private('alice', 'bob', 'other'))
+        messages = self.queue.fetch('alice', 10)
+        self.assertEqual([m['content'] for m in messages], ['pm0', 'pm1', 'pm2'])
+        self.assertEqual(messages[0]['type'], 'private_message')
+        self.assertEqual((messages[0]['from'], messages[0]['to']), ('bob', 'alice'))
+        self.assertEqual([m['content'] for m in self.queue.fetch('alice', 2)], ['pm0', 'pm1'])
+
+    def test_fetch_does_not_remove(self):
+        self.queue.enqueue(private('bob', 'alice', 'pm'))
+        self.queue.fetch('alice', 10)
+        self.assertEqual(self.queue.count('alice'), 1)
+
+    def test_remove_up_to_id(self):
+        for i in range(4):
+            self.queue.enqueue(private('bob', 'alice', f'pm{i}'))
+        messages = self.queue.fetch('alice', 2)
+        self.queue.remove('alice', messages[-1]['id'])
+        self.assertEqual([m['content'] for m in self.queue.fetch('alice', 10)], ['pm2', 'pm3'])
+
+    def test_keeps_newest(self):
+        """超出每人上限时丢弃最旧的"""
+        for i in range(8):
+            self.queue.enqueue(private('bob', 'alice', f'pm{i}'))
+        self.queue.enqueue(private('bob', 'carol', 'pm'))
+        self.assertEqual(self.queue.count('alice'), 5)
+        self.assertEqual([m['content'] for m in self.queue.fetch('alice', 10)],
+                         ['pm3', 'pm4', 'pm5', 'pm6', 'pm7'])
+        self.assertEqual(self.queue.count('carol'), 1)
+
+    def test_expired(self):
+        self.queue.enqueue(private('bob', 'alice', 'pm'))
+        self.queue.enqueue(private('bob', 'carol', 'pm'))
+        self.queue.ttl = 0
+        time.sleep(0.01)
+        self.assertEqual(self.queue.fetch('alice', 10), [])
+        self.assertEqual(self.queue.purge_expired(), 1)
+        self.assertEqual(self.queue.count('carol'), 0)
+
+    def test_persistent(self):
+        self.queue.enqueue(private('bob', 'alice', 'pm'))
+        self.queue.close()
+        self.queue = OfflineQueue(os.path.join(self.dir, 'offline.db'))
+        self.assertEqual([m['content'] for m in self.queue.fetch('alice', 10)], ['pm'])
+
+
+class ThreadOfflineTest(ServerTestCase):
+    """离线私信：收件人登录后分批补发，协商了确认的连接在确认之前不丢"""
+
+    def send_offline(self, *contents):
+        bob, _ = self.login('bob')
+        for content in contents:
+            bob.send({'type': 'private_message', 'to': 'alice', 'content': content})
+            self.assertTrue(bob.wait_for('private_message_response')['queued'])
+        return bob
+
+    def contents(self, client):
+        batch = client.wait_for('offline_messages')
+        return batch, [m['content'] for m in batch['messages']]
+
+    def test_delivered_on_login(self):
+        self.send_offline('pm1', 'pm2')
+        alice, _ = self.login('alice')
+        batch, contents = self.contents(alice)
+        self.assertEqual(contents, ['pm1', 'pm2'])
+        self.assertFalse(batch['more'])
+        self.assertEqual(self.server.offline.count('alice'), 0)
+
+    def test_batches(self):
+        for i in range(OFFLINE_DRAIN_BATCH + 10):
+            self.server.offline.enqueue(private('bob', 'alice', f'pm{i}'))
+        alice, _ = self.login('alice')
+        first, contents = self.contents(alice)
+        self.assertTrue(first['more'])
+        second, rest = self.contents(alice)
+        self.assertFalse(second['more'])
+        self.assertEqual(contents + rest, [f'pm{i}' for i in range(OFFLINE_DRAIN_BATCH + 10)])
+
+    def test_unacked_batch_redelivered(self):
+        """没有确认的一批私信在断开后放回离线队列，下次登录重新补发"""
+        bob = self.send_offline('pm1', 'pm2')
+        alice, _ = self.login('alice', acks=True)
+        self.assertEqual(self.contents(alice)[1], ['pm1', 'pm2'])
+        alice.close()
+        bob.wait_for('user_left', username='alice')
+
+        alice, _ = self.login('alice', acks=True)
+        batch, contents = self.contents(alice)
+        self.assertEqual(contents, ['pm1', 'pm2'])
+        alice.send({'type': 'ack', 'seq': batch['delivery_seq']})
+        self.assertEqual(alice.collect('offline_messages'), [])
+        alice.close()
+        bob.wait_for('user_left', username='alice')
+
+        alice, _ = self.login('alice', acks=True)
+        self.assertEqual(alice.collect('offline_messages'), [])
+        self.assertEqual(self.server.offline.count('alice'), 0)
+
+
+class AsyncOfflineTest(ThreadOfflineTest):
+    mode = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
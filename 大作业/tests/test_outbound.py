@@ -0,0 +1,67 @@
+import unittest
+
+from outbound import POLICY_COALESCE, POLICY_DISCONNECT, POLICY_DROP, OutboundQueue
+
+
+class OutboundQueueTest(unittest.TestCase):
+    def fill(self, queue, count):
+        for i in range(count):
+            self.assertTrue(queue.put(f'f{i}'.encode()))
+
+    def test_drop_policy(self):
+        """队列满时丢弃新帧，连接保留"""
+        queue = OutboundQueue(max_frames=3, policy=POLICY_DROP)
+        self.fill(queue, 3)
+        self.assertTrue(queue.put(b'new'))
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(queue.pop_all(), [b'f0', b'f1', b'f2'])
+
+    def test_disconnect_policy(self):
+        queue = OutboundQueue(max_frames=3, policy=POLICY_DISCONNECT)
+        self.fill(queue, 3)
+        self.assertFalse(queue.put(b'new'))
+        self.assertEqual(len(queue), 3)
+
+    def test_coalesce_replaces_same_key(self):
+        """新状态取代同 key 的旧状态，其余帧保持顺序"""
+        queue = OutboundQueue(max_frames=3, policy=POLICY_COALESCE)
+        queue.put(b'a', key='user_list')
+        queue.put(b'b')
+        queue.put(b'c')
+        self.assertTrue(queue.put(b'a2', key='user_list'))
+        self.assertEqual(queue.pop_all(), [b'b', b'c', b'a2'])
+        self.assertEqual(queue.dropped, 1)
+
+    def test_coalesce_never_evicts_unkeyed(self):
+        """没有同 key 的旧帧可取代时断开连接，不丢弃聊天消息等没有 key 的帧"""
+        queue = OutboundQueue(max_frames=3, policy=POLICY_COALESCE)
+        queue.put(b'a', key='user_list')
+        queue.put(b'b')
+        queue.put(b'c')
+        self.assertFalse(queue.put(b'd'))
+        self.assertFalse(queue.put(b'r', key='room_list'))
+        self.assertEqual(queue.pop_all(), [b'a', b'b', b'c'])
+        self.assertEqual(queue.dropped, 0)
+
+    def test_pop_all_frees_space(self):
+        queue = OutboundQueue(max_frames=2, policy=POLICY_DISCONNECT)
+        self.fill(queue, 2)
+        self.assertEqual(len(queue.pop_all()), 2)
+        self.assertEqual(len(queue), 0)
+        self.fill(queue, 2)
+
+    def test_closed(self):
+        """关闭后拒绝新帧，已入队的帧仍可取出"""
+        queue = OutboundQueue(max_frames=3, policy=POLICY_DROP)
+        queue.put(b'x')
+        queue.close()
+        self.assertFalse(queue.put(b'y'))
+        self.assertEqual(queue.pop_all(), [b'x'])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            OutboundQueue(policy='bogus')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from passwords import hash_password, is_password_hash, verify_password
+
+ITERATIONS = 1000
+
+
+class VerifyPasswordTest(unittest.TestCase):
+    def test_pbkdf2(self):
+        stored = hash_password('secret1', ITERATIONS)
+        self.assertTrue(is_password_hash(stored))
+        self.assertEqual(verify_password('secret1', stored, ITERATIONS), (True, None))
+        self.assertEqual(verify_password('wrong', stored, ITERATIONS), (False, None))
+
+    def test_rehash(self):
+        """旧版 SHA-256 与迭代次数偏低的记录校验成功后返回新哈希"""
+        legacy = '5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8'  # sha256('password')
+        ok, new_hash = verify_password('password', legacy, ITERATIONS)
+        self.assertTrue(ok)
+        self.assertTrue(new_hash.startswith(f'pbkdf2_sha256${ITERATIONS}$'))
+        ok, new_hash = verify_password('secret1', hash_password('secret1', 10), ITERATIONS)
+        self.assertTrue(ok)
+        self.assertEqual(verify_password('secret1', new_hash, ITERATIONS), (True, None))
+
+    def test_corrupt_record(self):
+        """损坏的记录按密码错误处理，不抛出异常"""
+        for stored in ('pbkdf2_sha256$x$00$00', 'pbkdf2_sha256$1000$00', 'pbkdf2_sha256$1000$zz$00',
+                       'pbkdf2_sha256$0$00$00', None):
+            with self.assertLogs('chat.users', 'ERROR'):
+                self.assertEqual(verify_password('secret1', stored, ITERATIONS), (False, None), stored)
+
+
+if __name__ == '__main__':
+    unittest.main()
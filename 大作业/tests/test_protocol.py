@@ -0,0 +1,34 @@
+import json
+import unittest
+
+from protocol import FrameDecoder, FrameError, decode_payload, encode_frame, encode_message
+
+
+class FrameDecoderTest(unittest.TestCase):
+    def test_split_frames(self):
+        """一帧拆成单字节逐个喂入，最后才产出"""
+        data = encode_message({'type': 'message', 'content': '你好'})
+        decoder = FrameDecoder()
+        for byte in data[:-1]:
+            self.assertEqual(decoder.feed(bytes([byte])), [])
+        payloads = decoder.feed(data[-1:])
+        self.assertEqual([decode_payload(p) for p in payloads], [{'type': 'message', 'content': '你好'}])
+        self.assertEqual(decoder.buffer, b'')
+
+    def test_coalesced_frames(self):
+        """多帧粘在一起一次喂入，半帧留在缓冲区"""
+        frames = [encode_frame(f'{{"n": {i}}}'.encode()) for i in range(3)]
+        data = b''.join(frames)
+        decoder = FrameDecoder()
+        payloads = decoder.feed(data[:-2])
+        self.assertEqual([json.loads(p) for p in payloads], [{'n': 0}, {'n': 1}])
+        self.assertEqual([json.loads(p) for p in decoder.feed(data[-2:])], [{'n': 2}])
+
+    def test_oversized_frame(self):
+        decoder = FrameDecoder(max_frame_size=16)
+        with self.assertRaises(FrameError):
+            decoder.feed(encode_frame(b'x' * 17))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import time
+import unittest
+
+from protocol import encode_message
+from ratelimit import RateLimiter, TokenBucket
+from tests.support import ServerTestCase
+
+FLOOD = 60  # 超过默认突发上限 RATE_LIMIT_MESSAGE_BURST
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=10, burst=3)
+        now = bucket.updated
+        for _ in range(3):
+            self.assertEqual(bucket.wait_time(1, now), 0)
+            bucket.consume(1)
+        self.assertAlmostEqual(bucket.wait_time(1, now), 0.1)
+        self.assertEqual(bucket.wait_time(1, now + 0.1), 0)
+
+    def test_refill_capped(self):
+        bucket = TokenBucket(rate=10, burst=3)
+        bucket.refill(bucket.updated + 100)
+        self.assertEqual(bucket.tokens, 3)
+
+    def test_oversized_amount(self):
+        """超过桶容量的单条消息按满桶计，不会永远等待"""
+        bucket = TokenBucket(rate=10, burst=3)
+        self.assertEqual(bucket.wait_time(100, bucket.updated), 0)
+        bucket.consume(100)
+        self.assertEqual(bucket.tokens, 0)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_message_limit(self):
+        limiter = RateLimiter(messages=5, message_burst=2, nbytes=0)
+        self.assertEqual(limiter.acquire(10), 0)
+        self.assertEqual(limiter.acquire(10), 0)
+        self.assertGreater(limiter.acquire(10), 0)
+
+    def test_byte_limit(self):
+        limiter = RateLimiter(messages=0, nbytes=100, byte_burst=100)
+        self.assertEqual(limiter.acquire(60), 0)
+        wait = limiter.acquire(60)
+        self.assertAlmostEqual(wait, 0.2, places=2)
+
+    def test_refused_does_not_consume(self):
+        """任一个桶不够时两个桶都不扣令牌"""
+        limiter = RateLimiter(messages=5, message_burst=2, nbytes=100, byte_burst=100)
+        self.assertEqual(limiter.acquire(90), 0)
+        self.assertGreater(limiter.acquire(90), 0)
+        self.assertEqual(limiter.acquire(5), 0)
+
+    def test_unlimited(self):
+        limiter = RateLimiter(messages=0, nbytes=0)
+        for _ in range(1000):
+            self.assertEqual(limiter.acquire(1 << 20), 0)
+
+    def test_should_notify(self):
+        limiter = RateLimiter()
+        self.assertTrue(limiter.should_notify(interval=0.05))
+        self.assertFalse(limiter.should_notify(interval=0.05))
+        time.sleep(0.06)
+        self.assertTrue(limiter.should_notify(interval=0.05))
+
+
+class ThreadRateLimitTest(ServerTestCase):
+    """超出限额后的三种处理方式：延迟（默认）、丢弃、断开"""
+
+    def flood(self, client):
+        """一次写入 FLOOD 条聊天消息"""
+        client.sock.sendall(b''.join(
+            encode_message({'type': 'message', 'content': f'm{i}'}) for i in range(FLOOD)
+        ))
+
+    def received(self, client, duration):
+        return [m['content'] for m in client.collect('chat_message', duration)]
+
+    def test_delay(self):
+        """暂停读取该连接，消息延后处理但不丢"""
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        self.flood(alice)
+        contents = [bob.wait_for('chat_message')['content'] for _ in range(FLOOD)]
+        self.assertEqual(contents, [f'm{i}' for i in range(FLOOD)])
+        self.assertGreater(self.server.clients.get('alice').limiter.throttled, 0)
+        self.assertEqual(alice.collect('error', 0), [])
+
+    def test_drop(self):
+        self.server.rate_limit_penalty = 'drop'
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        self.flood(alice)
+        self.assertEqual(alice.wait_for('error')['message'], '发送过快，部分消息已被丢弃')
+        contents = self.received(bob, 0.5)
+        self.assertLess(len(contents), FLOOD)
+        self.assertEqual(contents, [f'm{i}' for i in range(len(contents))])
+        # 只提醒一次，连接仍可用
+        self.assertEqual(alice.collect('error', 0), [])
+        self.assertIn('alice', self.server.clients)
+
+    def test_disconnect(self):
+        self.server.rate_limit_penalty = 'disconnect'
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        self.flood(alice)
+        self.assertEqual(alice.wait_for('error')['message'], '发送过快，连接已断开')
+        alice.wait_closed()
+        bob.wait_for('user_left', username='alice')
+        self.assertLess(len(self.received(bob, 0.2)), FLOOD)
+
+
+class AsyncRateLimitTest(ThreadRateLimitTest):
+    mode = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import time
+
+from config import HISTORY_REPLAY_BATCH
+from tests.support import ServerTestCase
+
+
+class ThreadReplayTest(ServerTestCase):
+    """登录时按游标补发聊天记录：补发到登记时最新的 id，之后的消息只直播"""
+
+    def publish(self, count):
+        for i in range(count):
+            self.call(self.server.publish_chat, {'type': 'chat_message', 'username': 'alice',
+                                                 'content': f'm{i}', 'timestamp': time.time()})
+
+    def replayed_ids(self, client):
+        ids = []
+        while True:
+            batch = client.wait_for('history')
+            ids += [message['id'] for message in batch['messages']]
+            if not batch['more']:
+                return ids
+
+    def test_after_id(self):
+        self.publish(5)
+        bob, _ = self.login('bob', after_id=2)
+        self.assertEqual(self.replayed_ids(bob), [3, 4, 5])
+
+    def test_since(self):
+        self.publish(3)
+        since = self.server.history.read_after(1, 1)[0]['timestamp']
+        self.publish(2)
+        bob, _ = self.login('bob', since=since)
+        self.assertEqual(self.replayed_ids(bob), [3, 4, 5])
+
+    def test_batches(self):
+        self.publish(HISTORY_REPLAY_BATCH + 10)
+        bob, _ = self.login('bob', after_id=0)
+        first = bob.wait_for('history')
+        self.assertEqual(len(first['messages']), HISTORY_REPLAY_BATCH)
+        self.assertTrue(first['more'])
+        self.assertEqual(self.replayed_ids(bob), list(range(HISTORY_REPLAY_BATCH + 1, HISTORY_REPLAY_BATCH + 11)))
+
+    def test_replay_and_live_do_not_overlap(self):
+        self.publish(3)
+        bob, _ = self.login('bob', after_id=0)
+        self.publish(2)
+        replayed = self.replayed_ids(bob)
+        live = [message['id'] for message in bob.collect('chat_message')]
+        self.assertEqual(sorted(replayed + live), [1, 2, 3, 4, 5])
+        self.assertEqual(replayed, [1, 2, 3])
+
+    def test_server_timestamp(self):
+        """聊天记录使用服务器时间，忽略客户端提供的时间戳"""
+        alice, _ = self.login('alice')
+        before = time.time()
+        alice.send({'type': 'message', 'content': 'hi', 'timestamp': 'not a number'})
+        message = alice.wait_for('chat_message')
+        self.assertIsInstance(message['timestamp'], float)
+        self.assertGreaterEqual(message['timestamp'], before)
+        self.assertEqual(self.server.history.read_after(0, 1)[0]['timestamp'], message['timestamp'])
+
+
+class AsyncReplayTest(ThreadReplayTest):
+    mode = 'asyncio'
@@ -0,0 +1,125 @@
+import unittest
+
+from config import ROOMS_PER_USER_MAX
+from rooms import RoomRegistry
+from tests.support import ServerTestCase
+
+
+class RoomRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.rooms = RoomRegistry()
+
+    def test_join_and_leave(self):
+        self.assertTrue(self.rooms.join('dev', 'alice'))
+        self.assertFalse(self.rooms.join('dev', 'alice'))
+        self.rooms.join('dev', 'bob')
+        self.rooms.join('ops', 'alice')
+        self.assertEqual(self.rooms.members('dev'), ['alice', 'bob'])
+        self.assertEqual(self.rooms.rooms_of('alice'), ['dev', 'ops'])
+        self.assertTrue(self.rooms.leave('dev', 'alice'))
+        self.assertFalse(self.rooms.leave('dev', 'alice'))
+        self.assertFalse(self.rooms.is_member('dev', 'alice'))
+        self.assertEqual(self.rooms.rooms_of('alice'), ['ops'])
+
+    def test_empty_room_removed(self):
+        """最后一个成员离开后房间自动删除"""
+        self.rooms.join('dev', 'alice')
+        self.rooms.leave('dev', 'alice')
+        self.assertEqual(self.rooms.list_rooms(), [])
+        self.assertEqual(self.rooms.rooms_of('alice'), [])
+        self.assertEqual(self.rooms.memberships, {})
+
+    def test_list_rooms(self):
+        self.rooms.join('dev', 'alice')
+        self.rooms.join('dev', 'bob')
+        self.rooms.join('ops', 'bob')
+        self.assertEqual(self.rooms.list_rooms(), [{'name': 'dev', 'members': 2},
+                                                   {'name': 'ops', 'members': 1}])
+
+    def test_snapshot_and_load(self):
+        self.rooms.join('dev', 'alice')
+        self.rooms.join('ops', 'alice')
+        self.rooms.join('ops', 'bob')
+        restored = RoomRegistry()
+        restored.load(self.rooms.snapshot())
+        self.assertEqual(restored.snapshot(), self.rooms.snapshot())
+        self.assertEqual(restored.rooms_of('alice'), ['dev', 'ops'])
+        self.assertEqual(restored.rooms_of('bob'), ['ops'])
+
+
+class ThreadRoomTest(ServerTestCase):
+    """聊天室消息只发给成员"""
+
+    def join(self, client, room):
+        client.send({'type': 'join_room', 'room': room})
+        return client.wait_for('join_room_response')
+
+    def test_fan_out_to_members(self):
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        carol, _ = self.login('carol')
+        self.join(alice, 'dev')
+        response = self.join(bob, 'dev')
+        self.assertEqual(response['members'], ['alice', 'bob'])
+        self.assertEqual(alice.wait_for('room_event', event='joined')['username'], 'bob')
+
+        alice.send({'type': 'message', 'room': 'dev', 'content': 'hi dev'})
+        for client in (alice, bob):
+            message = client.wait_for('room_message')
+            self.assertEqual((message['room'], message['username'], message['content']),
+                             ('dev', 'alice', 'hi dev'))
+        self.assertEqual(carol.collect('room_message'), [])
+
+    def test_non_member_rejected(self):
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        self.join(alice, 'dev')
+        bob.send({'type': 'message', 'room': 'dev', 'content': 'intrude'})
+        self.assertEqual(bob.wait_for('error')['message'], '你不在聊天室 dev 中')
+        self.assertEqual(alice.collect('room_message'), [])
+
+    def test_leave(self):
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        self.join(alice, 'dev')
+        self.join(bob, 'dev')
+        bob.send({'type': 'leave_room', 'room': 'dev'})
+        self.assertTrue(bob.wait_for('leave_room_response')['success'])
+        self.assertEqual(alice.wait_for('room_event', event='left')['username'], 'bob')
+        alice.send({'type': 'message', 'room': 'dev', 'content': 'after'})
+        alice.wait_for('room_message')
+        self.assertEqual(bob.collect('room_message'), [])
+
+        bob.send({'type': 'leave_room', 'room': 'dev'})
+        self.assertFalse(bob.wait_for('leave_room_response')['success'])
+
+    def test_disconnect_leaves_rooms(self):
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        self.join(alice, 'dev')
+        self.join(bob, 'dev')
+        bob.close()
+        self.assertEqual(alice.wait_for('room_event', event='left')['username'], 'bob')
+        self.assertEqual(self.server.rooms.members('dev'), ['alice'])
+
+    def test_room_limit(self):
+        alice, _ = self.login('alice')
+        for i in range(ROOMS_PER_USER_MAX):
+            self.assertTrue(self.join(alice, f'room{i}')['success'])
+        self.assertFalse(self.join(alice, 'one-more')['success'])
+
+    def test_list_rooms(self):
+        alice, _ = self.login('alice')
+        self.join(alice, 'dev')
+        alice.send({'type': 'list_rooms'})
+        response = alice.wait_for('room_list')
+        self.assertEqual(response['rooms'], [{'name': 'dev', 'members': 1}])
+        self.assertEqual(response['joined'], ['dev'])
+
+
+class AsyncRoomTest(ThreadRoomTest):
+    mode = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
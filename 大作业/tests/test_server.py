@@ -0,0 +1,56 @@
+from tests.support import ServerTestCase
+
+
+class ThreadServerTest(ServerTestCase):
+    """登录、聊天、登出的基本流程（事件循环模式见 AsyncServerTest，用例相同）"""
+
+    def test_login(self):
+        client, response = self.login('alice')
+        self.assertEqual(response['username'], 'alice')
+        self.assertIn('alice', client.wait_for('user_list')['users'])
+
+    def test_login_failures(self):
+        client = self.connect()
+        self.assertEqual(client.login('alice', 'wrong')['message'], "密码错误")
+        self.assertEqual(client.login('nobody')['message'], "用户不存在")
+        self.assertTrue(client.login('alice')['success'])
+
+    def test_chat_broadcast(self):
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        self.assertEqual(alice.wait_for('user_joined')['username'], 'bob')
+        alice.send({'type': 'message', 'content': 'hello'})
+        for client in (alice, bob):
+            message = client.wait_for('chat_message')
+            self.assertEqual((message['username'], message['content']), ('alice', 'hello'))
+
+    def test_chat_requires_login(self):
+        client = self.connect()
+        client.send({'type': 'message', 'username': 'alice', 'content': 'spoof'})
+        self.assertEqual(client.wait_for('error')['message'], '请先登录')
+
+    def test_logout(self):
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        bob.send({'type': 'logout'})
+        self.assertEqual(alice.wait_for('user_left')['username'], 'bob')
+        self.assertNotIn('bob', self.server.clients)
+
+    def test_login_replaces_connection(self):
+        """同名用户再次登录时接替旧连接，旧连接被断开"""
+        old, _ = self.login('alice')
+        new, _ = self.login('alice')
+        old.wait_closed()
+        new.send({'type': 'message', 'content': 'still here'})
+        self.assertEqual(new.wait_for('chat_message')['content'], 'still here')
+
+    def test_disconnect(self):
+        alice, _ = self.login('alice')
+        bob, _ = self.login('bob')
+        bob.close()
+        self.assertEqual(alice.wait_for('user_left')['username'], 'bob')
+        self.assertFalse(self.server.user_manager.is_online('bob'))
+
+
+class AsyncServerTest(ThreadServerTest):
+    mode = 'asyncio'
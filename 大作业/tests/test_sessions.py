@@ -0,0 +1,123 @@
+import time
+import unittest
+
+from sessions import ResumeSessions
+from tests.support import ServerTestCase
+
+
+class ResumeSessionsTest(unittest.TestCase):
+    def setUp(self):
+        self.dropped = []
+        self.sessions = ResumeSessions(ttl=0.05, on_drop=self.dropped.append)
+
+    def test_claim_once(self):
+        token = self.sessions.issue('alice')
+        session = self.sessions.claim(token)
+        self.assertEqual(session.username, 'alice')
+        self.assertIsNone(self.sessions.claim(token))
+        self.assertIsNone(self.sessions.claim(None))
+        self.assertEqual(self.dropped, [])
+
+    def test_detach_keeps_state(self):
+        token = self.sessions.issue('alice')
+        window = object()
+        self.sessions.detach('alice', ['dev'], window)
+        session = self.sessions.claim(token)
+        self.assertEqual((session.rooms, session.window), (['dev'], window))
+
+    def test_expired(self):
+        """断开后超过 ttl 的会话不能再取回，清理时交给 on_drop"""
+        token = self.sessions.issue('alice')
+        self.sessions.detach('alice')
+        time.sleep(0.1)
+        self.sessions.purge()
+        self.assertEqual([session.username for session in self.dropped], ['alice'])
+        self.assertIsNone(self.sessions.claim(token))
+        self.assertEqual(len(self.sessions), 0)
+
+    def test_connected_session_does_not_expire(self):
+        token = self.sessions.issue('alice')
+        time.sleep(0.1)
+        self.sessions.purge()
+        self.assertIsNotNone(self.sessions.claim(token))
+
+    def test_reissue_and_revoke(self):
+        """重新登录换发令牌、主动登出作废令牌，原会话都交给 on_drop"""
+        first = self.sessions.issue('alice')
+        second = self.sessions.issue('alice')
+        self.assertIsNone(self.sessions.claim(first))
+        self.assertEqual(len(self.dropped), 1)
+        self.sessions.revoke('alice')
+        self.assertIsNone(self.sessions.claim(second))
+        self.assertEqual(len(self.dropped), 2)
+
+
+class ThreadResumeTest(ServerTestCase):
+    """续连：恢复聊天室与在线状态，只重传客户端没有确认的消息"""
+
+    def disconnect(self, client, watcher):
+        client.close()
+        watcher.wait_for('user_left', username=client.username)
+
+    def login_alice(self):
+        alice, response = self.login('alice', acks=True)
+        alice.username = 'alice'
+        alice.send({'type': 'join_room', 'room': 'dev'})
+        alice.wait_for('join_room_response')
+        return alice, response['resume_token']
+
+    def resume(self, token, **fields):
+        client = self.connect()
+        client.send({'type': 'resume', 'token': token, 'acks': True, **fields})
+        return client, client.wait_for('resume_response')
+
+    def test_resume(self):
+        alice, token = self.login_alice()
+        bob, _ = self.login('bob')
+        bob.send({'type': 'private_message', 'to': 'alice', 'content': 'pm1'})
+        self.assertEqual(alice.wait_for('private_message')['delivery_seq'], 1)
+        self.disconnect(alice, bob)
+
+        # 没有确认 pm1，续连后重传
+        alice, response = self.resume(token, ack=0)
+        self.assertTrue(response['success'], response)
+        self.assertEqual(response['rooms'], ['dev'])
+        self.assertEqual(alice.wait_for('private_message')['content'], 'pm1')
+        self.assertTrue(self.server.rooms.is_member('dev', 'alice'))
+        self.assertIn('alice', self.server.clients)
+        self.assertEqual(bob.wait_for('user_joined')['username'], 'alice')
+
+    def test_acked_not_retransmitted(self):
+        alice, token = self.login_alice()
+        bob, _ = self.login('bob')
+        bob.send({'type': 'private_message', 'to': 'alice', 'content': 'pm1'})
+        alice.wait_for('private_message')
+        self.disconnect(alice, bob)
+        alice, response = self.resume(token, ack=1)
+        self.assertTrue(response['success'])
+        self.assertEqual(alice.collect('private_message'), [])
+
+    def test_token_single_use(self):
+        alice, token = self.login_alice()
+        bob, _ = self.login('bob')
+        self.disconnect(alice, bob)
+        _, response = self.resume(token)
+        self.assertTrue(response['success'])
+        _, response = self.resume(token)
+        self.assertFalse(response['success'])
+
+    def test_logout_revokes(self):
+        alice, token = self.login_alice()
+        bob, _ = self.login('bob')
+        alice.send({'type': 'logout'})
+        bob.wait_for('user_left', username='alice')
+        _, response = self.resume(token)
+        self.assertFalse(response['success'])
+
+
+class AsyncResumeTest(ThreadResumeTest):
+    mode = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import queue
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+
+from sharding import BusClient, BusHub, BusPresence
+
+TIMEOUT = 5
+
+
+class Worker:
+    """测试用 worker：只有总线连接和在线状态副本，收到的强制下线交给 on_kick 处理"""
+
+    def __init__(self, path, worker_id, on_kick):
+        self.kicks = queue.Queue()
+        self.on_kick = on_kick
+        self.bus = BusClient(path, worker_id, self.handle)
+        self.presence = BusPresence(self.bus)
+        self.bus.start()
+
+    def handle(self, message):
+        if message['op'] == 'kick':
+            self.kicks.put(self.on_kick(self, message['username']))
+
+    def claim_async(self, username):
+        """在后台线程中申请上线（申请会阻塞到总线中心应答）"""
+        future = Future()
+        threading.Thread(target=lambda: future.set_result(self.presence.set_online(username)),
+                         daemon=True).start()
+        return future
+
+
+def release(worker, username):
+    """本 worker 上没有进行中的登录：直接归还名额"""
+    worker.presence.set_offline(username)
+
+
+def defer(worker, username):
+    """与 ShardedServerMixin.kick 相同：有进行中的申请时记下，否则归还名额"""
+    if worker.presence.defer_kick(username):
+        return True
+    worker.presence.set_offline(username)
+    return False
+
+
+class BusPresenceTest(unittest.TestCase):
+    """总线中心裁决全局唯一登录：上线申请、强制下线与进行中申请的交接"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)  # BusHub 在当前目录创建聊天记录与离线队列
+        self.hub = BusHub(os.path.join(self.dir, 'bus.sock'))
+        self.hub.start()
+        self.workers = []
+
+    def tearDown(self):
+        self.hub.stop()
+        for worker in self.workers:
+            worker.bus.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def worker(self, worker_id, on_kick=release):
+        worker = Worker(self.hub.path, worker_id, on_kick)
+        self.workers.append(worker)
+        return worker
+
+    def owner(self, username, expected):
+        """等待总线中心把 username 记到 expected 名下"""
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            with self.hub.lock:
+                if self.hub.owners.get(username) == expected:
+                    return
+            time.sleep(0.01)
+        self.fail(f"{username} 的所在 worker 不是 {expected}：{self.hub.owners}")
+
+    def test_uncontended_claim(self):
+        first = self.worker(1)
+        self.assertTrue(first.presence.set_online('alice'))
+        self.owner('alice', 1)
+        # 同一 worker 上已在线时拒绝
+        self.assertFalse(first.presence.set_online('alice'))
+
+    def test_contended_claim_kicks_owner(self):
+        first = self.worker(1)
+        second = self.worker(2)
+        self.assertTrue(first.presence.set_online('alice'))
+        first.presence.settle('alice')
+
+        claim = second.claim_async('alice')
+        first.kicks.get(timeout=TIMEOUT)
+        self.assertTrue(claim.result(TIMEOUT))
+        self.owner('alice', 2)
+
+    def test_kick_during_claim_deferred(self):
+        """名额已授予但登录还没登记时收到强制下线：记下，登记时放弃并归还，等待的申请随后成功"""
+        first = self.worker(1)
+        second = self.worker(2, on_kick=defer)
+        self.assertTrue(second.presence.set_online('alice'))  # 还没有 settle
+
+        claim = first.claim_async('alice')
+        self.assertTrue(second.kicks.get(timeout=TIMEOUT))
+        self.assertFalse(claim.done())
+        self.owner('alice', 2)
+
+        self.assertTrue(second.presence.settle('alice'))
+        second.presence.set_offline('alice')
+        self.assertTrue(claim.result(TIMEOUT))
+        self.owner('alice', 1)
+
+    def test_kick_after_settle_releases(self):
+        first = self.worker(1)
+        second = self.worker(2, on_kick=defer)
+        self.assertTrue(second.presence.set_online('alice'))
+        self.assertFalse(second.presence.settle('alice'))
+
+        claim = first.claim_async('alice')
+        self.assertFalse(second.kicks.get(timeout=TIMEOUT))
+        self.assertTrue(claim.result(TIMEOUT))
+        self.owner('alice', 1)
+
+    def test_worker_exit_releases_users(self):
+        first = self.worker(1)
+        second = self.worker(2)
+        self.assertTrue(first.presence.set_online('alice'))
+        # 模拟 worker 进程退出（读线程还阻塞在 recv 上，只 close 不会发出 FIN）
+        first.bus.sock.shutdown(socket.SHUT_RDWR)
+        self.owner('alice', None)
+        self.assertTrue(second.presence.set_online('alice'))
+        self.owner('alice', 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
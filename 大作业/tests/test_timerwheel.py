@@ -0,0 +1,43 @@
+import unittest
+
+from timerwheel import TimerWheel
+
+
+def expire_ticks(wheel, ticks):
+    """转动 ticks 格，返回 {item: 第几格到期}"""
+    expired = {}
+    for tick in range(1, ticks + 1):
+        for item in wheel.advance():
+            expired[item] = tick
+    return expired
+
+
+class TimerWheelTest(unittest.TestCase):
+    def test_expiry_rounds_up_to_tick(self):
+        wheel = TimerWheel(tick=1.0, slots=8)
+        wheel.add('now', 0)
+        wheel.add('one', 1.0)
+        wheel.add('two', 1.2)
+        wheel.add('five', 5)
+        self.assertEqual(len(wheel), 4)
+        self.assertEqual(expire_ticks(wheel, 8), {'now': 1, 'one': 1, 'two': 2, 'five': 5})
+        self.assertEqual(len(wheel), 0)
+
+    def test_more_than_one_revolution(self):
+        """超过一圈的条目要多转几圈才到期"""
+        wheel = TimerWheel(tick=1.0, slots=4)
+        wheel.add('a', 3)
+        wheel.add('b', 7)
+        wheel.add('c', 11)
+        self.assertEqual(expire_ticks(wheel, 12), {'a': 3, 'b': 7, 'c': 11})
+
+    def test_added_after_advance(self):
+        """登记时按当前游标计算，而不是从第 0 格"""
+        wheel = TimerWheel(tick=0.5, slots=4)
+        expire_ticks(wheel, 3)
+        wheel.add('x', 1.0)
+        self.assertEqual(expire_ticks(wheel, 4), {'x': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from passwords import PasswordHasher, hash_password
+from storage import create_storage
+from user_manager import UserManager
+
+ITERATIONS = 1000  # 测试中降低迭代次数，哈希与格式检查不受影响
+
+
+class UserImportTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.hasher.shutdown()
+            manager.storage.close()
+        shutil.rmtree(self.dir)
+
+    def manager(self, backend='sqlite', name='users'):
+        path = os.path.join(self.dir, f'{name}.{"db" if backend == "sqlite" else "json"}')
+        manager = UserManager(create_storage(backend, path), hasher=PasswordHasher(iterations=ITERATIONS))
+        self.managers.append(manager)
+        return manager
+
+    def test_validation(self):
+        manager = self.manager()
+        manager.register('exists', '123456')
+        records = [
+            (1, {'username': 'alice', 'password': '123456'}),
+            (2, None),
+            (3, {'username': '', 'password': '123456'}),
+            (4, {'username': 'alice', 'password': '654321'}),
+            (5, {'username': 'exists', 'password': '123456'}),
+            (6, {'username': 'ab', 'password': '123456'}),
+            (7, {'username': 'shortpw', 'password': '123'}),
+            (8, {'username': 'badhash', 'password_hash': 'pbkdf2_sha256$x$00$00'}),
+            (9, {'username': 'hashed', 'password_hash': hash_password('secret1', ITERATIONS)}),
+        ]
+        imported, errors = manager.import_users(records, batch_size=1)
+        self.assertEqual(imported, 2)
+        self.assertEqual([(line, reason) for line, _, reason in errors], [
+            (2, "格式错误"),
+            (3, "用户名不能为空"),
+            (4, "用户名重复"),
+            (5, "用户名已存在"),
+            (6, "用户名长度应在3-20个字符之间"),
+            (7, "密码长度至少6位"),
+            (8, "密码哈希格式不正确"),
+        ])
+        self.assertEqual(manager.login('alice', '123456'), (True, "登录成功"))
+        self.assertEqual(manager.login('hashed', 'secret1'), (True, "登录成功"))
+
+    def test_overwrite(self):
+        manager = self.manager()
+        manager.register('alice', '123456')
+        imported, errors = manager.import_users([(1, {'username': 'alice', 'password': 'changed'})],
+                                                overwrite=True)
+        self.assertEqual((imported, errors), (1, []))
+        self.assertEqual(manager.login('alice', 'changed'), (True, "登录成功"))
+
+    def test_round_trip(self):
+        """导出再导入到另一个存储后，账号与密码哈希保持不变"""
+        source = self.manager('sqlite', 'source')
+        for i in range(5):
+            source.register(f'user{i}', f'password{i}')
+        for fmt in ('csv', 'jsonl'):
+            for backend in ('sqlite', 'json'):
+                path = os.path.join(self.dir, f'accounts.{fmt}')
+                self.assertEqual(source.export_file(path), 5)
+                target = self.manager(backend, f'{fmt}_{backend}')
+                imported, errors = target.import_file(path)
+                self.assertEqual((imported, errors), (5, []))
+                self.assertEqual(target.storage.load_all(), source.storage.load_all())
+                self.assertEqual(target.login('user3', 'password3'), (True, "登录成功"))
+
+
+if __name__ == '__main__':
+    unittest.main()
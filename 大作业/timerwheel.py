@@ -0,0 +1,37 @@
+import math
+import threading
+
+
+class TimerWheel:
+    """哈希时间轮：每个 tick 只处理当前槽里的条目，与登记的总数无关
+
+    超时时间超过一圈的条目记录剩余圈数，转到时减一。条目不支持取消，
+    到期后由调用方检查是否仍然有效（例如连接期间有活动就重新登记）。
+    """
+
+    def __init__(self, tick, slots):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def add(self, item, delay):
+        """登记 item，约 delay 秒后（向上取整到 tick）由 advance 返回"""
+        ticks = max(1, math.ceil(delay / self.tick))
+        rounds, offset = divmod(ticks - 1, len(self.slots))
+        with self.lock:
+            self.slots[(self.cursor + offset) % len(self.slots)].append([item, rounds])
+
+    def advance(self):
+        """转动一格，返回到期的条目"""
+        with self.lock:
+            slot = self.slots[self.cursor]
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            expired = [item for item, rounds in slot if rounds == 0]
+            remaining = [[item, rounds - 1] for item, rounds in slot if rounds > 0]
+            slot[:] = remaining
+        return expired
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(slot) for slot in self.slots)
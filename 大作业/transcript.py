@@ -0,0 +1,56 @@
+import sqlite3
+from config import CHAT_TRANSCRIPT_FILE
+
+
+class Transcript:
+    """客户端本地聊天记录（SQLite）
+
+    聊天框只保留最近的一部分消息，显示过的每一条都按顺序编号存在这里，
+    向上滚动超出聊天框的范围时按编号分批读回。path 为空字符串时 SQLite 使用临时文件，
+    数据在磁盘上而不占内存，关闭后自动删除。只在界面线程中使用。
+    """
+
+    def __init__(self, path=CHAT_TRANSCRIPT_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS transcript ("
+            " id INTEGER PRIMARY KEY,"
+            " text TEXT NOT NULL,"
+            " tag TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        (self.last_id,) = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM transcript").fetchone()
+
+    def append(self, lines):
+        """按顺序保存 [(text, tag), ...]，返回最后一条的编号"""
+        first = self.last_id + 1
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO transcript (id, text, tag) VALUES (?, ?, ?)",
+                ((first + i, text, tag) for i, (text, tag) in enumerate(lines))
+            )
+        self.last_id += len(lines)
+        return self.last_id
+
+    def before(self, row_id, limit):
+        """编号在 row_id 之前的最后 limit 条，按顺序返回 [(id, text, tag), ...]"""
+        rows = self.conn.execute(
+            "SELECT id, text, tag FROM transcript WHERE id < ? ORDER BY id DESC LIMIT ?", (row_id, limit)
+        ).fetchall()
+        rows.reverse()
+        return rows
+
+    def after(self, row_id, limit):
+        """编号在 row_id 之后的前 limit 条"""
+        return self.conn.execute(
+            "SELECT id, text, tag FROM transcript WHERE id > ? ORDER BY id LIMIT ?", (row_id, limit)
+        ).fetchall()
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM transcript")
+        self.last_id = 0
+
+    def close(self):
+        self.conn.close()
@@ -1,122 +1,363 @@
-import json
-import hashlib
+import asyncio
 import os
+import threading
+from collections import deque
+from concurrent.futures import Future
 from datetime import datetime
+from config import (USER_DATA_FILE, USER_STORAGE_BACKEND, USER_DB_FILE, IMPORT_BATCH_SIZE, USER_PAGE_SIZE,
+                    USER_SEARCH_LIMIT)
+from logger import get_logger
+from passwords import PasswordHasher, chain_future, hash_password, is_password_hash
+from presence import PresenceRegistry
+from storage import (SQLiteStorage, create_storage, dump_json_users, load_json_users, read_accounts,
+                     write_accounts)
+
+log = get_logger('users')
 
 
 class UserManager:
-    def __init__(self):
-        self.users_file = 'users.json'
+    def __init__(self, storage=None, presence=None, hasher=None):
+        self.users_file = USER_DATA_FILE
+        self.storage = storage or self.create_default_storage()
+        # 在线状态只在内存中维护，登录/登出不写盘
+        self.presence = presence or PresenceRegistry()
+        # 密码哈希/校验放到线程池或进程池中执行
+        self.hasher = hasher or PasswordHasher()
+        self.lock = threading.Lock()
         self.users = self.load_users()
 
+    def create_default_storage(self):
+        """按配置创建存储后端"""
+        if USER_STORAGE_BACKEND == 'json':
+            return create_storage('json', self.users_file)
+
+        storage = create_storage(USER_STORAGE_BACKEND, USER_DB_FILE)
+        # 首次使用数据库时导入已有的 users.json
+        if isinstance(storage, SQLiteStorage) and storage.is_empty() and os.path.exists(self.users_file):
+            try:
+                storage.save_all(load_json_users(self.users_file))
+                log.info("已导入用户数据", path=self.users_file)
+            except Exception as e:
+                log.error("导入用户数据失败", error=e)
+        return storage
+
     def load_users(self):
         """加载用户数据"""
-        if os.path.exists(self.users_file):
+        try:
+            return self.storage.load_all()
+        except Exception as e:
+            log.error("加载用户数据失败", error=e)
+            return {}
+
+    def get_user(self, username):
+        """取得用户信息；缓存中没有时回到存储查一次（其他 worker 进程可能刚注册）"""
+        info = self.users.get(username)
+        if info is None and username:
             try:
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                info = self.storage.load_user(username)
             except Exception as e:
-                print(f"加载用户数据失败: {e}")
-                return {}
-        return {}
+                log.error("读取用户数据失败", error=e)
+                return None
+            if info is not None:
+                self.users[username] = info
+        return info
 
     def save_users(self):
-        """保存用户数据"""
+        """整体保存用户数据"""
         try:
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(self.users, f, ensure_ascii=False, indent=2)
+            self.storage.save_all(self.users)
             return True
         except Exception as e:
-            print(f"保存用户数据失败: {e}")
+            log.error("保存用户数据失败", error=e)
             return False
 
+    def save_user(self, username):
+        """只保存单个用户的数据"""
+        try:
+            self.storage.save_user(username, self.users[username])
+            return True
+        except Exception as e:
+            log.error("保存用户数据失败", error=e)
+            return False
+
+    def import_json(self, path=None):
+        """从 users.json 格式的文件导入用户（同名用户覆盖），返回导入数量"""
+        users = load_json_users(path or self.users_file)
+        with self.lock:
+            self.storage.add_users(users, overwrite=True)
+            self.users.update(users)
+        return len(users)
+
+    def export_json(self, path=None):
+        """把所有用户导出为 users.json 格式"""
+        dump_json_users(self.users, path or self.users_file)
+
+    def import_users(self, records, overwrite=False, batch_size=IMPORT_BATCH_SIZE):
+        """批量导入账号，返回 (导入数量, 错误列表 [(行号, 用户名, 原因)])
+
+        records 逐条产出 (行号, 记录)，记录含 username 以及 password（明文）或 password_hash（已哈希）；
+        无法解析的行记录为 None。明文密码提交到密码池并行哈希，最多同时 batch_size 个任务；
+        全部校验、哈希完成后一次写入存储。
+        """
+        errors = []
+        accepted = {}  # username -> info
+        seen = set()
+        hashing = deque()  # (username, info, future)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        for line_no, record in records:
+            if not isinstance(record, dict):
+                errors.append((line_no, None, "格式错误"))
+                continue
+            username = str(record.get('username') or '').strip()
+            password = str(record.get('password') or '')
+            stored = str(record.get('password_hash') or '')
+            error = self.validate_import(username, password, stored, overwrite, seen)
+            if error:
+                errors.append((line_no, username, error))
+                continue
+
+            seen.add(username)
+            info = {
+                'password': stored,
+                'register_time': record.get('register_time') or now,
+                'last_login': record.get('last_login') or None
+            }
+            if stored:
+                accepted[username] = info
+                continue
+            hashing.append((username, info, self.hasher.submit_hash(password)))
+            while len(hashing) > batch_size:
+                username, info, future = hashing.popleft()
+                info['password'] = future.result()
+                accepted[username] = info
+
+        for username, info, future in hashing:
+            info['password'] = future.result()
+            accepted[username] = info
+
+        with self.lock:
+            written = self.storage.add_users(accepted, overwrite)
+            if written == len(accepted):
+                self.users.update(accepted)
+            else:
+                # 导入期间其他进程注册了同名用户，以存储中的数据为准
+                self.users = self.load_users()
+        log.info("批量导入账号", imported=written, errors=len(errors))
+        return written, errors
+
+    def validate_import(self, username, password, stored, overwrite, seen):
+        """检查一条导入记录，合法时返回 None"""
+        if not username:
+            return "用户名不能为空"
+        if username in seen:
+            return "用户名重复"
+        if not overwrite and self.get_user(username) is not None:
+            return "用户名已存在"
+        if stored:
+            if not is_password_hash(stored):
+                return "密码哈希格式不正确"
+            password = None
+        return self.validate_format(username, password)
+
+    def import_file(self, path, fmt=None, overwrite=False):
+        """从 CSV / JSONL 文件批量导入账号，返回值同 import_users"""
+        return self.import_users(read_accounts(path, fmt), overwrite)
+
+    def export_file(self, path, fmt=None):
+        """把所有账号导出为 CSV / JSONL（从存储分页读取、边读边写），返回导出数量"""
+        return write_accounts(self.storage.iter_users(), path, fmt)
+
     def hash_password(self, password):
-        """密码加密"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """密码加密（PBKDF2 加盐，在当前线程计算）"""
+        return hash_password(password, self.hasher.iterations)
 
-    def register(self, username, password):
-        """用户注册"""
+    def validate_register(self, username, password):
+        """检查注册信息，合法时返回 None"""
         if not username or not password:
-            return False, "用户名和密码不能为空"
+            return "用户名和密码不能为空"
 
-        if username in self.users:
-            return False, "用户名已存在"
+        if self.get_user(username) is not None:
+            return "用户名已存在"
+
+        return self.validate_format(username, password)
 
+    def validate_format(self, username, password):
+        """检查用户名与密码长度（password 为 None 时不检查密码），合法时返回 None"""
         if len(username) < 3 or len(username) > 20:
-            return False, "用户名长度应在3-20个字符之间"
+            return "用户名长度应在3-20个字符之间"
+
+        if password is not None and len(password) < 6:
+            return "密码长度至少6位"
+
+        return None
+
+    def begin_register(self, username, password):
+        """开始注册：哈希在池中计算，返回结果为 (是否成功, 消息) 的 Future"""
+        error = self.validate_register(username, password)
+        if error:
+            return completed_future((False, error))
 
-        if len(password) < 6:
-            return False, "密码长度至少6位"
+        return chain_future(self.hasher.submit_hash(password),
+                            lambda hashed: self.finish_register(username, hashed))
 
-        # 注册新用户
-        self.users[username] = {
-            'password': self.hash_password(password),
-            'online': False,
+    def finish_register(self, username, hashed):
+        """哈希完成后写入新用户"""
+        info = {
+            'password': hashed,
             'register_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'last_login': None
         }
+        with self.lock:
+            # 哈希期间可能已有同名用户注册（包括其他 worker 进程），由存储保证唯一
+            if username in self.users:
+                return False, "用户名已存在"
+            try:
+                added = self.storage.add_user(username, info)
+            except Exception as e:
+                log.error("保存用户数据失败", error=e)
+                return False, "注册失败，请重试"
+            if not added:
+                return False, "用户名已存在"
+            self.users[username] = info
 
-        if self.save_users():
-            return True, "注册成功"
-        else:
-            return False, "注册失败，请重试"
+        return True, "注册成功"
 
-    def login(self, username, password):
-        """用户登录"""
+    def register(self, username, password):
+        """用户注册"""
+        return self.begin_register(username, password).result()
+
+    def begin_login(self, username, password):
+        """开始登录：密码校验在池中执行，返回结果为 (是否成功, 消息) 的 Future"""
         if not username or not password:
-            return False, "用户名和密码不能为空"
+            return completed_future((False, "用户名和密码不能为空"))
 
-        if username not in self.users:
-            return False, "用户不存在"
+        user = self.get_user(username)
+        if user is None:
+            return completed_future((False, "用户不存在"))
+
+        stored = user['password']
+        return chain_future(self.hasher.submit_verify(password, stored),
+                            lambda result: self.finish_login(username, *result))
 
-        if self.users[username]['password'] != self.hash_password(password):
+    def finish_login(self, username, ok, new_hash):
+        """校验完成后更新登录状态；旧格式密码顺便升级为新哈希"""
+        if not ok:
             return False, "密码错误"
 
-        if self.users[username]['online']:
+        if username not in self.users:
+            return False, "用户不存在"
+
+        if not self.presence.set_online(username):
             return False, "用户已在线，不能重复登录"
 
-        # 更新用户状态
-        self.users[username]['online'] = True
-        self.users[username]['last_login'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.save_users()
+        # 更新用户状态（在密码池线程中执行，与注册、导入同样持有 self.lock）
+        with self.lock:
+            info = self.users.get(username)
+            if info is not None:
+                if new_hash:
+                    info['password'] = new_hash
+                info['last_login'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.save_user(username)
 
         return True, "登录成功"
 
+    def begin_resume(self, username):
+        """续连：不校验密码、不写存储，只恢复在线状态；返回 (是否成功, 消息) 的 Future"""
+        if self.get_user(username) is None:
+            return completed_future((False, "用户不存在"))
+        return chain_future(self.presence.begin_set_online(username),
+                            lambda ok: (True, "会话已恢复") if ok else (False, "用户已在线，不能重复登录"))
+
+    def login(self, username, password):
+        """用户登录"""
+        return self.begin_login(username, password).result()
+
+    async def login_async(self, username, password):
+        """用户登录（协程接口）"""
+        return await asyncio.wrap_future(self.begin_login(username, password))
+
+    async def register_async(self, username, password):
+        """用户注册（协程接口）"""
+        return await asyncio.wrap_future(self.begin_register(username, password))
+
     def logout(self, username):
         """用户登出"""
         if username in self.users:
-            self.users[username]['online'] = False
-            self.save_users()
+            self.presence.set_offline(username)
             return True
         return False
 
     def force_logout(self, username):
         """强制用户下线（用于清理异常状态）"""
         if username in self.users:
-            self.users[username]['online'] = False
-            self.save_users()
+            self.presence.set_offline(username)
             return True
         return False
 
+    def reset_online(self):
+        """清空所有用户的在线状态"""
+        self.presence.reset()
+
     def is_online(self, username):
         """检查用户是否在线"""
-        return username in self.users and self.users[username].get('online', False)
+        return self.presence.is_online(username)
 
     def get_online_users(self):
-        """获取在线用户列表"""
-        return [username for username, info in self.users.items() if info.get('online', False)]
+        """获取在线用户列表（复制全部在线用户名，只需部分时用 list_online）"""
+        return self.presence.get_online_users()
 
     def get_all_users(self):
-        """获取所有用户"""
+        """获取所有用户（复制全部用户名，只需部分时用 list_users / iter_users）"""
         return list(self.users.keys())
 
+    def count_users(self):
+        """注册用户数（由存储统计，包括其他 worker 进程注册的用户）"""
+        return self.storage.count_users()
+
+    def count_online(self):
+        """在线用户数"""
+        return self.presence.count()
+
+    def iter_users(self):
+        """按用户名顺序逐个产出用户名，从存储分页读取"""
+        for username, _ in self.storage.iter_users():
+            yield username
+
+    def list_users(self, after=None, limit=USER_PAGE_SIZE):
+        """分页列出用户名：返回排在 after（上一页最后一个）之后的最多 limit 个"""
+        return self.storage.page_users(after, limit)
+
+    def list_online(self, after=None, limit=USER_PAGE_SIZE):
+        """分页列出在线用户名（按用户名排序）"""
+        return self.presence.page(after, limit)
+
+    def search_users(self, prefix, limit=USER_SEARCH_LIMIT, online_only=False):
+        """按用户名前缀查找用户，返回有序的用户名"""
+        if online_only:
+            return self.presence.search(prefix, limit)
+        return self.storage.search_users(prefix, limit)
+
     def user_exists(self, username):
         """检查用户是否存在"""
-        return username in self.users
+        return self.get_user(username) is not None
 
     def delete_user(self, username):
         """删除用户"""
         if username in self.users:
             del self.users[username]
-            return self.save_users()
-        return False
\ No newline at end of file
+            self.presence.set_offline(username)
+            try:
+                self.storage.delete_user(username)
+                return True
+            except Exception as e:
+                log.error("删除用户数据失败", error=e)
+                return False
+        return False
+
+
+def completed_future(result):
+    """返回已完成的 Future"""
+    future = Future()
+    future.set_result(result)
+    return future